@@ -1,54 +1,87 @@
 import os
+import heapq
 import itertools
 import operator
+import re
 from collections import deque, namedtuple
+import stat
 import string
 
 from . import diff
 from . import data
+from . import ignore
 
-def init ():
-    """Initialize a new PyGit repository with required directories and HEAD reference."""
+def init (object_format=data.DEFAULT_OBJECT_FORMAT):
+    """
+    Initialize a new PyGit repository with required directories and HEAD reference.
+
+    Args:
+        object_format: Object store layout, one of data.OBJECT_FORMATS
+    """
+    assert object_format in data.OBJECT_FORMATS, f'Unknown object format {object_format}'
     print("Creating .pygit directory...")  # Debug print
     if not os.path.exists(data.GIT_DIR):
         os.makedirs(data.GIT_DIR)
         os.makedirs(f'{data.GIT_DIR}/objects', exist_ok=True)
+        data.set_config ('object_format', object_format)
     print("Setting up HEAD reference...")  # Debug print
     data.update_ref ('HEAD', data.RefValue (symbolic=True, value='refs/heads/master'))
 
 
 def write_tree ():
-    """Create a tree object from current index and return its OID."""
-    # Index is flat, we need it as a tree of dicts
-    index_as_tree = {}
+    """
+    Create a tree object from current index and return its OID.
+
+    Directories whose tree oid is cached in the index are reused as they
+    are, so only the directories containing changed entries, and their
+    parents, are serialized and hashed again.
+    """
     with data.get_index () as index:
-        for path, oid in index.items ():
-            path = path.split ('/')
-            dirpath, filename = path[:-1], path[-1]
-
-            current = index_as_tree
-            # Find the dict for the directory of this file
-            for dirname in dirpath:
-                current = current.setdefault (dirname, {})
-            current[filename] = oid
-
-    def write_tree_recursive (tree_dict):
-        entries = []
-        for name, value in tree_dict.items ():
-            if type (value) is dict:
-                type_ = 'tree'
-                oid = write_tree_recursive (value)
-            else:
-                type_ = 'blob'
-                oid = value
-            entries.append ((name, oid, type_))
+        trees = index.trees
+        if '' in trees:
+            return trees['']
 
-        tree = ''.join (f'{type_} {oid} {name}\n'
-                        for name, oid, type_
-                        in sorted (entries))
-        return data.hash_object (tree.encode (), 'tree')
+        # Entries of the directories whose tree has to be written. Changes
+        # invalidate every directory above them, so these always include
+        # the parents of each directory written.
+        children = {'': []}
 
-    return write_tree_recursive (index_as_tree)
+        def register (dirpath):
+            while dirpath not in children:
+                children[dirpath] = []
+                dirpath = dirpath.rpartition ('/')[0]
+
+        for path, oid in index.items ():
+            dirpath, _, name = path.rpartition ('/')
+            if dirpath in trees:
+                continue
+            register (dirpath)
+            children[dirpath].append ((name, oid, 'blob'))
+        for dirpath in trees:
+            parent = dirpath.rpartition ('/')[0]
+            if dirpath and parent not in trees:
+                register (parent)
+
+        # Subtrees, either written below or reused from the cache
+        for dirpath in itertools.chain (list (children), trees):
+            parent, _, name = dirpath.rpartition ('/')
+            if dirpath and parent in children:
+                children[parent].append ((name, dirpath, 'tree'))
+
+        # Deepest directories first, so subtree oids are known
+        for dirpath in sorted (children, key=lambda d: d.count ('/') + bool (d),
+                               reverse=True):
+            entries = []
+            for name, value, type_ in children[dirpath]:
+                oid = trees[value] if type_ == 'tree' else value
+                entries.append ((name, oid, type_))
+
+            tree = ''.join (f'{type_} {oid} {name}\n'
+                            for name, oid, type_
+                            in sorted (entries))
+            index.set_tree (dirpath, data.hash_object (tree.encode (), 'tree'))
+
+        return trees['']
 
 def _iter_tree_entries (oid):
     """
@@ -62,10 +95,13 @@ def _iter_tree_entries (oid):
     """
     if not oid:
         return
-    tree = data.get_object (oid, 'tree')
-    for entry in tree.decode ().splitlines ():
-        type_, oid, name = entry.split (' ', 2)
-        yield type_, oid, name
+    entries = data.parsed_cache.get (('tree', oid))
+    if entries is None:
+        tree = data.get_object (oid, 'tree')
+        entries = tuple (tuple (entry.split (' ', 2))
+                         for entry in tree.decode ().splitlines ())
+        data.parsed_cache.put (('tree', oid), entries, len (tree))
+    yield from entries
 
 
 def get_tree (oid, base_path=''):
@@ -92,60 +128,279 @@ def get_tree (oid, base_path=''):
             assert False, f'Unknown tree entry {type_}'
     return result
 
+def iter_tree_changes (*oids, base_path=''):
+    """
+    Walk trees together and yield the blobs that differ between them.
+
+    Subtrees whose oid is the same in every tree are skipped without being
+    read, and changes are yielded as they are found instead of after both
+    trees have been flattened.
+
+    Args:
+        oids: Tree OIDs to compare, None for a missing tree
+        base_path: Base path prefix for yielded paths
+
+    Yields:
+        tuple: (path, *oids) for every path whose blob oids aren't all
+            equal, with None where a tree doesn't have the blob
+    """
+    if len (set (oids)) <= 1:
+        return
+    blobs = {}
+    trees = {}
+    for i, oid in enumerate (oids):
+        for type_, entry_oid, name in _iter_tree_entries (oid):
+            assert '/' not in name
+            assert name not in ('..', '.')
+            if type_ == 'blob':
+                entries = blobs
+            elif type_ == 'tree':
+                entries = trees
+            else:
+                assert False, f'Unknown tree entry {type_}'
+            entries.setdefault (name, [None] * len (oids))[i] = entry_oid
+
+    for name in sorted (blobs.keys () | trees.keys ()):
+        entry_oids = blobs.get (name)
+        if entry_oids and len (set (entry_oids)) > 1:
+            yield (base_path + name, *entry_oids)
+        if name in trees:
+            yield from iter_tree_changes (*trees[name],
+                                          base_path=f'{base_path}{name}/')
+
 def get_working_tree ():
-    """Get dictionary of paths and OIDs for current working directory."""
+    """
+    Get dictionary of paths and OIDs for current working directory.
+
+    Files whose stat data matches their index entry reuse the indexed oid
+    instead of being read and hashed again; the others are hashed in
+    parallel.
+    """
     result = {}
-    for root, _, filenames in os.walk ('.'):
-        for filename in filenames:
-            path = os.path.relpath (f'{root}/{filename}')
-            if is_ignored (path) or not os.path.isfile (path):
-                continue
-            with open (path, 'rb') as f:
-                result[path] = data.hash_object (f.read ())
+    to_hash = []
+    with data.get_index () as index:
+        for root, _, filenames in ignore.walk ('.'):
+            for filename in filenames:
+                path = os.path.relpath (f'{root}/{filename}')
+                try:
+                    st = os.stat (path)
+                except FileNotFoundError:
+                    continue
+                if not stat.S_ISREG (st.st_mode):
+                    continue
+                if index.is_fresh (path, st):
+                    result[path] = index[path]
+                    continue
+                result[path] = None
+                to_hash.append ((path, st))
+
+        oids = data.hash_files ([path for path, _ in to_hash],
+                                [st.st_size for _, st in to_hash])
+        for (path, st), oid in zip (to_hash, oids):
+            result[path] = oid
+            # Refresh stat data of entries that turned out to be unchanged
+            if index.get (path) == oid:
+                index.set_stat (path, st)
     return result
 
 def get_index_tree ():
     """Get dictionary of paths and OIDs from current index."""
     with data.get_index () as index:
-        return index
+        return dict (index)
+
+
+def _set_index (index, tree):
+    """
+    Make the index match tree, keeping the stat data of unchanged entries.
+
+    Args:
+        index: Index to update
+        tree: Dictionary mapping paths to OIDs
+    """
+    for path in [path for path in index if path not in tree]:
+        del index[path]
+    for path, oid in tree.items ():
+        index[path] = oid
 
 
-def _empty_current_directory ():
-    """Remove all tracked files from working directory."""
-    for root, dirnames, filenames in os.walk ('.', topdown=False):
+class CheckoutConflictError (Exception):
+    """A checkout would overwrite local changes or untracked files."""
+
+    def __init__ (self, conflicts):
+        super ().__init__ ('\n'.join (conflicts +
+                                       ['Commit or remove them before switching']))
+        self.conflicts = conflicts
+
+
+def _holds_only (dirpath, paths):
+    """Check whether every file below dirpath is one of paths."""
+    for root, _, filenames in os.walk (dirpath):
         for filename in filenames:
-            path = os.path.relpath (f'{root}/{filename}')
-            if is_ignored (path) or not os.path.isfile (path):
+            path = os.path.relpath (os.path.join (root, filename)).replace ('\\', '/')
+            if path not in paths:
+                return False
+    return True
+
+
+def _find_checkout_conflicts (index, tree):
+    """
+    Find local changes a checkout from index to tree would clobber.
+
+    A path the checkout changes must be staged as in HEAD. A tracked file is
+    only dirty if its stat data is stale and its content no longer hashes to
+    the indexed oid. An untracked file is only in the way if it isn't
+    ignored and differs from what would be written there, or if it stands
+    where a directory is needed. A directory where a file goes is only in
+    the way if it holds anything besides tracked files being removed.
+
+    Returns:
+        list: Error messages, empty if the checkout is safe
+    """
+    changed = sorted (set (index).symmetric_difference (tree) |
+                      {path for path, oid in tree.items ()
+                       if index.get (path, oid) != oid})
+    if not changed:
+        return []
+    removed = {path for path in index if path not in tree}
+    HEAD = data.get_ref ('HEAD').value
+    head_tree = get_tree (get_commit (HEAD).tree) if HEAD else {}
+
+    conflicts = []
+    to_hash = []
+    for path in changed:
+        if index.get (path) != head_tree.get (path):
+            conflicts.append (f'Staged changes to {path} would be overwritten')
+            continue
+        try:
+            st = os.stat (path)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        if path not in index:
+            if stat.S_ISDIR (st.st_mode):
+                if not _holds_only (path, removed):
+                    conflicts.append (f'Untracked working tree path {path} would be overwritten')
                 continue
-            os.remove (path)
-        for dirname in dirnames:
-            path = os.path.relpath (f'{root}/{dirname}')
-            if is_ignored (path):
+            if ignore.is_ignored (path):
                 continue
-            try:
-                os.rmdir (path)
-            except (FileNotFoundError, OSError):
-                pass
+            if not stat.S_ISREG (st.st_mode):
+                conflicts.append (f'Untracked working tree path {path} would be overwritten')
+                continue
+            to_hash.append ((path, st, tree[path]))
+        elif not stat.S_ISREG (st.st_mode):
+            conflicts.append (f'Local changes to {path} would be overwritten')
+        elif not index.is_fresh (path, st):
+            to_hash.append ((path, st, index[path]))
+
+    # Untracked files standing where the directories of new files go
+    checked = set ()
+    for path in changed:
+        if path not in tree:
+            continue
+        parts = path.split ('/')
+        for i in range (1, len (parts)):
+            prefix = '/'.join (parts[:i])
+            if prefix in checked:
+                continue
+            checked.add (prefix)
+            if prefix in removed or os.path.isdir (prefix):
+                continue
+            if os.path.lexists (prefix) and not ignore.is_ignored (prefix):
+                conflicts.append (f'Untracked working tree file {prefix} would be overwritten')
+            break
+
+    oids = data.hash_files ([path for path, _, _ in to_hash],
+                            [st.st_size for _, st, _ in to_hash])
+    for (path, st, expected), oid in zip (to_hash, oids):
+        if oid == expected:
+            if path in index:
+                index.set_stat (path, st)
+        elif path in index:
+            conflicts.append (f'Local changes to {path} would be overwritten')
+        else:
+            conflicts.append (f'Untracked working tree file {path} would be overwritten')
+    return conflicts
+
+
+def _checkout_index (index, tree):
+    """
+    Update index and working directory from the index's contents to tree.
+
+    Only paths whose oid differs between the index and tree are written or
+    removed; everything else, including local changes to those paths, is
+    left alone.
+
+    Args:
+        index: Index describing the current working directory
+        tree: Dictionary mapping paths to OIDs to check out
+
+    Raises:
+        CheckoutConflictError: If staged or local changes or untracked files
+            would be overwritten, in which case nothing is modified
+    """
+    conflicts = _find_checkout_conflicts (index, tree)
+    if conflicts:
+        raise CheckoutConflictError (conflicts)
+
+    # Removals go first, so directories are gone before files replace them
+    removed = [path for path in index if path not in tree]
+    for path in removed:
+        del index[path]
+        try:
+            os.remove (path)
+        except FileNotFoundError:
+            continue
+        # Remove directories left empty, deepest first
+        try:
+            os.removedirs (os.path.dirname (path))
+        except OSError:
+            pass
+
+    for path, oid in tree.items ():
+        if index.get (path) == oid:
+            continue
+        if os.path.isdir (path):
+            # Only empty directories are left where the file goes
+            for root, _, _ in os.walk (path, topdown=False):
+                os.rmdir (root)
+        dir_path = os.path.dirname (path)
+        if dir_path and not os.path.isdir (dir_path):
+            # Ignored files may stand where directories go
+            parts = dir_path.split ('/')
+            for i in range (1, len (parts) + 1):
+                prefix = '/'.join (parts[:i])
+                if os.path.lexists (prefix) and not os.path.isdir (prefix):
+                    os.remove (prefix)
+            os.makedirs (dir_path, exist_ok=True)
+        with open (path, 'wb') as f:
+            data.copy_object (oid, f)
+        index[path] = oid
+        index.set_stat (path, os.stat (path))
+
 
 def read_tree (tree_oid, update_working=False):
-    """Read a tree into the index and optionally update working directory"""
+    """
+    Read a tree into the index and optionally update working directory.
+
+    Args:
+        tree_oid: OID of the tree to read
+        update_working: Whether to update the working directory, touching
+            only the paths that differ from the current index
+    """
+    tree = get_tree (tree_oid, base_path='')
     with data.get_index () as index:
-        index.clear ()
-        for path, oid in get_tree (tree_oid, base_path='').items ():
-            index[path] = oid
-            if update_working:
-                # Skip if path is empty
-                if not path:
-                    continue
-                    
-                # Create directory if needed
-                dir_path = os.path.dirname(path)
-                if dir_path:  # Only create directory if path is not empty
-                    os.makedirs(dir_path, exist_ok=True)
-                    
-                # Write file contents
-                with open(path, 'wb') as f:
-                    f.write(data.get_object(oid))
+        if update_working:
+            _checkout_index (index, tree)
+        else:
+            _set_index (index, tree)
+        _cache_trees (index, tree_oid)
+
+
+def _cache_trees (index, tree_oid, dirpath=''):
+    """Record the oids of a tree and its subtrees in the index cache-tree."""
+    index.set_tree (dirpath, tree_oid)
+    for type_, oid, name in _iter_tree_entries (tree_oid):
+        if type_ == 'tree':
+            _cache_trees (index, oid, f'{dirpath}/{name}' if dirpath else name)
 
 
 def read_tree_merged (t_base, t_HEAD, t_other, update_working=False):
@@ -158,29 +413,12 @@ def read_tree_merged (t_base, t_HEAD, t_other, update_working=False):
         t_other: Other tree OID
         update_working: Whether to update working directory
     """
+    merged = diff.merge_trees (t_base, t_HEAD, t_other)
     with data.get_index () as index:
-        index.clear ()
-        index.update (diff.merge_trees (
-            get_tree (t_base),
-            get_tree (t_HEAD),
-            get_tree (t_other)
-        ))
-
         if update_working:
-            _checkout_index (index)
-
-def _checkout_index (index):
-    """
-    Update working directory to match index.
-    
-    Args:
-        index: Dictionary mapping paths to OIDs
-    """
-    _empty_current_directory ()
-    for path, oid in index.items ():
-        os.makedirs (os.path.dirname (f'./{path}'), exist_ok=True)
-        with open (path, 'wb') as f:
-            f.write (data.get_object (oid, 'blob'))
+            _checkout_index (index, merged)
+        else:
+            _set_index (index, merged)
 
 def commit (message):
     """
@@ -207,11 +445,54 @@ def commit (message):
 
     oid = data.hash_object (commit.encode (), 'commit')
 
-    data.update_ref ('HEAD', data.RefValue (symbolic=False, value=oid))
+    # Fail rather than drop a commit made concurrently on the same branch
+    data.update_ref ('HEAD', data.RefValue (symbolic=False, value=oid),
+                     old_value=HEAD or '')
+    _update_commit_graph (oid)
 
     return oid
 
 
+def _update_commit_graph (oid):
+    """
+    Add a new commit, and any of its ancestors missing from the commit
+    graph, as a new commit-graph layer.
+
+    Repositories without a commit graph only get one started by a root
+    commit; older histories need write_commit_graph first.
+    """
+    graph = data.get_commit_graph ()
+    if graph is None and get_commit (oid).parents:
+        return
+
+    commits = {}
+    pending = [oid]
+    while pending:
+        oid = pending.pop ()
+        if oid in commits or (graph is not None and oid in graph):
+            continue
+        commit = get_commit (oid)
+        commits[oid] = (commit.tree, commit.parents)
+        pending.extend (commit.parents)
+    data.write_commit_graph (commits)
+
+
+def write_commit_graph ():
+    """
+    Write a commit graph covering all commits reachable from refs.
+
+    Returns:
+        int: Number of commits in the graph
+    """
+    commits = {}
+    oids = {ref.value for _, ref in data.iter_refs ()}
+    for oid in iter_commits_and_parents (oids):
+        commit = get_commit (oid)
+        commits[oid] = (commit.tree, commit.parents)
+    data.write_commit_graph (commits, incremental=False)
+    return len (commits)
+
+
 def checkout (name):
     """
     Switch to specified branch or commit.
@@ -268,6 +549,138 @@ def merge (other):
 
 
 
+# Flags used while painting history in _paint_down_to_common
+_PARENT1 = 1
+_PARENT2 = 2
+_STALE = 4
+
+
+# Generation numbers computed so far. A commit's generation is fixed by its
+# content, so entries never go stale, and unlike the byte-bounded
+# parsed_cache they are never evicted, which the walks below rely on.
+_generations = {}
+
+
+def get_generation (oid):
+    """
+    Get the generation number of a commit: 1 for root commits, otherwise
+    one more than the largest generation of its parents.
+
+    Read from the commit graph when it covers the commit, otherwise computed
+    by walking the parents down to covered commits and cached.
+    """
+    generation = _generations.get (oid)
+    if generation is not None:
+        return generation
+    graph = data.get_commit_graph ()
+    pending = [oid]
+    while pending:
+        current = pending[-1]
+        if current in _generations:
+            pending.pop ()
+            continue
+        generation = graph.generation (current) if graph is not None else None
+        if generation is None:
+            parents = get_parents (current)
+            missing = [p for p in parents if p not in _generations]
+            if missing:
+                pending.extend (missing)
+                continue
+            generation = 1 + max ((_generations[p] for p in parents), default=0)
+        _generations[current] = generation
+        pending.pop ()
+    return _generations[oid]
+
+
+def _paint_down_to_common (one, twos):
+    """
+    Find the common ancestors of one and twos that aren't ancestors of
+    other common ancestors found on the way.
+
+    History is walked from both sides at once, highest generation first, so
+    every commit is seen before its ancestors. A commit reached from both
+    sides is a candidate and its ancestors are marked stale; the walk stops
+    as soon as only stale commits are left to visit.
+    """
+    flags = {one: _PARENT1}
+    for two in twos:
+        flags[two] = flags.get (two, 0) | _PARENT2
+
+    queue = []
+    nonstale = set ()
+    counter = itertools.count ()
+    for oid in flags:
+        heapq.heappush (queue, (-get_generation (oid), next (counter), oid))
+        nonstale.add (oid)
+
+    results = []
+    while nonstale:
+        _, _, oid = heapq.heappop (queue)
+        nonstale.discard (oid)
+        oid_flags = flags[oid]
+        if oid_flags & (_PARENT1 | _PARENT2 | _STALE) == _PARENT1 | _PARENT2:
+            results.append (oid)
+            oid_flags |= _STALE
+        for parent in get_parents (oid):
+            parent_flags = flags.get (parent)
+            if parent_flags is not None and parent_flags & oid_flags == oid_flags:
+                continue
+            if parent_flags is None:
+                heapq.heappush (queue, (-get_generation (parent),
+                                        next (counter), parent))
+                nonstale.add (parent)
+                parent_flags = 0
+            parent_flags |= oid_flags
+            flags[parent] = parent_flags
+            if parent_flags & _STALE:
+                nonstale.discard (parent)
+
+    # Candidates reached from another candidate are ancestors of it
+    return [oid for oid in results if not flags[oid] & _STALE]
+
+
+def _remove_redundant (oids):
+    """Drop commits that are ancestors of other commits in oids."""
+    oids = list (dict.fromkeys (oids))
+    return [oid for oid in oids
+            if not any (other != oid and is_ancestor_of (other, oid)
+                        for other in oids)]
+
+
+def get_merge_bases (one, *twos):
+    """
+    Find the best common ancestors of one and all of twos.
+
+    A commit is a merge base if it is an ancestor of one and of at least one
+    of twos, and no other such commit descends from it.
+
+    Returns:
+        list: Merge base OIDs, highest generation first
+    """
+    bases = _remove_redundant (_paint_down_to_common (one, twos))
+    return sorted (bases, key=get_generation, reverse=True)
+
+
+def get_octopus_merge_bases (oids):
+    """
+    Find the best common ancestors of all given commits.
+
+    Args:
+        oids: Commit OIDs
+
+    Returns:
+        list: OIDs of commits that are ancestors of every commit in oids
+    """
+    oids = list (oids)
+    bases = oids[:1]
+    for oid in oids[1:]:
+        new_bases = []
+        for base_oid in bases:
+            new_bases.extend (get_merge_bases (base_oid, oid))
+        bases = _remove_redundant (new_bases)
+    return sorted (bases, key=get_generation, reverse=True)
+
+
 def get_merge_base (oid1, oid2):
     """
     Find most recent common ancestor of two commits.
@@ -277,17 +690,17 @@ def get_merge_base (oid1, oid2):
         oid2: Second commit OID
         
     Returns:
-        str: OID of merge base commit
+        str: OID of merge base commit, or None if the histories are unrelated
     """
-    parents1 = set (iter_commits_and_parents ({oid1}))
-
-    for oid in iter_commits_and_parents ({oid2}):
-        if oid in parents1:
-            return oid
+    bases = get_merge_bases (oid1, oid2)
+    return bases[0] if bases else None
 
 def is_ancestor_of (commit, maybe_ancestor):
     """
     Check if one commit is ancestor of another.
+
+    Generation numbers decrease along parent links, so the walk never
+    descends below the generation of maybe_ancestor.
     
     Args:
         commit: Potential descendant commit OID
@@ -296,7 +709,25 @@ def is_ancestor_of (commit, maybe_ancestor):
     Returns:
         bool: True if maybe_ancestor is ancestor of commit
     """
-    return maybe_ancestor in iter_commits_and_parents ({commit})
+    if not commit or not maybe_ancestor:
+        return False
+    if commit == maybe_ancestor:
+        return True
+    min_generation = get_generation (maybe_ancestor)
+
+    queue = [(-get_generation (commit), commit)]
+    visited = {commit}
+    while queue:
+        neg_generation, oid = heapq.heappop (queue)
+        if oid == maybe_ancestor:
+            return True
+        if -neg_generation <= min_generation:
+            continue
+        for parent in get_parents (oid):
+            if parent not in visited:
+                visited.add (parent)
+                heapq.heappush (queue, (-get_generation (parent), parent))
+    return False
 
 def create_tag (name, oid):
     """
@@ -361,6 +792,11 @@ Commit = namedtuple ('Commit', ['tree', 'parents', 'message'])
 
 def get_commit (oid):
     """Get commit object by OID and return Commit namedtuple."""
+    # The cached Commit is shared by every caller, so it is immutable
+    cached = data.parsed_cache.get (('commit', oid))
+    if cached is not None:
+        return cached
+
     parents = []
     commit = data.get_object (oid, 'commit').decode ()
     lines = iter (commit.splitlines ())
@@ -374,7 +810,26 @@ def get_commit (oid):
             assert False, f'Unknown field {key}'
 
     message = '\n'.join (lines)
-    return Commit (tree=tree, parents=parents, message=message)
+    result = Commit (tree=tree, parents=tuple (parents), message=message)
+    data.parsed_cache.put (('commit', oid), result, len (commit))
+    return result
+
+def get_parents (oid):
+    """
+    Get the parent OIDs of a commit, from the commit graph if it covers it.
+
+    Args:
+        oid: Commit OID
+
+    Returns:
+        tuple: Parent OIDs, first parent first
+    """
+    graph = data.get_commit_graph ()
+    if graph is not None:
+        parents = graph.parents (oid)
+        if parents is not None:
+            return tuple (parents)
+    return get_commit (oid).parents
 
 def iter_commits_and_parents (oids):
     """
@@ -396,11 +851,100 @@ def iter_commits_and_parents (oids):
         visited.add (oid)
         yield oid
 
-        commit = get_commit (oid)
+        parents = get_parents (oid)
         # Return first parent next
-        oids.extendleft (commit.parents[:1])
+        oids.extendleft (parents[:1])
         # Return other parents later
-        oids.extend (commit.parents[1:])
+        oids.extend (parents[1:])
+
+def parse_revisions (revisions):
+    """
+    Split revision arguments into the commits to include and exclude.
+
+    Supported forms, as in git:
+    - 'A': commits reachable from A
+    - '^A': exclude commits reachable from A
+    - 'A..B': reachable from B but not from A
+    - 'A...B': reachable from either A or B but not both
+    - '--not': flip between including and excluding for the arguments
+      that follow
+    An empty side of a range means HEAD.
+
+    Returns:
+        tuple: (include, exclude) lists of commit OIDs
+    """
+    include = []
+    exclude = []
+    negate = False
+    for revision in revisions:
+        if revision == '--not':
+            negate = not negate
+            continue
+        wanted, unwanted = (exclude, include) if negate else (include, exclude)
+        if '...' in revision:
+            left, right = revision.split ('...', 1)
+            left = get_oid (left or '@')
+            right = get_oid (right or '@')
+            wanted.extend ((left, right))
+            unwanted.extend (get_merge_bases (left, right))
+        elif '..' in revision:
+            left, right = revision.split ('..', 1)
+            unwanted.append (get_oid (left or '@'))
+            wanted.append (get_oid (right or '@'))
+        elif revision.startswith ('^'):
+            unwanted.append (get_oid (revision[1:]))
+        else:
+            wanted.append (get_oid (revision))
+    return include, exclude
+
+
+def iter_commits_in_range (include, exclude=()):
+    """
+    Iterate through the commits reachable from include but not from exclude.
+
+    Both ends are walked in a single pass, highest generation first, so a
+    commit is only visited after all of its descendants in the walk and it
+    is known by then whether an excluded commit reaches it. Exclusion is
+    passed on to parents, and the walk stops as soon as only excluded
+    commits are left, so history below the range isn't read.
+
+    Args:
+        include: Commit OIDs whose ancestors are listed
+        exclude: Commit OIDs whose ancestors are left out
+
+    Yields:
+        str: OID of each commit in the range, highest generation first
+    """
+    # Commit -> whether it is excluded
+    excluded = {oid: True for oid in exclude}
+    for oid in include:
+        excluded.setdefault (oid, False)
+
+    queue = []
+    counter = itertools.count ()
+    wanted = set ()
+    for oid, is_excluded in excluded.items ():
+        heapq.heappush (queue, (-get_generation (oid), next (counter), oid))
+        if not is_excluded:
+            wanted.add (oid)
+
+    while wanted:
+        _, _, oid = heapq.heappop (queue)
+        wanted.discard (oid)
+        is_excluded = excluded[oid]
+        if not is_excluded:
+            yield oid
+        for parent in get_parents (oid):
+            if parent not in excluded:
+                heapq.heappush (queue, (-get_generation (parent),
+                                        next (counter), parent))
+            elif excluded[parent] or not is_excluded:
+                continue
+            excluded[parent] = is_excluded
+            if is_excluded:
+                wanted.discard (parent)
+            else:
+                wanted.add (parent)
 
 def iter_objects_in_commits (oids):
     """
@@ -431,7 +975,83 @@ def iter_objects_in_commits (oids):
             yield from iter_objects_in_tree (commit.tree)
 
 
+def iter_objects_in_trees (oids, exclude=None):
+    """
+    Iterate through trees and everything below them, deepest first.
+
+    Args:
+        oids: Tree OIDs to start from
+        exclude: Callable telling whether an object ID can be skipped; a
+            skipped tree is not read, so nothing below it is visited
+
+    Yields:
+        tuple: (type, oid) of each object, every tree after the objects
+            it contains
+    """
+    visited = set ()
+    def iter_objects_in_tree (oid):
+        visited.add (oid)
+        for type_, entry_oid, _ in _iter_tree_entries (oid):
+            if entry_oid in visited or (exclude and exclude (entry_oid)):
+                visited.add (entry_oid)
+                continue
+            if type_ == 'tree':
+                yield from iter_objects_in_tree (entry_oid)
+            else:
+                visited.add (entry_oid)
+                yield type_, entry_oid
+        yield 'tree', oid
+
+    for oid in oids:
+        if oid not in visited and not (exclude and exclude (oid)):
+            yield from iter_objects_in_tree (oid)
+        visited.add (oid)
+
+
+def pack_objects ():
+    """
+    Move all loose objects reachable from refs into a single packfile.
+
+    Returns:
+        int: Number of objects packed
+    """
+    oids = {ref.value for _, ref in data.iter_refs ()}
+    return data.pack_objects (iter_objects_in_commits (oids))
+
+
+# Trailing ~N and ^N navigation steps of a revision like HEAD~2^2
+_REV_STEPS = re.compile (r'(?:[~^]\d*)+$')
+_REV_STEP = re.compile (r'([~^])(\d*)')
+
+
 def get_oid (name):
+    """
+    Resolve a revision to an OID.
+
+    A revision is a ref name, '@', a full or abbreviated SHA1, optionally
+    followed by navigation steps: '~N' goes to the Nth first-parent
+    ancestor and '^N' to the Nth parent ('~' and '^' alone mean 1, '^0' is
+    the commit itself).
+    """
+    steps = _REV_STEPS.search (name)
+    if steps and steps.start ():
+        oid = _get_named_oid (name[:steps.start ()])
+        for op, count in _REV_STEP.findall (steps.group ()):
+            count = int (count) if count else 1
+            if op == '~':
+                for _ in range (count):
+                    parents = get_parents (oid)
+                    assert parents, f'{name}: commit {oid} has no parent'
+                    oid = parents[0]
+            elif count:
+                parents = get_parents (oid)
+                assert len (parents) >= count, \
+                    f'{name}: commit {oid} has no parent {count}'
+                oid = parents[count - 1]
+        return oid
+    return _get_named_oid (name)
+
+def _get_named_oid (name):
     if name == '@': name = 'HEAD'
     # Name is ref
     refs_to_try = [
@@ -441,8 +1061,9 @@ def get_oid (name):
         f'refs/heads/{name}',
     ]
     for ref in refs_to_try:
-        if data.get_ref (ref, deref=False).value:
-            return data.get_ref (ref).value
+        value = data.get_ref (ref, deref=False)
+        if value.value:
+            return data.get_ref (ref).value if value.symbolic else value.value
 
 
     # Name is SHA1
@@ -450,23 +1071,38 @@ def get_oid (name):
     if len (name) == 40 and is_hex:
         return name
 
+    # Name is an abbreviated SHA1
+    if data.MIN_ABBREV <= len (name) < 40 and is_hex:
+        oid = data.expand_oid (name)
+        if oid:
+            return oid
+
     assert False, f'Unknown name {name}'
 
 def add (filenames):
+    """
+    Add files, or all files below directories, to the index.
+
+    Changed files are hashed and stored in parallel, then entered into the
+    index in the order they were found.
+    """
+    to_hash = []
 
     def add_file (filename):
         # Normalize path
         filename = os.path.relpath (filename)
-        with open (filename, 'rb') as f:
-            oid = data.hash_object (f.read ())
-        index[filename] = oid
+        # Stat before reading so a concurrent modification is caught later
+        st = os.stat (filename)
+        if index.is_fresh (filename, st):
+            return
+        to_hash.append ((filename, st))
 
     def add_directory (dirname):
-        for root, _, filenames in os.walk (dirname):
+        for root, _, filenames in ignore.walk (dirname):
             for filename in filenames:
                 # Normalize path
                 path = os.path.relpath (f'{root}/{filename}')
-                if is_ignored (path) or not os.path.isfile (path):
+                if not os.path.isfile (path):
                     continue
                 add_file (path)
 
@@ -477,6 +1113,13 @@ def add (filenames):
             elif os.path.isdir (name):
                 add_directory (name)
 
+        oids = data.hash_files ([path for path, _ in to_hash],
+                                [st.st_size for _, st in to_hash],
+                                write=True)
+        for (path, st), oid in zip (to_hash, oids):
+            index[path] = oid
+            index.set_stat (path, st)
+
 
 def is_ignored (path):
     """
@@ -488,40 +1131,4 @@ def is_ignored (path):
     Returns:
         bool: True if path should be ignored
     """
-    # Normalize path separators to forward slashes
-    path = path.replace('\\', '/')
-    
-    # Only .pygit directory is always ignored
-    if path.startswith('.pygit/'):
-        return True
-    
-    # Read .pygitignore if it exists
-    ignore_patterns = set()
-    if os.path.exists('.pygitignore'):
-        with open('.pygitignore', 'r') as f:
-            for line in f:
-                # Skip empty lines and comments
-                line = line.strip()
-                if line and not line.startswith('#'):
-                    ignore_patterns.add(line)
-    
-    # Helper function to match patterns
-    def matches_pattern(path, pattern):
-        if pattern.endswith('/'):
-            # Directory pattern
-            return pattern[:-1] in path.split('/')
-        elif '*' in pattern:
-            # Handle wildcards
-            if pattern.startswith('*'):
-                return path.endswith(pattern[1:])
-            elif pattern.endswith('*'):
-                return path.startswith(pattern[:-1])
-            else:
-                prefix, suffix = pattern.split('*', 1)
-                return path.startswith(prefix) and path.endswith(suffix)
-        else:
-            # Exact match
-            return pattern == path
-    
-    # Check if path matches any pattern
-    return any(matches_pattern(path, pattern) for pattern in ignore_patterns)
+    return ignore.is_ignored (path)
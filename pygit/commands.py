@@ -7,27 +7,47 @@ import subprocess
 from . import base
 from . import data
 from . import diff as diff_module
+from . import ignore
 from . import remote
 
 def init(args):
     """Initialize a new PyGit repository in the current directory."""
-    base.init()
+    base.init(args.object_format)
     print(f'Initialized empty pygit repository in {os.getcwd()}/{data.GIT_DIR}')
 
 def hash_object(args):
     """Compute hash of file contents and store in object database."""
-    with open(args.file, 'rb') as f:
-        print(data.hash_object(f.read()))
+    print(data.hash_file(args.file, write=True))
+
+def migrate_objects(args):
+    """Convert a flat object store to the fan-out format."""
+    count = data.migrate_objects()
+    print(f'Migrated {count} objects to the fanout format')
+
+def pack(args):
+    """Pack reachable loose objects into a packfile."""
+    count = base.pack_objects()
+    print(f'Packed {count} objects')
 
 def cat_file(args):
     """Display contents of object from database."""
     sys.stdout.flush()
-    sys.stdout.buffer.write(data.get_object(args.object, expected=None))
+    data.copy_object(args.object, sys.stdout.buffer, expected=None)
 
 def write_tree(args):
     """Write current index as tree object and return its hash."""
     print(base.write_tree())
 
+def write_commit_graph(args):
+    """Write a commit graph covering all reachable commits."""
+    count = base.write_commit_graph()
+    print(f'Wrote commit graph with {count} commits')
+
+def pack_refs(args):
+    """Move loose refs into the packed-refs file."""
+    count = data.pack_refs()
+    print(f'Packed {count} refs')
+
 def read_tree(args):
     """Read tree into index."""
     base.read_tree(args.tree)
@@ -42,9 +62,19 @@ def log(args):
     for refname, ref in data.iter_refs():
         refs.setdefault(ref.value, []).append(refname)
 
-    for oid in base.iter_commits_and_parents({args.oid}):
+    revisions = (args.revisions or ['@']) + ['--not', *args.not_revisions]
+    include, exclude = base.parse_revisions(revisions)
+    if exclude:
+        oids = base.iter_commits_in_range(include, exclude)
+    else:
+        oids = base.iter_commits_and_parents(include)
+
+    for oid in oids:
         commit = base.get_commit(oid)
-        _print_commit(oid, commit, refs.get(oid))
+        if args.oneline:
+            _print_commit_oneline(oid, commit, refs.get(oid))
+        else:
+            _print_commit(oid, commit, refs.get(oid))
 
 def show(args):
     """Show commit details and changes."""
@@ -56,31 +86,67 @@ def show(args):
         parent_tree = base.get_commit(commit.parents[0]).tree
 
     _print_commit(args.oid, commit)
-    result = diff_module.diff_trees(
-        base.get_tree(parent_tree), base.get_tree(commit.tree))
-    sys.stdout.flush()
-    sys.stdout.buffer.write(result)
+    _print_diff(args, parent_tree, commit.tree)
+
+def _print_diff(args, t_from, t_to, to_working=False):
+    """Write the diff between two trees to stdout as it is generated."""
+    if args.name_only:
+        chunks = diff_module.iter_name_only(t_from, t_to)
+    elif args.stat:
+        chunks = diff_module.iter_stat(t_from, t_to, to_working,
+                                       args.diff_algorithm)
+    else:
+        chunks = diff_module.iter_diff(t_from, t_to, to_working,
+                                       args.unified, args.diff_algorithm)
+    _write_output(chunks, args.paginate)
+
+def _write_output(chunks, paginate=False):
+    """
+    Write chunks of bytes to stdout, flushing each so output appears as it
+    is produced. With paginate, output to a terminal goes through
+    $PYGIT_PAGER or $PAGER (less by default).
+    """
+    out = sys.stdout.buffer
+    pager = None
+    if paginate and sys.stdout.isatty():
+        command = os.environ.get('PYGIT_PAGER') or os.environ.get('PAGER') or 'less -FRX'
+        pager = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE)
+        out = pager.stdin
+    try:
+        sys.stdout.flush()
+        for chunk in chunks:
+            out.write(chunk)
+            out.flush()
+        if pager:
+            pager.stdin.close()
+    except BrokenPipeError:
+        # The reader quit early, e.g. the pager or `| head`. Point stdout at
+        # devnull so the interpreter doesn't fail flushing it on exit.
+        if not pager:
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, sys.stdout.fileno())
+    finally:
+        if pager:
+            pager.wait()
 
 def diff(args):
     """Show changes between commits, index, or working tree."""
     oid = args.commit and base.get_oid(args.commit)
 
     if args.commit:
-        tree_from = base.get_tree(oid and base.get_commit(oid).tree)
+        tree_from = oid and base.get_commit(oid).tree
 
     if args.cached:
         tree_to = base.get_index_tree()
         if not args.commit:
             oid = base.get_oid('@')
-            tree_from = base.get_tree(oid and base.get_commit(oid).tree)
+            tree_from = oid and base.get_commit(oid).tree
     else:
         tree_to = base.get_working_tree()
         if not args.commit:
             tree_from = base.get_index_tree()
 
-    result = diff_module.diff_trees(tree_from, tree_to)
-    sys.stdout.flush()
-    sys.stdout.buffer.write(result)
+    _print_diff(args, tree_from, tree_to, to_working=not args.cached)
 
 def checkout(args):
     base.checkout(args.commit)
@@ -150,12 +216,12 @@ def status(args):
     if branch:
         print(f'On branch {branch}')
     else:
-        print(f'HEAD detached at {HEAD[:10]}')
+        print(f'HEAD detached at {data.abbreviate(HEAD)}')
 
     # Show merge status if merging
     MERGE_HEAD = data.get_ref('MERGE_HEAD').value
     if MERGE_HEAD:
-        print(f'Merging with {MERGE_HEAD[:10]}')
+        print(f'Merging with {data.abbreviate(MERGE_HEAD)}')
 
     # Get trees for comparison
     head_tree = HEAD and base.get_commit(HEAD).tree
@@ -164,10 +230,19 @@ def status(args):
 
     # Show staged changes
     print('\nChanges to be committed:')
-    if head_tree != index_tree:
-        for path, action in diff_module.iter_changed_files(base.get_tree(head_tree),
-                                                         index_tree):
+    with data.get_index() as index:
+        index_root = index.trees.get('')
+    # The cache-tree knows the index's root tree as long as nothing changed
+    # since the last commit or checkout
+    staged = []
+    if index_root is None or index_root != head_tree:
+        staged = list(diff_module.iter_changed_files(head_tree, index_tree))
+    if staged:
+        for path, action in staged:
             print(f'  {action:>12}: {path}')
+        if args.verbose:
+            print()
+            _print_diff(args, head_tree, index_tree)
     else:
         print('  (no changes)')
 
@@ -183,10 +258,10 @@ def status(args):
     # Show untracked files
     print('\nUntracked files:')
     untracked = []
-    for root, _, files in os.walk('.'):
+    for root, _, files in ignore.walk('.'):
         for file in files:
             path = os.path.relpath(os.path.join(root, file))
-            if not base.is_ignored(path) and path not in index_tree:
+            if path not in index_tree:
                 untracked.append(path)
     if untracked:
         for path in sorted(untracked):
@@ -203,8 +278,13 @@ def merge(args):
     base.merge(args.commit)
 
 def merge_base(args):
-    """Find common ancestor of two commits."""
-    print(base.get_merge_base(args.commit1, args.commit2))
+    """Find common ancestors of commits."""
+    if args.octopus:
+        bases = base.get_octopus_merge_bases(args.commits)
+    else:
+        bases = base.get_merge_bases(*args.commits)
+    for oid in (bases if args.all else bases[:1]):
+        print(oid)
 
 def fetch(args):
     """Download objects and refs from remote repository."""
@@ -241,4 +321,10 @@ def _print_commit(oid, commit, refs=None):
     refs_str = f' ({", ".join(refs)})' if refs else ''
     print(f'commit {oid}{refs_str}\n')
     print(textwrap.indent(commit.message, '    '))
-    print('')
\ No newline at end of file
+    print('')
+
+def _print_commit_oneline(oid, commit, refs=None):
+    """Print a commit as its shortest unique oid and its subject line."""
+    refs_str = f' ({", ".join(refs)})' if refs else ''
+    subject = commit.message.splitlines()[0] if commit.message else ''
+    print(f'{data.abbreviate(oid)}{refs_str} {subject}')
\ No newline at end of file
@@ -0,0 +1,338 @@
+"""Commit-graph files for PyGit.
+
+The commit graph stores, for every commit it covers, the root tree oid,
+the positions of its parents and its generation number in a compact binary
+array, so history walks don't have to open and parse commit objects.
+
+The graph is a chain of layers listed base first in
+``objects/info/commit-graph-chain``. Each layer
+(``objects/info/commit-graphs/graph-<hash>.graph``) holds:
+
+- header: signature, version, number of commits, number of commits in the
+  layers below it
+- 256-entry fan-out table and the sorted binary oids of its commits
+- one fixed-width record per commit: tree oid, first and second parent
+  position and generation number
+- extra edge list for commits with more than two parents
+- SHA-1 trailer
+
+Positions are global across the chain: a commit's position is the number of
+commits in the layers below plus its index in its own layer. New commits are
+appended as a new layer, and small layers are merged into the one below so
+the chain stays logarithmic in length.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+SIGNATURE = b'CGPH'
+VERSION = 1
+
+NO_PARENT = 0x70000000
+EXTRA_EDGES = 0x80000000
+LAST_EDGE = 0x80000000
+
+_HEADER = struct.Struct ('>4sIII')
+_FANOUT = struct.Struct ('>256I')
+_RECORD = struct.Struct ('>20sIII')
+_OID_SIZE = 20
+
+CHAIN_FILE = 'commit-graph-chain'
+LAYER_DIR = 'commit-graphs'
+
+
+class _Layer:
+    """One commit-graph file, read through mmap."""
+
+    def __init__ (self, path):
+        self.path = path
+        with open (path, 'rb') as f:
+            self._buf = mmap.mmap (f.fileno (), 0, access=mmap.ACCESS_READ)
+        signature, version, self.count, self.base_count = \
+            _HEADER.unpack_from (self._buf, 0)
+        assert signature == SIGNATURE and version == VERSION, \
+            f'Unsupported commit-graph {path}'
+        self._fanout = _FANOUT.unpack_from (self._buf, _HEADER.size)
+        self._oids_start = _HEADER.size + _FANOUT.size
+        self._records_start = self._oids_start + self.count * _OID_SIZE
+        self._edges_start = self._records_start + self.count * _RECORD.size
+
+    def close (self):
+        self._buf.close ()
+
+    def oid_at (self, i):
+        start = self._oids_start + i * _OID_SIZE
+        return self._buf[start:start + _OID_SIZE].hex ()
+
+    def find (self, oid):
+        """Binary search for oid, returning its local index or None."""
+        key = bytes.fromhex (oid)
+        first = key[0]
+        lo = self._fanout[first - 1] if first else 0
+        hi = self._fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._oids_start + mid * _OID_SIZE
+            mid_oid = self._buf[start:start + _OID_SIZE]
+            if mid_oid < key:
+                lo = mid + 1
+            elif mid_oid > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def record (self, i):
+        """Return (tree oid, parent1, parent2, generation) of local index i."""
+        tree, parent1, parent2, generation = _RECORD.unpack_from (
+            self._buf, self._records_start + i * _RECORD.size)
+        return tree.hex (), parent1, parent2, generation
+
+    def extra_edges (self, start):
+        """Yield parent positions from the extra edge list."""
+        pos = self._edges_start + start * 4
+        while True:
+            (edge,) = struct.unpack_from ('>I', self._buf, pos)
+            yield edge & ~LAST_EDGE
+            if edge & LAST_EDGE:
+                return
+            pos += 4
+
+
+class CommitGraph:
+    """A chain of commit-graph layers, lowest layer first."""
+
+    def __init__ (self, layers):
+        self.layers = layers
+
+    def __len__ (self):
+        if not self.layers:
+            return 0
+        top = self.layers[-1]
+        return top.base_count + top.count
+
+    def close (self):
+        for layer in self.layers:
+            layer.close ()
+
+    def position (self, oid):
+        """Return the global position of oid, or None if it isn't covered."""
+        for layer in self.layers:
+            i = layer.find (oid)
+            if i is not None:
+                return layer.base_count + i
+        return None
+
+    def __contains__ (self, oid):
+        return self.position (oid) is not None
+
+    def _locate (self, pos):
+        for layer in self.layers:
+            if pos < layer.base_count + layer.count:
+                return layer, pos - layer.base_count
+        raise IndexError (f'Commit-graph position {pos} out of range')
+
+    def oid_at (self, pos):
+        layer, i = self._locate (pos)
+        return layer.oid_at (i)
+
+    def _parent_positions (self, layer, record):
+        _, parent1, parent2, _ = record
+        if parent1 == NO_PARENT:
+            return []
+        if parent2 == NO_PARENT:
+            return [parent1]
+        if parent2 & EXTRA_EDGES:
+            return [parent1, *layer.extra_edges (parent2 & ~EXTRA_EDGES)]
+        return [parent1, parent2]
+
+    def lookup (self, oid):
+        """
+        Look up a commit.
+
+        Returns:
+            tuple: (tree oid, parent oids, generation), or None if the commit
+                isn't covered by the graph
+        """
+        for layer in self.layers:
+            i = layer.find (oid)
+            if i is not None:
+                record = layer.record (i)
+                parents = [self.oid_at (pos)
+                           for pos in self._parent_positions (layer, record)]
+                return record[0], parents, record[3]
+        return None
+
+    def parents (self, oid):
+        found = self.lookup (oid)
+        return found and found[1]
+
+    def generation (self, oid):
+        """Return the generation number of oid, or None if it isn't covered."""
+        for layer in self.layers:
+            i = layer.find (oid)
+            if i is not None:
+                return layer.record (i)[3]
+        return None
+
+    def iter_commits (self):
+        """Yield (oid, tree, parents) for every commit in the graph."""
+        for layer in self.layers:
+            for i in range (layer.count):
+                oid = layer.oid_at (i)
+                tree, parents, _ = self.lookup (oid)
+                yield oid, tree, parents
+
+
+def load (info_dir):
+    """
+    Load the commit-graph chain from info_dir.
+
+    Returns:
+        CommitGraph: The graph, or None if there is none
+    """
+    chain_path = f'{info_dir}/{CHAIN_FILE}'
+    if not os.path.isfile (chain_path):
+        return None
+    with open (chain_path) as f:
+        names = f.read ().split ()
+    if not names:
+        return None
+    return CommitGraph ([_Layer (f'{info_dir}/{LAYER_DIR}/graph-{name}.graph')
+                         for name in names])
+
+
+def _compute_generations (commits, base):
+    """Generation numbers for commits, with parents in commits or base."""
+    generations = {}
+    for oid in commits:
+        stack = [oid]
+        while stack:
+            current = stack[-1]
+            if current in generations:
+                stack.pop ()
+                continue
+            pending = [p for p in commits[current][1]
+                       if p in commits and p not in generations]
+            if pending:
+                stack.extend (pending)
+                continue
+            generation = 0
+            for parent in commits[current][1]:
+                if parent in commits:
+                    generation = max (generation, generations[parent])
+                else:
+                    parent_generation = base.generation (parent)
+                    assert parent_generation is not None, \
+                        f'Parent {parent} missing from commit-graph'
+                    generation = max (generation, parent_generation)
+            generations[current] = generation + 1
+            stack.pop ()
+    return generations
+
+
+def _write_layer (graph_dir, commits, base):
+    """Write commits as a layer on top of base and return its name."""
+    oids = sorted (commits)
+    base_count = len (base)
+    positions = {oid: base_count + i for i, oid in enumerate (oids)}
+    generations = _compute_generations (commits, base)
+
+    def position (parent):
+        if parent in positions:
+            return positions[parent]
+        pos = base.position (parent)
+        assert pos is not None, f'Parent {parent} missing from commit-graph'
+        return pos
+
+    fanout = [0] * 256
+    for oid in oids:
+        fanout[int (oid[:2], 16)] += 1
+    for i in range (1, 256):
+        fanout[i] += fanout[i - 1]
+
+    content = bytearray (_HEADER.pack (SIGNATURE, VERSION, len (oids), base_count))
+    content += _FANOUT.pack (*fanout)
+    for oid in oids:
+        content += bytes.fromhex (oid)
+
+    extra_edges = []
+    for oid in oids:
+        tree, parents = commits[oid]
+        parent_positions = [position (p) for p in parents]
+        parent1 = parent_positions[0] if parent_positions else NO_PARENT
+        if len (parent_positions) <= 2:
+            parent2 = parent_positions[1] if len (parent_positions) == 2 else NO_PARENT
+        else:
+            parent2 = EXTRA_EDGES | len (extra_edges)
+            extra_edges.extend (parent_positions[1:-1])
+            extra_edges.append (LAST_EDGE | parent_positions[-1])
+        content += _RECORD.pack (bytes.fromhex (tree), parent1, parent2,
+                                 generations[oid])
+    for edge in extra_edges:
+        content += struct.pack ('>I', edge)
+    name = hashlib.sha1 (content).hexdigest ()
+    content += bytes.fromhex (name)
+
+    _write_file_atomic (f'{graph_dir}/graph-{name}.graph', content)
+    return name
+
+
+def _write_file_atomic (path, content):
+    dirname = os.path.dirname (path)
+    os.makedirs (dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp (dir=dirname, prefix='tmp_')
+    try:
+        with os.fdopen (fd, 'wb') as out:
+            out.write (content)
+        os.chmod (tmp_path, 0o644)
+        os.replace (tmp_path, path)
+    except BaseException:
+        os.unlink (tmp_path)
+        raise
+
+
+def write (info_dir, commits, graph=None):
+    """
+    Add commits to the commit graph in info_dir.
+
+    The commits become a new top layer. As long as that layer is at least
+    half the size of the one below, the two are merged, so each layer is
+    much larger than all layers above it combined.
+
+    Args:
+        info_dir: Directory holding the commit-graph chain
+        commits: Dict mapping commit oids to (tree oid, parent oids); every
+            parent must be in commits or in graph
+        graph: Existing CommitGraph to extend, or None to start a new chain
+    """
+    layers = list (graph.layers) if graph is not None else []
+    commits = dict (commits)
+    while layers and len (commits) * 2 >= layers[-1].count:
+        top = CommitGraph (list (layers))
+        layer = layers.pop ()
+        for i in range (layer.count):
+            oid = layer.oid_at (i)
+            commits.setdefault (oid, top.lookup (oid)[:2])
+
+    graph_dir = f'{info_dir}/{LAYER_DIR}'
+    os.makedirs (graph_dir, exist_ok=True)
+    names = [os.path.basename (layer.path)[len ('graph-'):-len ('.graph')]
+             for layer in layers]
+    if commits:
+        names.append (_write_layer (graph_dir, commits, CommitGraph (list (layers))))
+    _write_file_atomic (f'{info_dir}/{CHAIN_FILE}',
+                        ''.join (f'{name}\n' for name in names).encode ())
+
+    # Layers merged away are no longer referenced by the chain
+    keep = {f'graph-{name}.graph' for name in names}
+    for filename in os.listdir (graph_dir):
+        if filename.startswith ('graph-') and filename not in keep:
+            try:
+                os.remove (f'{graph_dir}/{filename}')
+            except OSError:
+                # Still mapped by a reader on platforms that forbid removal
+                pass
@@ -7,19 +7,148 @@ This module handles all low-level data storage operations including:
 """
 
 import os
-import shutil
 import hashlib
+import itertools
 import json
+import shutil
+import string
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-from collections import namedtuple
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 
+from . import commit_graph
+from . import pack
+
 # Named tuple for reference values
 RefValue = namedtuple('RefValue', ['symbolic', 'value'])
 
+# Stat data recorded in the index next to each entry's oid
+IndexStat = namedtuple('IndexStat', ['mtime_ns', 'ctime_ns', 'size', 'ino', 'mode'])
+
 # Will be initialized in cli.main()
 GIT_DIR = None
 
+# Read size used when streaming file contents
+CHUNK_SIZE = 64 * 1024
+
+# Parallel hashing: files are handed to worker threads in batches of about
+# HASH_BATCH_BYTES (or HASH_BATCH_FILES small files) to amortize overhead
+HASH_WORKERS = int (os.environ.get ('PYGIT_HASH_WORKERS', 0)) or min (32, (os.cpu_count () or 1) + 4)
+HASH_BATCH_BYTES = 4 * 1024 * 1024
+HASH_BATCH_FILES = 256
+
+# Objects copied between repositories are opened this many at a time
+TRANSFER_BATCH_OBJECTS = 256
+
+# Shortest abbreviated oid accepted or printed
+MIN_ABBREV = 4
+
+# Seconds to wait for a lock held by another process before giving up
+LOCK_TIMEOUT = float (os.environ.get ('PYGIT_LOCK_TIMEOUT', 10))
+
+# Default byte limits of the in-process object caches
+OBJECT_CACHE_BYTES = int (os.environ.get ('PYGIT_OBJECT_CACHE_BYTES', 64 * 1024 * 1024))
+PARSED_CACHE_BYTES = int (os.environ.get ('PYGIT_PARSED_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Object store layouts: 'flat' keeps uncompressed objects directly in
+# objects/, 'fanout' keeps zlib-compressed objects in objects/<oid[:2]>/
+OBJECT_FORMATS = ('flat', 'fanout')
+DEFAULT_OBJECT_FORMAT = 'fanout'
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by the total size of its values.
+
+    Since objects are immutable and addressed by their hash, cached entries
+    never need to be invalidated.
+    """
+
+    def __init__ (self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict ()
+        self._lock = threading.Lock ()
+
+    def get (self, key):
+        """Return the cached value for key, or None."""
+        with self._lock:
+            entry = self._entries.get (key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end (key)
+            return entry[0]
+
+    def put (self, key, value, size):
+        """Cache value, counting it as size bytes towards the limit."""
+        # A single huge value would just evict everything else
+        if size > self.max_bytes // 4:
+            return
+        with self._lock:
+            old = self._entries.pop (key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            self._evict ()
+
+    def resize (self, max_bytes):
+        """Change the byte limit, evicting entries if needed."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict ()
+
+    def clear (self):
+        with self._lock:
+            self._entries.clear ()
+            self.size = 0
+
+    def _evict (self):
+        while self.size > self.max_bytes and self._entries:
+            _, (_, size) = self._entries.popitem (last=False)
+            self.size -= size
+
+    def __len__ (self):
+        return len (self._entries)
+
+
+# Raw objects as (type, content), keyed by oid
+object_cache = LRUCache (OBJECT_CACHE_BYTES)
+# Parsed objects, keyed by (kind, oid): ('commit', oid) -> Commit,
+# ('tree', oid) -> tuple of entries, ('blob-info', oid) -> (binary, size)
+parsed_cache = LRUCache (PARSED_CACHE_BYTES)
+
+
+def set_cache_limits (object_bytes=None, parsed_bytes=None):
+    """
+    Change the byte limits of the object caches.
+
+    Args:
+        object_bytes: Limit for raw objects, unchanged if None
+        parsed_bytes: Limit for parsed commits and trees, unchanged if None
+    """
+    if object_bytes is not None:
+        object_cache.resize (object_bytes)
+    if parsed_bytes is not None:
+        parsed_cache.resize (parsed_bytes)
+
+
 @contextmanager
 def change_git_dir(new_dir):
     """
@@ -31,40 +160,360 @@ def change_git_dir(new_dir):
     global GIT_DIR
     old_dir = GIT_DIR
     GIT_DIR = f'{new_dir}/.pygit'
-    yield
-    GIT_DIR = old_dir
+    try:
+        yield
+    finally:
+        GIT_DIR = old_dir
+
+def _stat_key (path):
+    """Return identifying stat data for path, or None if it doesn't exist."""
+    try:
+        st = os.stat (path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
 
-def hash_object(data, type_='blob'):
+# Parsed config files, keyed by path and validated against their stat data
+_config_cache = {}
+
+def get_config ():
+    """Return the repository configuration as a dict."""
+    path = f'{GIT_DIR}/config'
+    key = _stat_key (path)
+    if key is None:
+        return {}
+    cached = _config_cache.get (path)
+    if cached is None or cached[0] != key:
+        with open (path) as f:
+            cached = (key, json.load (f))
+        _config_cache[path] = cached
+    return dict (cached[1])
+
+
+def set_config (name, value):
+    """Set a repository configuration value."""
+    config = get_config ()
+    config[name] = value
+    with open (f'{GIT_DIR}/config', 'w') as f:
+        json.dump (config, f, indent=2)
+
+
+def get_object_format ():
     """
-    Compute hash of object and store it.
-    
-    Args:
-        data: Content to hash and store
-        type_: Object type ('blob', 'tree', 'commit')
-        
-    Returns:
-        str: Object ID (SHA-1 hash)
+    Return the object store format of the repository.
+
+    Repositories created before the format was configurable use 'flat'.
     """
-    obj = type_.encode() + b'\x00' + data
-    oid = hashlib.sha1(obj).hexdigest()
-    with open(f'{GIT_DIR}/objects/{oid}', 'wb') as out:
-        out.write(obj)
-    return oid
+    return get_config ().get ('object_format', 'flat')
 
-def update_ref (ref, value, deref=True):
-    """Update a reference to point to a specific value."""
-    ref = _get_ref_internal (ref, deref)[0]
 
-    assert value.value
-    if value.symbolic:
-        value = f'ref: {value.value}'
-    else:
-        value = value.value
+def _fsync_dir (dirname):
+    """Make a rename in dirname durable, where the platform allows it."""
+    try:
+        fd = os.open (dirname, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync (fd)
+    except OSError:
+        # Directories can't be synced on every platform
+        pass
+    finally:
+        os.close (fd)
+
+
+class LockFile:
+    """
+    Exclusive lock on a file, held by creating '<path>.lock'.
+
+    The new content is written to the lock file itself, synced and renamed
+    over the file on commit, so readers see either the old or the new
+    content and a crashed writer leaves the file untouched. The lock is
+    released, without changing the file, if the lock isn't committed.
+    """
+
+    def __init__ (self, path, timeout=None):
+        self.path = path
+        self.lock_path = f'{path}.lock'
+        self.timeout = LOCK_TIMEOUT if timeout is None else timeout
+        self._fd = None
+
+    def acquire (self):
+        """Create the lock file, waiting while another process holds it."""
+        os.makedirs (os.path.dirname (self.path), exist_ok=True)
+        deadline = time.monotonic () + self.timeout
+        delay = 0.001
+        while True:
+            try:
+                self._fd = os.open (self.lock_path,
+                                    os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                return self
+            except FileExistsError:
+                if time.monotonic () >= deadline:
+                    raise Exception (
+                        f'Unable to lock {self.path}: {self.lock_path} exists. '
+                        'If no other pygit process is running, remove it.')
+            time.sleep (delay)
+            delay = min (delay * 2, 0.1)
+
+    def write (self, content):
+        """Write content to the lock file."""
+        view = memoryview (content)
+        while view:
+            view = view[os.write (self._fd, view):]
+
+    def _close (self):
+        fd, self._fd = self._fd, None
+        os.close (fd)
+
+    def commit (self):
+        """Sync the written content and rename it over the file."""
+        os.fsync (self._fd)
+        self._close ()
+        os.replace (self.lock_path, self.path)
+        _fsync_dir (os.path.dirname (self.path))
+
+    def remove (self):
+        """Delete the file, then release the lock."""
+        self._close ()
+        try:
+            os.remove (self.path)
+        except FileNotFoundError:
+            pass
+        os.remove (self.lock_path)
+
+    def rollback (self):
+        """Release the lock without changing the file, if still held."""
+        if self._fd is not None:
+            self._close ()
+            os.remove (self.lock_path)
+
+    def __enter__ (self):
+        return self.acquire ()
+
+    def __exit__ (self, *exc_info):
+        self.rollback ()
+
+
+# packed-refs holds one '<value> <refname>' line per ref, sorted by name
+# after a header line. A loose ref file overrides the packed entry of the
+# same name.
+PACKED_REFS_HEADER = '# pack-refs sorted\n'
+
+
+class PackedRefs:
+    """The entries of a packed-refs file, sorted by name for binary search."""
+
+    def __init__ (self, entries=()):
+        entries = sorted (entries)
+        self.names = [name for name, _ in entries]
+        self.values = [value for _, value in entries]
+
+    def __iter__ (self):
+        return zip (self.names, self.values)
+
+    def __len__ (self):
+        return len (self.names)
+
+    def get (self, name):
+        """Return the packed value of a ref, or None."""
+        i = bisect_left (self.names, name)
+        if i < len (self.names) and self.names[i] == name:
+            return self.values[i]
+        return None
+
+    def iter_prefix (self, prefix):
+        """Yield (name, value) of the refs starting with prefix, in order."""
+        # Names sharing a prefix are contiguous in sorted order
+        for i in range (bisect_left (self.names, prefix), len (self.names)):
+            if not self.names[i].startswith (prefix):
+                return
+            yield self.names[i], self.values[i]
+
+
+def _read_packed_refs (path):
+    entries = []
+    with open (path) as f:
+        for line in f:
+            line = line.rstrip ('\n')
+            if not line or line.startswith ('#'):
+                continue
+            value, name = line.split (' ', 1)
+            entries.append ((name, value))
+    return PackedRefs (entries)
+
+
+def _packed_refs_content (entries):
+    return (PACKED_REFS_HEADER + ''.join (
+        f'{entries[name]} {name}\n' for name in sorted (entries))).encode ()
+
+
+# Ref file contents and parsed packed-refs files, keyed by path and
+# validated against their stat data. Ref transactions refresh the entries
+# they change, so a rewrite within the same mtime tick isn't missed.
+_ref_cache = {}
+_packed_refs_cache = {}
+
+
+def _get_packed_refs ():
+    path = f'{GIT_DIR}/packed-refs'
+    key = _stat_key (path)
+    if key is None:
+        _packed_refs_cache.pop (path, None)
+        return PackedRefs ()
+    cached = _packed_refs_cache.get (path)
+    if cached is None or cached[0] != key:
+        cached = (key, _read_packed_refs (path))
+        _packed_refs_cache[path] = cached
+    return cached[1]
+
+
+def _read_ref (ref):
+    """Return the stored value of a ref: its loose file, else its packed entry."""
+    path = f'{GIT_DIR}/{ref}'
+    key = _stat_key (path)
+    cached = _ref_cache.get (path)
+    if key is not None and (cached is None or cached[0] != key):
+        try:
+            with open (path) as f:
+                cached = (key, f.read ().strip ())
+        except IsADirectoryError:
+            key = None
+        else:
+            _ref_cache[path] = cached
+    if key is None:
+        _ref_cache.pop (path, None)
+        return _get_packed_refs ().get (ref)
+    return cached[1]
+
+
+def _loose_ref_names ():
+    names = []
+    for root, _, filenames in os.walk (f'{GIT_DIR}/refs'):
+        # Convert Windows paths to Unix-style for consistency
+        root = os.path.relpath (root, GIT_DIR).replace ('\\', '/')
+        names.extend (f'{root}/{name}' for name in filenames
+                      if not name.endswith ('.lock'))
+    return names
+
+
+class RefTransaction:
+    """
+    A batch of ref updates and deletions applied together.
 
-    ref_path = f'{GIT_DIR}/{ref}'
-    os.makedirs (os.path.dirname (ref_path), exist_ok=True)
-    with open (ref_path, 'w') as f:
-        f.write (value)
+    On commit every ref involved is locked, in sorted order so concurrent
+    transactions can't deadlock, and checked against its expected old
+    value. Only when all checks pass are the new values synced and renamed
+    into place; otherwise no ref is changed.
+    """
+
+    def __init__ (self):
+        # Ref name -> (new stored value or None to delete, expected old value)
+        self._updates = {}
+
+    def update (self, ref, value, deref=True, old_value=None):
+        """
+        Queue a ref update.
+
+        Args:
+            ref: Reference name to update
+            value: New RefValue
+            deref: Whether to update the ref a symbolic ref points to
+            old_value: If given, the oid the ref must still have when the
+                transaction commits, or '' if it must not exist yet
+        """
+        ref = _get_ref_internal (ref, deref)[0]
+        assert value.value
+        stored = f'ref: {value.value}' if value.symbolic else value.value
+        self._updates[ref] = (stored, old_value)
+
+    def delete (self, ref, deref=True, old_value=None):
+        """Queue a ref deletion, see update for the arguments."""
+        ref = _get_ref_internal (ref, deref)[0]
+        self._updates[ref] = (None, old_value)
+
+    def commit (self):
+        refs = sorted (self._updates)
+        deleted = [ref for ref in refs if self._updates[ref][0] is None]
+        locks = {}
+        packed_lock = None
+        try:
+            # Locks are always taken packed-refs first, then refs in sorted
+            # order, as in pack_refs, so the two can't deadlock. Deletions
+            # hold packed-refs throughout, so pack_refs can't pack a ref
+            # while it is being deleted.
+            if deleted:
+                packed_lock = LockFile (f'{GIT_DIR}/packed-refs').acquire ()
+            for ref in refs:
+                locks[ref] = LockFile (f'{GIT_DIR}/{ref}').acquire ()
+
+            for ref in refs:
+                old_value = self._updates[ref][1]
+                current = _read_ref (ref) or ''
+                if old_value is not None and current != old_value:
+                    raise Exception (f'Ref {ref} changed concurrently: '
+                                     f'expected {old_value or "no ref"}, '
+                                     f'found {current or "no ref"}')
+
+            for ref in refs:
+                stored = self._updates[ref][0]
+                if stored is not None:
+                    locks[ref].write (stored.encode ())
+
+            # A loose ref overrides its packed entry, so a deleted ref is
+            # dropped from packed-refs before its loose file goes away
+            packed = _get_packed_refs ()
+            if packed_lock is not None and any (packed.get (ref) is not None
+                                                for ref in deleted):
+                entries = dict (packed)
+                for ref in deleted:
+                    entries.pop (ref, None)
+                packed_lock.write (_packed_refs_content (entries))
+                packed_lock.commit ()
+            for ref in refs:
+                path = f'{GIT_DIR}/{ref}'
+                stored = self._updates[ref][0]
+                if stored is None:
+                    locks[ref].remove ()
+                    _ref_cache.pop (path, None)
+                else:
+                    locks[ref].commit ()
+                    _ref_cache[path] = (_stat_key (path), stored)
+        finally:
+            for lock in locks.values ():
+                lock.rollback ()
+            if packed_lock is not None:
+                packed_lock.rollback ()
+        self._updates.clear ()
+
+
+@contextmanager
+def ref_transaction ():
+    """
+    Collect ref updates and apply them together on exit.
+
+    Yields:
+        RefTransaction: The transaction, committed if the block succeeds
+    """
+    transaction = RefTransaction ()
+    yield transaction
+    transaction.commit ()
+
+
+def update_ref (ref, value, deref=True, old_value=None):
+    """
+    Update a reference to point to a specific value.
+
+    Args:
+        ref: Reference name to update
+        value: New RefValue
+        deref: Whether to update the ref a symbolic ref points to
+        old_value: If given, the oid the ref must currently have, or '' if
+            it must not exist yet; the update fails otherwise
+    """
+    with ref_transaction () as transaction:
+        transaction.update (ref, value, deref=deref, old_value=old_value)
 
 
 def get_ref (ref, deref=True):
@@ -78,13 +527,7 @@ def get_ref (ref, deref=True):
     Returns:
         RefValue: Named tuple containing ref value and symbolic flag
     """
-    ref_path = f'{GIT_DIR}/{ref}'
-    value = None
-    
-    # Get ref value if file exists
-    if os.path.isfile(ref_path):
-        with open(ref_path) as f:
-            value = f.read().strip()
+    value = _read_ref (ref)
 
     # Handle symbolic refs
     symbolic = bool(value) and value.startswith('ref:')
@@ -101,16 +544,13 @@ def get_ref (ref, deref=True):
 
     return RefValue(symbolic=symbolic, value=value)
 
-def delete_ref (ref, deref=True):
-    ref = _get_ref_internal (ref, deref)[0]
-    os.remove (f'{GIT_DIR}/{ref}')
+def delete_ref (ref, deref=True, old_value=None):
+    """Delete a reference, loose or packed."""
+    with ref_transaction () as transaction:
+        transaction.delete (ref, deref=deref, old_value=old_value)
 
 def _get_ref_internal (ref, deref):
-    ref_path = f'{GIT_DIR}/{ref}'
-    value = None
-    if os.path.isfile (ref_path):
-        with open (ref_path) as f:
-            value = f.read ().strip ()
+    value = _read_ref (ref)
 
     symbolic = bool (value) and value.startswith ('ref:')
     if symbolic:
@@ -122,61 +562,759 @@ def _get_ref_internal (ref, deref):
 
 
 def iter_refs (prefix='', deref=True):
-    """Iterate through all refs in the repository"""
+    """
+    Iterate through all refs in the repository.
+
+    Loose and packed refs are merged, a loose ref hiding the packed entry of
+    the same name. HEAD and MERGE_HEAD come first, then the refs below refs/
+    sorted by name.
+    """
     # First, check if refs directory exists
-    refs_dir = f'{GIT_DIR}/refs'
-    if not os.path.exists(refs_dir):
+    if not os.path.exists (f'{GIT_DIR}/refs'):
         return
 
-    # Start with HEAD and MERGE_HEAD
-    refs = ['HEAD', 'MERGE_HEAD']
-    
-    # Walk through all files in refs directory
-    for root, _, filenames in os.walk(refs_dir):
-        # Convert Windows paths to Unix-style for consistency
-        root = root.replace('\\', '/')
-        # Get relative path from GIT_DIR
-        root = os.path.relpath(root, GIT_DIR)
-        # Add each ref file found
-        for name in filenames:
-            refs.append(f'{root}/{name}')
-
-    # Yield each ref that matches the prefix
-    for refname in refs:
-        # Normalize path separators
-        refname = refname.replace('\\', '/')
-        if not refname.startswith(prefix):
-            continue
-        ref = get_ref(refname, deref=deref)
+    names = {name for name in _loose_ref_names () if name.startswith (prefix)}
+    names.update (name for name, _ in _get_packed_refs ().iter_prefix (prefix))
+    refnames = [name for name in ('HEAD', 'MERGE_HEAD') if name.startswith (prefix)]
+
+    for refname in refnames + sorted (names):
+        ref = get_ref (refname, deref=deref)
         if ref.value:
             yield refname, ref
 
+
+def pack_refs ():
+    """
+    Move the loose refs below refs/ into the packed-refs file.
+
+    Symbolic refs stay loose. packed-refs and then the packed refs are
+    locked while they are moved, in the same order RefTransaction uses.
+    Directories left empty are removed, except refs/heads and refs/tags.
+
+    Returns:
+        int: Number of refs packed
+    """
+    locks = {}
+    try:
+        packed_lock = LockFile (f'{GIT_DIR}/packed-refs').acquire ()
+        locks['packed-refs'] = packed_lock
+        entries = dict (_get_packed_refs ())
+        for refname in sorted (_loose_ref_names ()):
+            lock = LockFile (f'{GIT_DIR}/{refname}').acquire ()
+            locks[refname] = lock
+            value = _read_ref (refname)
+            if not value or value.startswith ('ref:'):
+                lock.rollback ()
+                del locks[refname]
+                continue
+            entries[refname] = value
+
+        # Write the packed entries before dropping the loose files they replace
+        packed_lock.write (_packed_refs_content (entries))
+        packed_lock.commit ()
+        packed = [refname for refname in locks if refname != 'packed-refs']
+        for refname in packed:
+            locks[refname].remove ()
+            _ref_cache.pop (f'{GIT_DIR}/{refname}', None)
+            parent = os.path.dirname (refname)
+            while parent.count ('/') >= 2:
+                try:
+                    os.rmdir (f'{GIT_DIR}/{parent}')
+                except OSError:
+                    break
+                parent = os.path.dirname (parent)
+    finally:
+        for lock in locks.values ():
+            lock.rollback ()
+    return len (packed)
+
+# Binary index file layout:
+#   header: signature, version, number of entries
+#   entries, sorted by path: path length, UTF-8 path, binary oid, flags and
+#     stat data (zeroed when the entry has none)
+#   extensions: signature, payload length, payload
+#   trailer: SHA-1 of everything before it
+#
+# The cache-tree extension (TREE) lists directories whose tree oid is known,
+# each as path length, UTF-8 path ('' for the root) and binary oid.
+INDEX_SIGNATURE = b'PIDX'
+INDEX_VERSION = 1
+_INDEX_HEADER = struct.Struct ('>4sII')
+_INDEX_ENTRY = struct.Struct ('>20sBqqQQI')
+_INDEX_HAS_STAT = 1
+_INDEX_EXTENSION = struct.Struct ('>4sI')
+_INDEX_TREE_EXTENSION = b'TREE'
+
+
+class Index (MutableMapping):
+    """
+    Staging area mapping paths to blob OIDs.
+
+    Besides the oid, each entry may carry the stat data of the working file
+    it was hashed from. As long as the file's stat data is unchanged the
+    recorded oid can be trusted without re-reading the file.
+
+    The index also caches the tree oid of directories whose entries haven't
+    changed since their tree was last written or read, so unchanged
+    directories don't need to be serialized again.
+
+    The index file is only parsed on first access and the index tracks
+    whether it was modified, so read-only users never rewrite it.
+    """
+
+    def __init__ (self, path=None):
+        self.path = path
+        self._entries = {}
+        self._stat = {}
+        self._trees = {}
+        # mtime_ns of the index file when it was loaded, for racy-clean checks
+        self.timestamp = None
+        self.dirty = False
+        self._loaded = path is None
+
+    def _load (self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open (self.path, 'rb') as f:
+                content = f.read ()
+                self.timestamp = os.fstat (f.fileno ()).st_mtime_ns
+        except FileNotFoundError:
+            return
+
+        if content.startswith (b'{'):
+            self._load_json (content)
+            # Rewrite indexes in the old JSON format as binary
+            self.dirty = True
+        else:
+            self._load_binary (content)
+
+    def _load_json (self, content):
+        for path, value in json.loads (content).items ():
+            # Entries are either a bare oid or [oid, *stat]
+            if isinstance (value, str):
+                self._entries[path] = value
+            else:
+                self._entries[path] = value[0]
+                self._stat[path] = IndexStat (*value[1:])
+
+    def _load_binary (self, content):
+        body, checksum = content[:-20], content[-20:]
+        assert hashlib.sha1 (body).digest () == checksum, \
+            f'Index checksum mismatch in {self.path}'
+        signature, version, count = _INDEX_HEADER.unpack_from (body, 0)
+        assert signature == INDEX_SIGNATURE and version == INDEX_VERSION, \
+            f'Unsupported index format in {self.path}'
+
+        pos = _INDEX_HEADER.size
+        for _ in range (count):
+            (path_length,) = struct.unpack_from ('>H', body, pos)
+            pos += 2
+            path = body[pos:pos + path_length].decode ()
+            pos += path_length
+            oid, flags, *stat = _INDEX_ENTRY.unpack_from (body, pos)
+            pos += _INDEX_ENTRY.size
+            self._entries[path] = oid.hex ()
+            if flags & _INDEX_HAS_STAT:
+                self._stat[path] = IndexStat (*stat)
+
+        while pos < len (body):
+            signature, length = _INDEX_EXTENSION.unpack_from (body, pos)
+            pos += _INDEX_EXTENSION.size
+            self._load_extension (signature, body[pos:pos + length])
+            pos += length
+
+    def _load_extension (self, signature, payload):
+        """Load an optional index extension; unknown ones are dropped."""
+        if signature != _INDEX_TREE_EXTENSION:
+            return
+        pos = 0
+        while pos < len (payload):
+            (path_length,) = struct.unpack_from ('>H', payload, pos)
+            pos += 2
+            dirpath = payload[pos:pos + path_length].decode ()
+            pos += path_length
+            self._trees[dirpath] = payload[pos:pos + 20].hex ()
+            pos += 20
+
+    def _extensions (self):
+        """Yield (signature, payload) of the extensions to write."""
+        if self._trees:
+            payload = bytearray ()
+            for dirpath in sorted (self._trees):
+                encoded = dirpath.encode ()
+                payload += struct.pack ('>H', len (encoded))
+                payload += encoded
+                payload += bytes.fromhex (self._trees[dirpath])
+            yield _INDEX_TREE_EXTENSION, bytes (payload)
+
+    def _invalidate_trees (self, path):
+        # Every directory containing path, up to the root
+        dirpath = path
+        while dirpath:
+            dirpath = dirpath.rpartition ('/')[0]
+            if self._trees.pop (dirpath, None) is not None:
+                self.dirty = True
+
+    def write (self, lock=None):
+        """
+        Write the index to its file through its lock file and a rename.
+
+        Args:
+            lock: LockFile already held on the index, taken here if None
+        """
+        if lock is None:
+            with LockFile (self.path) as lock:
+                return self.write (lock)
+        self._load ()
+        content = bytearray (_INDEX_HEADER.pack (INDEX_SIGNATURE, INDEX_VERSION,
+                                                 len (self._entries)))
+        no_stat = (0, 0, 0, 0, 0)
+        for path in sorted (self._entries):
+            encoded = path.encode ()
+            content += struct.pack ('>H', len (encoded))
+            content += encoded
+            stat = self._stat.get (path)
+            content += _INDEX_ENTRY.pack (
+                bytes.fromhex (self._entries[path]),
+                _INDEX_HAS_STAT if stat else 0,
+                *(stat or no_stat))
+        for signature, payload in self._extensions ():
+            content += _INDEX_EXTENSION.pack (signature, len (payload))
+            content += payload
+        content += hashlib.sha1 (content).digest ()
+        lock.write (content)
+        lock.commit ()
+        self.dirty = False
+
+    def __getitem__ (self, path):
+        self._load ()
+        return self._entries[path]
+
+    def __setitem__ (self, path, oid):
+        self._load ()
+        old = self._entries.get (path)
+        if old == oid:
+            return
+        # Stat data only describes the oid it was recorded with
+        self._stat.pop (path, None)
+        self._entries[path] = oid
+        self._invalidate_trees (path)
+        self.dirty = True
+
+    def __delitem__ (self, path):
+        self._load ()
+        del self._entries[path]
+        self._stat.pop (path, None)
+        self._invalidate_trees (path)
+        self.dirty = True
+
+    def __iter__ (self):
+        self._load ()
+        return iter (self._entries)
+
+    def __len__ (self):
+        self._load ()
+        return len (self._entries)
+
+    def __contains__ (self, path):
+        self._load ()
+        return path in self._entries
+
+    def __repr__ (self):
+        self._load ()
+        return f'Index({self._entries!r})'
+
+    @property
+    def stat (self):
+        """Mapping of paths to their IndexStat, for entries that have one."""
+        self._load ()
+        return self._stat
+
+    def set_stat (self, path, st):
+        """Record the stat data of the working file hashed to index[path]."""
+        self._load ()
+        stat = IndexStat (st.st_mtime_ns, st.st_ctime_ns,
+                          st.st_size, st.st_ino, st.st_mode)
+        # Rewriting a racily clean entry's stat data moves the index
+        # timestamp past the file's mtime, so it can be trusted next time
+        racy = self.timestamp is None or stat.mtime_ns >= self.timestamp
+        if self._stat.get (path) != stat or racy:
+            self._stat[path] = stat
+            self.dirty = True
+
+    @property
+    def trees (self):
+        """Mapping of directory paths ('' for the root) to cached tree OIDs."""
+        self._load ()
+        return self._trees
+
+    def set_tree (self, dirpath, oid):
+        """Record the tree oid of the index entries below dirpath."""
+        self._load ()
+        if self._trees.get (dirpath) != oid:
+            self._trees[dirpath] = oid
+            self.dirty = True
+
+    def is_fresh (self, path, st):
+        """
+        Check whether index[path] still describes the working file.
+
+        Args:
+            path: Path of the entry
+            st: Current os.stat_result of the working file
+
+        Returns:
+            bool: True if the stat data matches and the entry is not racy
+        """
+        self._load ()
+        cached = self._stat.get (path)
+        if cached is None or path not in self._entries:
+            return False
+        if cached != (st.st_mtime_ns, st.st_ctime_ns, st.st_size,
+                      st.st_ino, st.st_mode):
+            return False
+        # A file modified in the same timestamp tick as the index write could
+        # have changed without its stat data changing, so don't trust it
+        return self.timestamp is not None and cached.mtime_ns < self.timestamp
+
+
 @contextmanager
 def get_index ():
-    index = {}
-    if os.path.isfile (f'{GIT_DIR}/index'):
-        with open (f'{GIT_DIR}/index') as f:
-            index = json.load (f)
+    """
+    Open the index for reading and updating.
+
+    The index is locked for the duration, so concurrent processes can't
+    interleave their reads and writes and lose each other's changes.
+
+    Yields:
+        Index: The index, written back on exit only if it was modified
+    """
+    path = f'{GIT_DIR}/index'
+    with LockFile (path) as lock:
+        index = Index (path)
+
+        yield index
+
+        if index.dirty:
+            index.write (lock)
 
-    yield index
 
-    with open (f'{GIT_DIR}/index', 'w') as f:
-        json.dump (index, f)
+def hash_object (data, type_='blob', write=True):
+    """
+    Compute hash of object and optionally store it.
 
+    Args:
+        data: Content to hash
+        type_: Object type ('blob', 'tree', 'commit')
+        write: Whether to store the object in the object database
 
-def hash_object (data, type_='blob'):
+    Returns:
+        str: Object ID (SHA-1 hash)
+    """
     obj = type_.encode () + b'\x00' + data
     oid = hashlib.sha1 (obj).hexdigest ()
-    with open (f'{GIT_DIR}/objects/{oid}', 'wb') as out:
-        out.write (obj)
+    if write:
+        _write_object (oid, obj)
     return oid
 
-def get_object (oid, expected='blob'):
-    with open (f'{GIT_DIR}/objects/{oid}', 'rb') as f:
-        obj = f.read ()
 
-    type_, _, content = obj.partition (b'\x00')
-    type_ = type_.decode ()
+def hash_file (path, type_='blob', write=False):
+    """
+    Compute hash of a file's contents, reading it in chunks.
+
+    Without write, nothing is stored and the file is never held in memory
+    as a whole, so read-only commands can use it freely.
+
+    Args:
+        path: File to hash
+        type_: Object type of the contents
+        write: Whether to store the object in the object database
+
+    Returns:
+        str: Object ID (SHA-1 hash)
+    """
+    if write:
+        writer = _ObjectWriter ()
+        try:
+            writer.write (type_.encode () + b'\x00')
+            with open (path, 'rb') as f:
+                for chunk in iter (lambda: f.read (CHUNK_SIZE), b''):
+                    writer.write (chunk)
+        except BaseException:
+            writer.abort ()
+            raise
+        return writer.close ()
+
+    sha = hashlib.sha1 (type_.encode () + b'\x00')
+    with open (path, 'rb') as f:
+        for chunk in iter (lambda: f.read (CHUNK_SIZE), b''):
+            sha.update (chunk)
+    return sha.hexdigest ()
+
+def hash_files (paths, sizes=None, write=False, workers=None):
+    """
+    Hash many files using a pool of threads.
+
+    hashlib and file reads release the GIL, so several threads keep the disk
+    and CPU busy at once. Small files are grouped into batches so the
+    per-task overhead doesn't outweigh the gain.
+
+    Args:
+        paths: Files to hash
+        sizes: File sizes in the same order, used for batching if given
+        write: Whether to store the objects in the object database
+        workers: Number of threads, defaults to HASH_WORKERS
+
+    Returns:
+        list: Object IDs in the order of paths
+    """
+    paths = list (paths)
+    workers = workers or HASH_WORKERS
+    if sizes is None:
+        sizes = [0] * len (paths)
+
+    batches = []
+    batch = []
+    batch_bytes = 0
+    for path, size in zip (paths, sizes):
+        batch.append (path)
+        batch_bytes += size
+        if batch_bytes >= HASH_BATCH_BYTES or len (batch) >= HASH_BATCH_FILES:
+            batches.append (batch)
+            batch = []
+            batch_bytes = 0
+    if batch:
+        batches.append (batch)
+
+    def hash_batch (batch):
+        return [hash_file (path, write=write) for path in batch]
+
+    if workers == 1 or len (batches) <= 1:
+        return [oid for batch in batches for oid in hash_batch (batch)]
+
+    with ThreadPoolExecutor (max_workers=workers) as executor:
+        return [oid for oids in executor.map (hash_batch, batches) for oid in oids]
+
+
+def _flat_path (oid):
+    return f'{GIT_DIR}/objects/{oid}'
+
+
+def _fanout_path (oid):
+    return f'{GIT_DIR}/objects/{oid[:2]}/{oid[2:]}'
+
+
+class _ObjectWriter:
+    """
+    Stream a raw object (type header included) into the object store.
+
+    Chunks are hashed and written, compressed for the fan-out format, to a
+    temporary file that is renamed to the object's path once the oid is
+    known, so objects never need to fit in memory and readers never see a
+    partially written object.
+    """
+
+    def __init__ (self):
+        self._objects_dir = f'{GIT_DIR}/objects'
+        self._fanout = get_object_format () == 'fanout'
+        os.makedirs (self._objects_dir, exist_ok=True)
+        fd, self._tmp_path = tempfile.mkstemp (dir=self._objects_dir, prefix='tmp_obj_')
+        self._out = os.fdopen (fd, 'wb')
+        self._sha = hashlib.sha1 ()
+        self._compressor = zlib.compressobj () if self._fanout else None
+
+    def write (self, chunk):
+        self._sha.update (chunk)
+        if self._compressor:
+            chunk = self._compressor.compress (chunk)
+        self._out.write (chunk)
+
+    def close (self):
+        """Move the object into place and return its oid."""
+        if self._compressor:
+            self._out.write (self._compressor.flush ())
+        self._out.close ()
+
+        oid = self._sha.hexdigest ()
+        if self._fanout:
+            path = f'{self._objects_dir}/{oid[:2]}/{oid[2:]}'
+        else:
+            path = f'{self._objects_dir}/{oid}'
+        # Objects are immutable, an existing file already has the right content
+        if os.path.isfile (path):
+            os.unlink (self._tmp_path)
+            return oid
+        os.makedirs (os.path.dirname (path), exist_ok=True)
+        # mkstemp creates files only readable by the owner
+        os.chmod (self._tmp_path, 0o644)
+        os.replace (self._tmp_path, path)
+        return oid
+
+    def abort (self):
+        self._out.close ()
+        os.unlink (self._tmp_path)
+
+
+def _write_object (oid, obj):
+    """Store a raw object (type header included) in the repository's format."""
+    if get_object_format () == 'flat':
+        path = _flat_path (oid)
+        if not os.path.isfile (path):
+            _write_file_atomic (path, obj)
+        return
+
+    path = _fanout_path (oid)
+    # Objects are immutable, an existing file already has the right content
+    if os.path.isfile (path):
+        return
+    _write_file_atomic (path, zlib.compress (obj))
+
+
+def _write_file_atomic (path, content):
+    """Write content to a temporary file next to path and rename it into place."""
+    dirname = os.path.dirname (path)
+    os.makedirs (dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp (dir=dirname, prefix='tmp_')
+    try:
+        with os.fdopen (fd, 'wb') as out:
+            out.write (content)
+        # mkstemp creates files only readable by the owner
+        os.chmod (tmp_path, 0o644)
+        os.replace (tmp_path, path)
+    except BaseException:
+        os.unlink (tmp_path)
+        raise
+
+
+# Open packs, keyed by pack directory and validated against its stat data
+_pack_cache = {}
+
+def _get_packs ():
+    """Return the PackFile objects of the current repository."""
+    pack_dir = f'{GIT_DIR}/objects/pack'
+    # Adding or removing a pack changes the directory's mtime
+    key = _stat_key (pack_dir)
+    cached = _pack_cache.get (pack_dir)
+    if cached is None or cached[0] != key:
+        packs = []
+        if key is not None:
+            for name in sorted (os.listdir (pack_dir)):
+                if name.endswith ('.idx'):
+                    packs.append (pack.PackFile (f'{pack_dir}/{name}'))
+        cached = (key, packs)
+        _pack_cache[pack_dir] = cached
+    return cached[1]
+
+
+def _read_object (oid):
+    """
+    Read a raw object (type header included) from loose storage or packs.
+
+    Raises:
+        FileNotFoundError: If the object doesn't exist
+    """
+    try:
+        with open (_fanout_path (oid), 'rb') as f:
+            return zlib.decompress (f.read ())
+    except FileNotFoundError:
+        pass
+    try:
+        with open (_flat_path (oid), 'rb') as f:
+            return f.read ()
+    except FileNotFoundError:
+        pass
+    for pack_file in _get_packs ():
+        found = pack_file.read (oid)
+        if found:
+            type_, content = found
+            return type_.encode () + b'\x00' + content
+    raise FileNotFoundError (f'Object {oid} not found')
+
+
+# Loaded commit-graph chains, keyed by chain file and validated against its
+# stat data (the chain file is replaced whenever the graph changes)
+_commit_graph_cache = {}
+
+def get_commit_graph ():
+    """
+    Return the commit graph of the repository.
+
+    Returns:
+        commit_graph.CommitGraph: The graph, or None if none was written
+    """
+    info_dir = f'{GIT_DIR}/objects/info'
+    chain_path = f'{info_dir}/{commit_graph.CHAIN_FILE}'
+    key = _stat_key (chain_path)
+    cached = _commit_graph_cache.get (chain_path)
+    if cached is None or cached[0] != key:
+        cached = (key, commit_graph.load (info_dir) if key else None)
+        _commit_graph_cache[chain_path] = cached
+    return cached[1]
+
+
+def write_commit_graph (commits, incremental=True):
+    """
+    Write commits to the commit graph.
+
+    Args:
+        commits: Dict mapping commit oids to (tree oid, parent oids)
+        incremental: Add a layer to the existing graph instead of
+            replacing it; parents must then be in commits or the graph
+    """
+    graph = get_commit_graph () if incremental else None
+    commit_graph.write (f'{GIT_DIR}/objects/info', commits, graph)
+
+
+def _open_raw_chunks (oid):
+    """
+    Open an object for streaming.
+
+    The object's file is located and opened immediately, so the result can
+    be consumed after GIT_DIR has changed again.
+
+    Returns:
+        iterator: Chunks of the raw object (type header included)
+
+    Raises:
+        FileNotFoundError: If the object doesn't exist
+    """
+    try:
+        f = open (_fanout_path (oid), 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        def inflate ():
+            with f:
+                decompressor = zlib.decompressobj ()
+                for chunk in iter (lambda: f.read (CHUNK_SIZE), b''):
+                    # Bound the output of highly compressible chunks
+                    while chunk:
+                        out = decompressor.decompress (chunk, CHUNK_SIZE * 16)
+                        if out:
+                            yield out
+                        chunk = decompressor.unconsumed_tail
+                tail = decompressor.flush ()
+                if tail:
+                    yield tail
+        return inflate ()
+
+    try:
+        f = open (_flat_path (oid), 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        def read ():
+            with f:
+                yield from iter (lambda: f.read (CHUNK_SIZE), b'')
+        return read ()
+
+    # Packed objects may be deltas and are only available as a whole
+    return iter ([_read_object (oid)])
+
+
+def stream_object (oid, expected='blob'):
+    """
+    Read an object's content in chunks, without loading it as a whole.
+
+    Args:
+        oid: Object ID
+        expected: Expected object type, or None to accept any
+
+    Returns:
+        iterator: Chunks of the object's content
+    """
+    cached = object_cache.get (oid)
+    if cached is not None:
+        type_, content = cached
+        chunks = iter ([content])
+    else:
+        raw_chunks = _open_raw_chunks (oid)
+        header = b''
+        for chunk in raw_chunks:
+            header += chunk
+            if b'\x00' in header:
+                break
+        type_, _, first = header.partition (b'\x00')
+        type_ = type_.decode ()
+        chunks = itertools.chain ([first], raw_chunks)
+
+    if expected is not None:
+        assert type_ == expected, f'Expected {expected}, got {type_}'
+    return (chunk for chunk in chunks if chunk)
+
+
+def copy_object (oid, out, expected='blob'):
+    """
+    Write an object's content to a binary file object in chunks.
+
+    Args:
+        oid: Object ID
+        out: Writable binary file object
+        expected: Expected object type, or None to accept any
+    """
+    for chunk in stream_object (oid, expected):
+        out.write (chunk)
+
+
+def _copy_raw_object (oid, chunks):
+    """Store raw object chunks from another repository, checking the oid."""
+    writer = _ObjectWriter ()
+    try:
+        for chunk in chunks:
+            writer.write (chunk)
+    except BaseException:
+        writer.abort ()
+        raise
+    written = writer.close ()
+    assert written == oid, f'Object {oid} is corrupt, its content hashes to {written}'
+
+
+def _is_loose (oid):
+    return os.path.isfile (_fanout_path (oid)) or os.path.isfile (_flat_path (oid))
+
+
+def pack_objects (oids):
+    """
+    Move loose objects into a new pack.
+
+    Args:
+        oids: Object IDs to pack; objects that aren't loose are skipped
+
+    Returns:
+        int: Number of objects packed
+    """
+    oids = [oid for oid in dict.fromkeys (oids) if _is_loose (oid)]
+    if not oids:
+        return 0
+
+    def read_object (oid):
+        type_, _, content = _read_object (oid).partition (b'\x00')
+        return type_.decode (), content
+
+    pack.write_pack (f'{GIT_DIR}/objects/pack', oids, read_object)
+
+    # The pack is in place, the loose copies are now redundant
+    for oid in oids:
+        for path in (_fanout_path (oid), _flat_path (oid)):
+            if os.path.isfile (path):
+                os.remove (path)
+        try:
+            os.rmdir (os.path.dirname (_fanout_path (oid)))
+        except OSError:
+            pass
+    return len (oids)
+
+
+def get_object (oid, expected='blob'):
+    cached = object_cache.get (oid)
+    if cached is None:
+        type_, _, content = _read_object (oid).partition (b'\x00')
+        type_ = type_.decode ()
+        object_cache.put (oid, (type_, content), len (content))
+    else:
+        type_, content = cached
 
     if expected is not None:
         assert type_ == expected, f'Expected {expected}, got {type_}'
@@ -184,7 +1322,102 @@ def get_object (oid, expected='blob'):
 
 
 def object_exists (oid):
-    return os.path.isfile (f'{GIT_DIR}/objects/{oid}')
+    return _is_loose (oid) or any (oid in p for p in _get_packs ())
+
+
+# Sorted directory listings of loose objects, validated against the
+# directory's stat data
+_loose_names_cache = {}
+
+def _loose_names (dirpath):
+    key = _stat_key (dirpath)
+    if key is None:
+        return []
+    cached = _loose_names_cache.get (dirpath)
+    if cached is None or cached[0] != key:
+        cached = (key, sorted (os.listdir (dirpath)))
+        # A file added later in the same mtime tick wouldn't change the key
+        if time.time_ns () - key[1] > 1_000_000_000:
+            _loose_names_cache[dirpath] = cached
+    return cached[1]
+
+
+def _iter_loose_prefix (prefix):
+    """Yield the loose oids starting with a hex prefix of at least 2 digits."""
+    objects_dir = f'{GIT_DIR}/objects'
+    # Fan-out layout: only the directory of the first byte can match
+    names = _loose_names (f'{objects_dir}/{prefix[:2]}')
+    rest = prefix[2:]
+    for name in itertools.islice (names, bisect_left (names, rest), None):
+        if not name.startswith (rest):
+            break
+        if len (name) == 38:
+            yield prefix[:2] + name
+    # Flat layout
+    names = _loose_names (objects_dir)
+    for name in itertools.islice (names, bisect_left (names, prefix), None):
+        if not name.startswith (prefix):
+            break
+        if len (name) == 40:
+            yield name
+
+
+def find_oids_by_prefix (prefix):
+    """
+    Find the objects whose oid starts with a hex prefix.
+
+    Loose objects are found through the prefix's fan-out directory and a
+    sorted listing of the flat objects directory, packed objects with a
+    binary search of each pack index.
+
+    Args:
+        prefix: Hex prefix of at least 2 digits
+
+    Returns:
+        list: Matching oids, sorted
+    """
+    prefix = prefix.lower ()
+    oids = set (_iter_loose_prefix (prefix))
+    for p in _get_packs ():
+        oids.update (p.iter_prefix (prefix))
+    return sorted (oids)
+
+
+def expand_oid (prefix):
+    """
+    Resolve an abbreviated oid.
+
+    Args:
+        prefix: Hex prefix of at least MIN_ABBREV digits
+
+    Returns:
+        str: The full oid, or None if no object matches
+
+    Raises:
+        Exception: If more than one object matches
+    """
+    assert len (prefix) >= MIN_ABBREV, f'Short object ID {prefix} is too short'
+    matches = find_oids_by_prefix (prefix)
+    if len (matches) > 1:
+        raise Exception (f'Short object ID {prefix} is ambiguous, candidates: '
+                         + ', '.join (matches))
+    return matches[0] if matches else None
+
+
+def abbreviate (oid, min_length=MIN_ABBREV):
+    """
+    Return the shortest prefix of oid that no other object shares.
+
+    Args:
+        oid: Full object ID
+        min_length: Shortest prefix to return
+    """
+    length = min_length
+    for other in find_oids_by_prefix (oid[:min_length]):
+        if other != oid:
+            common = len (os.path.commonprefix ([oid, other]))
+            length = max (length, common + 1)
+    return oid[:length]
 
 
 def fetch_object_if_missing (oid, remote_path):
@@ -194,26 +1427,148 @@ def fetch_object_if_missing (oid, remote_path):
         
     # Ensure objects directory exists
     os.makedirs(f'{GIT_DIR}/objects', exist_ok=True)
-    
-    remote_git_dir = f'{remote_path}/.pygit'
-    src = f'{remote_git_dir}/objects/{oid}'
-    dst = f'{GIT_DIR}/objects/{oid}'
-    
-    shutil.copy(src, dst)
 
-def push_object (oid, remote_path):
-    """Push an object to a remote repository"""
-    remote_git_dir = f'{remote_path}/.pygit'
-    
-    # Ensure remote objects directory exists
-    os.makedirs(f'{remote_git_dir}/objects', exist_ok=True)
-    
-    src = f'{GIT_DIR}/objects/{oid}'
-    dst = f'{remote_git_dir}/objects/{oid}'
-    
-    shutil.copy(src, dst)
+    # The remote may use a different object format, so copy the raw object
+    with change_git_dir (remote_path):
+        chunks = _open_raw_chunks (oid)
+    _copy_raw_object (oid, chunks)
+
+def fetch_objects (oids, remote_path, workers=None):
+    """
+    Copy the objects missing locally from a remote repository in parallel.
+
+    GIT_DIR is global, so remote objects are opened in batches under the
+    remote's GIT_DIR first; a pool of threads then inflates, verifies and
+    stores them locally.
+
+    Args:
+        oids: Object IDs to copy
+        remote_path: Path to the remote repository
+        workers: Number of threads, defaults to HASH_WORKERS
+
+    Returns:
+        int: Number of objects copied
+    """
+    oids = [oid for oid in dict.fromkeys (oids) if not object_exists (oid)]
+    if not oids:
+        return 0
+    os.makedirs (f'{GIT_DIR}/objects', exist_ok=True)
+
+    with ThreadPoolExecutor (max_workers=workers or HASH_WORKERS) as executor:
+        for start in range (0, len (oids), TRANSFER_BATCH_OBJECTS):
+            batch = oids[start:start + TRANSFER_BATCH_OBJECTS]
+            with change_git_dir (remote_path):
+                opened = [_open_raw_chunks (oid) for oid in batch]
+            # Consume the results so errors are raised
+            list (executor.map (_copy_raw_object, batch, opened))
+    return len (oids)
+
+
+def migrate_objects ():
+    """
+    Convert a flat object store to the fan-out format in place.
+
+    Every object is written to its fan-out location before the flat copy is
+    removed, so an interrupted migration leaves a readable store and can
+    simply be run again.
+
+    Returns:
+        int: Number of objects migrated
+    """
+    set_config ('object_format', 'fanout')
+    objects_dir = f'{GIT_DIR}/objects'
+    migrated = 0
+    for name in os.listdir (objects_dir):
+        path = f'{objects_dir}/{name}'
+        is_oid = len (name) == 40 and all (c in string.hexdigits for c in name)
+        if not is_oid or not os.path.isfile (path):
+            continue
+        with open (path, 'rb') as f:
+            obj = f.read ()
+        _write_object (name, obj)
+        os.remove (path)
+        migrated += 1
+    return migrated
+
+# ioctl request cloning a whole file on filesystems with reflinks (Linux)
+_FICLONE = 0x40049409
+
+
+def _clone_file (src, dst):
+    """
+    Copy a file as cheaply as the filesystem allows: a hard link, else a
+    reflink, else an in-kernel copy_file_range, else a plain copy. Objects
+    never change once written, so sharing their storage is safe.
+
+    Returns:
+        str: How the file was copied: 'link', 'reflink' or 'copy'
+    """
+    try:
+        os.link (src, dst)
+        return 'link'
+    except OSError:
+        pass
+
+    dirname = os.path.dirname (dst)
+    fd, tmp_path = tempfile.mkstemp (dir=dirname, prefix='tmp_')
+    try:
+        with open (src, 'rb') as fin, os.fdopen (fd, 'wb') as fout:
+            method = 'copy'
+            try:
+                fcntl.ioctl (fout.fileno (), _FICLONE, fin.fileno ())
+                method = 'reflink'
+            except (AttributeError, OSError):
+                # No fcntl on this platform, or no reflink support
+                size = os.fstat (fin.fileno ()).st_size
+                copied = 0
+                try:
+                    while copied < size:
+                        n = os.copy_file_range (fin.fileno (), fout.fileno (),
+                                                size - copied)
+                        if not n:
+                            break
+                        copied += n
+                except (AttributeError, OSError):
+                    fin.seek (copied)
+                    fout.seek (copied)
+                    shutil.copyfileobj (fin, fout, CHUNK_SIZE)
+        os.chmod (tmp_path, 0o644)
+        os.replace (tmp_path, dst)
+    except BaseException:
+        os.unlink (tmp_path)
+        raise
+    return method
+
+
+def clone_objects (remote_path):
+    """
+    Copy every object, pack and commit-graph file of another repository
+    into this one, sharing storage with it where possible.
+
+    Args:
+        remote_path: Path to the repository to copy from
 
-def init():
+    Returns:
+        dict: Number of files copied per method ('link', 'reflink', 'copy')
+    """
+    with change_git_dir (remote_path):
+        source = f'{GIT_DIR}/objects'
+    target = f'{GIT_DIR}/objects'
+    counts = {}
+    for root, _, filenames in os.walk (source):
+        target_root = os.path.join (target, os.path.relpath (root, source))
+        os.makedirs (target_root, exist_ok=True)
+        for filename in filenames:
+            # Skip files of interrupted writes
+            if filename.startswith ('tmp_'):
+                continue
+            method = _clone_file (os.path.join (root, filename),
+                                  os.path.join (target_root, filename))
+            counts[method] = counts.get (method, 0) + 1
+    return counts
+
+
+def init(object_format=DEFAULT_OBJECT_FORMAT):
     """Initialize repository data structures."""
     if not os.path.exists(GIT_DIR):
         os.makedirs(GIT_DIR)
@@ -226,6 +1581,7 @@ def init():
             f.write('ref: refs/heads/master\n')
 
         # Create empty index
-        with open(f'{GIT_DIR}/index', 'w') as f:
-            json.dump({}, f)
+        Index(f'{GIT_DIR}/index').write()
+
+        set_config('object_format', object_format)
 
@@ -1,9 +1,19 @@
 """Diff and merge operations for PyGit."""
 
+from bisect import bisect_left
+import codecs
 from collections import defaultdict
 import os
 from . import data
 
+DIFF_ALGORITHMS = ('myers', 'patience')
+DEFAULT_CONTEXT = 3
+
+# Blobs are classified as binary from this many leading bytes
+BINARY_SNIFF_BYTES = 8000
+# Files larger than this are summarized instead of diffed line by line
+DIFF_MAX_BYTES = int(os.environ.get('PYGIT_DIFF_MAX_BYTES', 16 * 1024 * 1024))
+
 def compare_trees(*trees):
     """Compare multiple trees and yield their differences."""
     entries = defaultdict(lambda: [None] * len(trees))
@@ -14,95 +24,620 @@ def compare_trees(*trees):
     for path, oids in entries.items():
         yield (path, *oids)
 
+def iter_tree_changes(*trees):
+    """
+    Yield (path, *oids) for the paths whose oids differ between trees.
+
+    Args:
+        trees: Mappings of paths to OIDs, or tree OIDs (None for an empty
+            tree). When all trees are OIDs they are walked together and
+            subtrees shared by all of them are skipped; otherwise the trees
+            are flattened and compared path by path.
+    """
+    # base imports this module, so it is only imported when needed
+    from . import base
+
+    if all(tree is None or isinstance(tree, str) for tree in trees):
+        yield from base.iter_tree_changes(*trees)
+        return
+
+    trees = [tree if isinstance(tree, dict) else base.get_tree(tree)
+             for tree in trees]
+    for path, *oids in compare_trees(*trees):
+        if len(set(oids)) > 1:
+            yield (path, *oids)
+
 def iter_changed_files(t_from, t_to):
     """Iterate through changed files between two trees."""
-    for path, o_from, o_to in compare_trees(t_from, t_to):
-        if o_from != o_to:
-            action = ('new file' if not o_from else
-                     'deleted' if not o_to else
-                     'modified')
-            yield path, action
-
-def is_text_file(path):
-    """Check if a file is a text file based on extension"""
-    text_extensions = {
-        '.txt', '.md', '.py', '.js', '.css', '.html', '.json', 
-        '.yml', '.yaml', '.xml', '.csv', '.ini', '.conf',
-        '.sh', '.bat', '.ps1', '.c', '.cpp', '.h', '.java',
-        '.rb', '.php', '.pl', '.sql', '.go', '.rs', '.ts'
-    }
-    return os.path.splitext(path)[1].lower() in text_extensions
-
-def diff_trees(t_from, t_to):
-    """Generate readable diff between two trees."""
-    output = []
-    
-    for path, o_from, o_to in compare_trees(t_from, t_to):
-        if o_from != o_to:
-            # Add file header
-            output.append(f"\nFile: {path}")
-            output.append("=" * (len(path) + 6))
-            
-            # Skip binary files
-            if not is_text_file(path):
-                output.append("Binary file")
-                continue
-                
-            # Get file contents
-            old_content = data.get_object(o_from).decode('utf-8', errors='replace') if o_from else ""
-            new_content = data.get_object(o_to).decode('utf-8', errors='replace') if o_to else ""
-            
-            # Show changes
-            if not o_from:
-                output.append("New file added:")
-                output.append("+++ New content")
-                output.extend("+ " + line for line in new_content.splitlines())
-            elif not o_to:
-                output.append("File deleted:")
-                output.append("--- Previous content")
-                output.extend("- " + line for line in old_content.splitlines())
+    for path, o_from, o_to in iter_tree_changes(t_from, t_to):
+        action = ('new file' if not o_from else
+                 'deleted' if not o_to else
+                 'modified')
+        yield path, action
+
+def _hash_lines(a, b):
+    """Map the lines of a and b to integers, equal lines to equal integers."""
+    ids = {}
+    return ([ids.setdefault(line, len(ids)) for line in a],
+            [ids.setdefault(line, len(ids)) for line in b])
+
+def _trim(a, alo, ahi, b, blo, bhi, matches):
+    """
+    Match the common prefix and suffix of two ranges.
+
+    Returns:
+        tuple: (alo, ahi, blo, bhi, suffix matches) of what is left
+    """
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        matches.append((alo, blo))
+        alo += 1
+        blo += 1
+    suffix = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix.append((ahi, bhi))
+    suffix.reverse()
+    return alo, ahi, blo, bhi, suffix
+
+def _middle_snake(a, alo, ahi, b, blo, bhi):
+    """
+    Find the middle snake of a shortest edit script, walking from both ends.
+
+    Returns:
+        tuple: (x, y, u, v), the snake runs from (x, y) to (u, v)
+    """
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    forward = {1: 0}
+    backward = {1: 0}
+    for d in range((n + m + 1) // 2 + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1]
+            else:
+                x = forward[k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and \
+                    x + backward[delta - k] >= n:
+                return alo + x0, blo + y0, alo + x, blo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[k] = x
+            if not odd and -d <= delta - k <= d and \
+                    x + forward[delta - k] >= n:
+                return ahi - x, bhi - y, ahi - x0, bhi - y0
+    assert False, 'No middle snake found'
+
+def _myers(a, alo, ahi, b, blo, bhi, matches):
+    """Append the matching line pairs of a shortest edit script to matches."""
+    alo, ahi, blo, bhi, suffix = _trim(a, alo, ahi, b, blo, bhi, matches)
+    if alo < ahi and blo < bhi:
+        x, y, u, v = _middle_snake(a, alo, ahi, b, blo, bhi)
+        _myers(a, alo, x, b, blo, y, matches)
+        matches.extend(zip(range(x, u), range(y, v)))
+        _myers(a, u, ahi, b, v, bhi, matches)
+    matches.extend(suffix)
+
+def _patience(a, alo, ahi, b, blo, bhi, matches):
+    """
+    Append matching line pairs to matches, anchoring on the longest
+    increasing sequence of lines that are unique on both sides and falling
+    back to Myers between anchors without unique lines.
+    """
+    alo, ahi, blo, bhi, suffix = _trim(a, alo, ahi, b, blo, bhi, matches)
+    if alo < ahi and blo < bhi:
+        positions = {}
+        for i in range(alo, ahi):
+            positions[a[i]] = None if a[i] in positions else i
+        unique_b = {}
+        for j in range(blo, bhi):
+            if positions.get(b[j]) is not None:
+                unique_b[b[j]] = None if b[j] in unique_b else j
+        anchors = sorted((positions[line], j)
+                         for line, j in unique_b.items() if j is not None)
+
+        # Longest increasing subsequence of b positions, by patience sorting:
+        # tops[p] is the smallest b position ending a sequence of length
+        # p + 1 and ends[p] the anchor it ends with
+        tops = []
+        ends = []
+        previous = []
+        for n, (i, j) in enumerate(anchors):
+            pile = bisect_left(tops, j)
+            previous.append(ends[pile - 1] if pile else None)
+            if pile == len(tops):
+                tops.append(j)
+                ends.append(n)
+            else:
+                tops[pile] = j
+                ends[pile] = n
+
+        if not anchors:
+            _myers(a, alo, ahi, b, blo, bhi, matches)
+        else:
+            chain = []
+            n = ends[-1]
+            while n is not None:
+                chain.append(anchors[n])
+                n = previous[n]
+            for i, j in reversed(chain):
+                _patience(a, alo, i, b, blo, j, matches)
+                matches.append((i, j))
+                alo, blo = i + 1, j + 1
+            _patience(a, alo, ahi, b, blo, bhi, matches)
+    matches.extend(suffix)
+
+def diff_lines(a, b, algorithm='myers'):
+    """
+    Compute the matching lines of two sequences of lines.
+
+    Args:
+        a: Lines of the old side
+        b: Lines of the new side
+        algorithm: One of DIFF_ALGORITHMS
+
+    Returns:
+        list: Matching blocks (i, j, n) meaning a[i:i + n] == b[j:j + n],
+            ending with (len(a), len(b), 0) like difflib's
+    """
+    assert algorithm in DIFF_ALGORITHMS, f'Unknown diff algorithm {algorithm}'
+    a_ids, b_ids = _hash_lines(a, b)
+    matches = []
+    if not set(a_ids).intersection(b_ids):
+        # Nothing in common, so everything is a change
+        pass
+    elif algorithm == 'patience':
+        _patience(a_ids, 0, len(a_ids), b_ids, 0, len(b_ids), matches)
+    else:
+        _myers(a_ids, 0, len(a_ids), b_ids, 0, len(b_ids), matches)
+
+    blocks = []
+    for i, j in matches:
+        if blocks and blocks[-1][0] + blocks[-1][2] == i \
+                and blocks[-1][1] + blocks[-1][2] == j:
+            blocks[-1][2] += 1
+        else:
+            blocks.append([i, j, 1])
+    return [tuple(block) for block in blocks] + [(len(a), len(b), 0)]
+
+def _opcodes(blocks):
+    """Yield (equal, i1, i2, j1, j2) runs covering both sides."""
+    i = j = 0
+    for bi, bj, n in blocks:
+        if i < bi or j < bj:
+            yield False, i, bi, j, bj
+        if n:
+            yield True, bi, bi + n, bj, bj + n
+        i, j = bi + n, bj + n
+
+def _hunk_range(start, count):
+    if count == 1:
+        return f'{start + 1}'
+    # An empty range names the line before it
+    return f'{start + 1 if count else start},{count}'
+
+def unified_diff(a, b, from_file, to_file, context=DEFAULT_CONTEXT,
+                 algorithm='myers'):
+    """
+    Generate a unified diff between two lists of lines.
+
+    Args:
+        a: Lines of the old side as bytes, with line endings
+        b: Lines of the new side as bytes, with line endings
+        from_file: Name of the old side
+        to_file: Name of the new side
+        context: Number of unchanged lines shown around each change
+        algorithm: One of DIFF_ALGORITHMS
+
+    Yields:
+        bytes: Output lines, each ending with a newline
+    """
+    ops = list(_opcodes(diff_lines(a, b, algorithm)))
+    changes = [n for n, (equal, *_) in enumerate(ops) if not equal]
+    if not changes:
+        return
+    yield f'--- {from_file}\n'.encode()
+    yield f'+++ {to_file}\n'.encode()
+
+    # Changes closer than twice the context share a hunk
+    groups = [[changes[0]]]
+    for n in changes[1:]:
+        _, i1, i2, _, _ = ops[n - 1]
+        if i2 - i1 > 2 * context:
+            groups.append([n])
+        else:
+            groups[-1].append(n)
+
+    for group in groups:
+        first, last = group[0], group[-1]
+        _, i1, _, j1, _ = ops[first]
+        _, _, i2, _, j2 = ops[last]
+        lead = trail = 0
+        if first > 0:
+            lead = min(context, ops[first - 1][2] - ops[first - 1][1])
+        if last + 1 < len(ops):
+            trail = min(context, ops[last + 1][2] - ops[last + 1][1])
+        i1, j1, i2, j2 = i1 - lead, j1 - lead, i2 + trail, j2 + trail
+        yield (f'@@ -{_hunk_range(i1, i2 - i1)} '
+               f'+{_hunk_range(j1, j2 - j1)} @@\n').encode()
+
+        lines = [(b' ', a[i]) for i in range(i1, i1 + lead)]
+        for n in range(first, last + 1):
+            equal, oi1, oi2, oj1, oj2 = ops[n]
+            if equal:
+                lines.extend((b' ', a[i]) for i in range(oi1, oi2))
+            else:
+                lines.extend((b'-', a[i]) for i in range(oi1, oi2))
+                lines.extend((b'+', b[j]) for j in range(oj1, oj2))
+        lines.extend((b' ', a[i]) for i in range(i2 - trail, i2))
+        for prefix, line in lines:
+            if line.endswith(b'\n'):
+                yield prefix + line
             else:
-                output.append("File modified:")
-                old_lines = old_content.splitlines()
-                new_lines = new_content.splitlines()
-                
-                # Show side-by-side diff
-                max_lines = max(len(old_lines), len(new_lines))
-                output.append("-" * 40 + "|" + "-" * 40)
-                output.append("Previous Content".ljust(40) + "|" + "New Content".ljust(40))
-                output.append("-" * 40 + "|" + "-" * 40)
-                
-                for i in range(max_lines):
-                    old_line = old_lines[i] if i < len(old_lines) else ""
-                    new_line = new_lines[i] if i < len(new_lines) else ""
-                    if old_line != new_line:
-                        output.append(f"{old_line:<40}|{new_line:<40}  <")
-                    else:
-                        output.append(f"{old_line:<40}|{new_line:<40}")
-                
-                output.append("-" * 40 + "|" + "-" * 40)
-            
-            output.append("\n")
-    
-    return "\n".join(output).encode()
+                yield prefix + line + b'\n\\ No newline at end of file\n'
+
+def is_binary_content(head):
+    """
+    Check whether the leading bytes of a file look binary.
+
+    Args:
+        head: The first BINARY_SNIFF_BYTES of the content, or all of it
+
+    Returns:
+        bool: True if head contains a NUL byte or isn't valid UTF-8
+    """
+    if b'\0' in head:
+        return True
+    try:
+        # A multi-byte character may be cut off at the end of head
+        codecs.getincrementaldecoder('utf-8')().decode(head, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+def blob_info(oid, path=None):
+    """
+    Classify a blob as text or binary and measure it, without reading more
+    than needed. Results are cached per oid.
+
+    Args:
+        oid: Object ID of the blob
+        path: Working file to read instead of the object store
+
+    Returns:
+        tuple: (is_binary, size); sizes above DIFF_MAX_BYTES are reported as
+            DIFF_MAX_BYTES + 1 since counting stops there
+    """
+    key = ('blob-info', oid)
+    info = data.parsed_cache.get(key)
+    if info is not None:
+        return info
+
+    if path is not None:
+        with open(path, 'rb') as f:
+            head = f.read(BINARY_SNIFF_BYTES)
+            size = os.fstat(f.fileno()).st_size
+    else:
+        head = b''
+        size = 0
+        for chunk in data.stream_object(oid):
+            if len(head) < BINARY_SNIFF_BYTES:
+                head += chunk[:BINARY_SNIFF_BYTES - len(head)]
+            size += len(chunk)
+            if size > DIFF_MAX_BYTES:
+                break
+    info = (is_binary_content(head), min(size, DIFF_MAX_BYTES + 1))
+    data.parsed_cache.put(key, info, 16)
+    return info
+
+def _summarize(path, o_from, o_to, to_working):
+    """
+    Explain why a changed path isn't diffed line by line.
+
+    Returns:
+        str: 'Binary file' or a size note, or None if it should be diffed
+    """
+    infos = []
+    if o_from:
+        infos.append(blob_info(o_from))
+    if o_to:
+        infos.append(blob_info(o_to, path if to_working else None))
+    if any(binary for binary, _ in infos):
+        return 'Binary file'
+    if any(size > DIFF_MAX_BYTES for _, size in infos):
+        return f'File larger than {DIFF_MAX_BYTES} bytes, not shown'
+    return None
+
+def _read_blob(oid, path=None):
+    """Read blob contents from the object store, or from path if given."""
+    if path is not None:
+        with open(path, 'rb') as f:
+            return f.read()
+    return data.get_object(oid)
+
+def _unified_file_diff(path, o_from, o_to, to_working, context, algorithm):
+    """Return the unified diff lines of one changed path as bytes."""
+    output = [f'diff --git a/{path} b/{path}\n'.encode()]
+    if not o_from:
+        output.append(b'new file\n')
+    elif not o_to:
+        output.append(b'deleted file\n')
+    summary = _summarize(path, o_from, o_to, to_working)
+    if summary == 'Binary file':
+        output.append(f'Binary files a/{path} and b/{path} differ\n'.encode())
+        return output
+    if summary:
+        output.append(f'{summary}\n'.encode())
+        return output
+
+    old_lines = data.get_object(o_from).splitlines(keepends=True) if o_from else []
+    new_lines = (_read_blob(o_to, path if to_working else None).splitlines(keepends=True)
+                 if o_to else [])
+    output.extend(unified_diff(old_lines, new_lines,
+                               f'a/{path}' if o_from else '/dev/null',
+                               f'b/{path}' if o_to else '/dev/null',
+                               context, algorithm))
+    return output
+
+def _side_by_side_file_diff(path, o_from, o_to, to_working, algorithm):
+    """Return the side-by-side view of one changed path as lines of text."""
+    # Add file header
+    output = [f"\nFile: {path}"]
+    output.append("=" * (len(path) + 6))
+
+    # Skip binary and very large files
+    summary = _summarize(path, o_from, o_to, to_working)
+    if summary:
+        output.append(summary)
+        return output
+
+    # Get file contents
+    old_content = data.get_object(o_from).decode('utf-8', errors='replace') if o_from else ""
+    new_content = _read_blob(o_to, path if to_working else None).decode('utf-8', errors='replace') if o_to else ""
+
+    # Show changes
+    if not o_from:
+        output.append("New file added:")
+        output.append("+++ New content")
+        output.extend("+ " + line for line in new_content.splitlines())
+    elif not o_to:
+        output.append("File deleted:")
+        output.append("--- Previous content")
+        output.extend("- " + line for line in old_content.splitlines())
+    else:
+        output.append("File modified:")
+        old_lines = old_content.splitlines()
+        new_lines = new_content.splitlines()
+
+        # Show side-by-side diff, with matching lines aligned
+        output.append("-" * 40 + "|" + "-" * 40)
+        output.append("Previous Content".ljust(40) + "|" + "New Content".ljust(40))
+        output.append("-" * 40 + "|" + "-" * 40)
+
+        blocks = diff_lines(old_lines, new_lines, algorithm)
+        for equal, i1, i2, j1, j2 in _opcodes(blocks):
+            for k in range(max(i2 - i1, j2 - j1)):
+                old_line = old_lines[i1 + k] if i1 + k < i2 else ""
+                new_line = new_lines[j1 + k] if j1 + k < j2 else ""
+                if equal:
+                    output.append(f"{old_line:<40}|{new_line:<40}")
+                else:
+                    output.append(f"{old_line:<40}|{new_line:<40}  <")
+
+        output.append("-" * 40 + "|" + "-" * 40)
+
+    output.append("\n")
+    return output
+
+def iter_diff(t_from, t_to, to_working=False, unified=None, algorithm='myers'):
+    """
+    Generate readable diff between two trees, one changed path at a time.
+
+    Args:
+        t_from: Mapping of paths to OIDs or tree OID for the old side
+        t_to: Mapping of paths to OIDs or tree OID for the new side
+        to_working: Whether t_to describes the working tree, whose blobs
+            are read from the files since they are not in the object store
+        unified: Number of context lines for a unified diff, or None for the
+            side-by-side view
+        algorithm: Line diff algorithm, one of DIFF_ALGORITHMS
+
+    Yields:
+        bytes: The diff of each changed path
+    """
+    for path, o_from, o_to in iter_tree_changes(t_from, t_to):
+        if unified is not None:
+            yield b''.join(_unified_file_diff(path, o_from, o_to, to_working,
+                                              unified, algorithm))
+        else:
+            lines = _side_by_side_file_diff(path, o_from, o_to, to_working,
+                                            algorithm)
+            yield ("\n".join(lines) + "\n").encode()
+
+def diff_trees(t_from, t_to, to_working=False, unified=None, algorithm='myers'):
+    """
+    Generate readable diff between two trees.
+
+    Takes the same arguments as iter_diff and returns its output as a whole.
+    """
+    return b''.join(iter_diff(t_from, t_to, to_working, unified, algorithm))
+
+def iter_name_only(t_from, t_to):
+    """Yield the changed paths between two trees, without reading any blob."""
+    for path, _, _ in iter_tree_changes(t_from, t_to):
+        yield f'{path}\n'.encode()
+
+def iter_stat(t_from, t_to, to_working=False, algorithm='myers'):
+    """
+    Yield a diffstat: changed lines per path and a summary line.
+
+    Counting lines needs the text of both sides of each changed path, but
+    only one path is held at a time, and binary and oversized blobs are
+    summarized from their sniffed header without being loaded.
+
+    Yields:
+        bytes: One line per changed path, then the summary
+    """
+    files = insertions = deletions = 0
+    for path, o_from, o_to in iter_tree_changes(t_from, t_to):
+        files += 1
+        summary = _summarize(path, o_from, o_to, to_working)
+        if summary == 'Binary file':
+            yield f' {path} | Bin\n'.encode()
+            continue
+        if summary:
+            yield f' {path} | Large\n'.encode()
+            continue
+
+        old_lines = data.get_object(o_from).splitlines() if o_from else []
+        new_lines = (_read_blob(o_to, path if to_working else None).splitlines()
+                     if o_to else [])
+        added = removed = 0
+        for equal, i1, i2, j1, j2 in _opcodes(diff_lines(old_lines, new_lines,
+                                                         algorithm)):
+            if not equal:
+                removed += i2 - i1
+                added += j2 - j1
+        insertions += added
+        deletions += removed
+        # Scale the bar down for large changes
+        scale = min(1, 50 / max(1, added + removed))
+        bar = '+' * round(added * scale) + '-' * round(removed * scale)
+        yield f' {path} | {added + removed} {bar}\n'.encode()
+
+    if files:
+        yield (f' {files} file{"s" if files != 1 else ""} changed, '
+               f'{insertions} insertions(+), {deletions} deletions(-)\n').encode()
 
 def merge_trees(t_base, t_HEAD, t_other):
-    """Merge three trees and return the merged tree"""
-    tree = {}
-    for path, o_base, o_HEAD, o_other in compare_trees(t_base, t_HEAD, t_other):
-        tree[path] = data.hash_object(merge_blobs(o_base, o_HEAD, o_other))
+    """
+    Merge three trees and return the merged tree.
+
+    Args:
+        t_base: Mapping of paths to OIDs or tree OID of the merge base
+        t_HEAD: Mapping of paths to OIDs or tree OID of HEAD
+        t_other: Mapping of paths to OIDs or tree OID of the other side
+
+    Returns:
+        dict: Mapping of paths to OIDs. Paths changed on at most one side,
+            or the same way on both, keep that side's oid without being
+            read; only paths changed differently on both sides are merged
+            line by line.
+    """
+    from . import base
+
+    tree = dict(t_HEAD) if isinstance(t_HEAD, dict) else base.get_tree(t_HEAD)
+    for path, o_base, o_HEAD, o_other in iter_tree_changes(t_base, t_HEAD, t_other):
+        if o_HEAD == o_other or o_base == o_other:
+            oid = o_HEAD
+        elif o_base == o_HEAD:
+            oid = o_other
+        elif not o_HEAD or not o_other:
+            # Modified on one side and deleted on the other: keep the
+            # modified version
+            oid = o_HEAD or o_other
+        else:
+            oid = data.hash_object(merge_blobs(o_base, o_HEAD, o_other))
+
+        if oid:
+            tree[path] = oid
+        else:
+            tree.pop(path, None)
     return tree
 
+def _conflict(ours, theirs):
+    """Wrap two conflicting sets of lines in conflict markers."""
+    def terminated(lines):
+        if lines and not lines[-1].endswith(b'\n'):
+            return lines[:-1] + [lines[-1] + b'\n']
+        return lines
+    return ([b'<<<<<<< HEAD\n'] + terminated(ours) + [b'=======\n'] +
+            terminated(theirs) + [b'>>>>>>>\n'])
+
+def merge_lines(base_lines, ours, theirs, algorithm='myers'):
+    """
+    Merge two edited versions of a list of lines, diff3 style.
+
+    Base lines kept by both sides split the files into stable regions and
+    the changed regions between them. A changed region edited on one side
+    only, or identically on both, is resolved automatically; regions edited
+    differently on both sides become conflicts.
+
+    Returns:
+        tuple: (merged lines, number of conflicts)
+    """
+    ours_at = {}
+    for i, j, n in diff_lines(base_lines, ours, algorithm):
+        ours_at.update((i + t, j + t) for t in range(n))
+    theirs_at = {}
+    for i, k, n in diff_lines(base_lines, theirs, algorithm):
+        theirs_at.update((i + t, k + t) for t in range(n))
+
+    merged = []
+    conflicts = 0
+    i = j = k = 0
+    # Base lines matched on both sides, plus a sentinel past the end
+    stable = [line for line in range(len(base_lines))
+              if line in ours_at and line in theirs_at]
+    stable.append(len(base_lines))
+    for line in stable:
+        if line < i:
+            continue
+        end_j = ours_at.get(line, len(ours))
+        end_k = theirs_at.get(line, len(theirs))
+        base_part = base_lines[i:line]
+        ours_part = ours[j:end_j]
+        theirs_part = theirs[k:end_k]
+        if ours_part == base_part or ours_part == theirs_part:
+            merged.extend(theirs_part)
+        elif theirs_part == base_part:
+            merged.extend(ours_part)
+        else:
+            merged.extend(_conflict(ours_part, theirs_part))
+            conflicts += 1
+
+        if line < len(base_lines):
+            merged.append(ours[end_j])
+        i, j, k = line + 1, end_j + 1, end_k + 1
+    return merged, conflicts
+
 def merge_blobs(o_base, o_HEAD, o_other):
-    """Simple merge strategy: take the changed version"""
-    if o_HEAD == o_other:
-        return data.get_object(o_HEAD)
-    elif o_base == o_HEAD:
-        return data.get_object(o_other)
-    elif o_base == o_other:
-        return data.get_object(o_HEAD)
-    else:
-        # Conflict - take HEAD version but indicate conflict
-        content = data.get_object(o_HEAD)
-        return b'<<<<<<< HEAD\n' + content + b'\n=======\n' + data.get_object(o_other) + b'\n>>>>>>>\n'
+    """
+    Merge the contents of two versions of a blob with their common base.
+
+    Args:
+        o_base: Blob OID in the merge base, or None
+        o_HEAD: Blob OID in HEAD, or None
+        o_other: Blob OID on the other side, or None
+
+    Returns:
+        bytes: Merged content, with conflict markers around the regions
+            changed differently on both sides
+    """
+    if o_HEAD == o_other or o_base == o_other:
+        return data.get_object(o_HEAD) if o_HEAD else b''
+    if o_base == o_HEAD:
+        return data.get_object(o_other) if o_other else b''
+
+    def read_lines(oid):
+        return data.get_object(oid).splitlines(keepends=True) if oid else []
 
+    merged, _ = merge_lines(read_lines(o_base), read_lines(o_HEAD),
+                            read_lines(o_other))
+    return b''.join(merged)
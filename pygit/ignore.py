@@ -0,0 +1,232 @@
+"""Ignore rules for PyGit.
+
+Patterns are read from ``.pygitignore`` files in the working tree root and
+any subdirectory, following gitignore semantics:
+
+- blank lines and lines starting with ``#`` are skipped
+- ``!pattern`` re-includes paths excluded by an earlier pattern
+- a trailing ``/`` only matches directories
+- a pattern containing a ``/`` elsewhere is anchored to the directory of
+  its ignore file, otherwise it matches a name at any depth below it
+- ``*``, ``?`` and ``[...]`` match within a path component, ``**`` matches
+  across components
+- the last matching pattern wins, patterns in deeper ignore files take
+  precedence, and nothing below an ignored directory can be re-included
+
+Each ignore file is compiled into a single regular expression and cached
+until the file's stat data changes.
+"""
+
+import os
+import re
+
+IGNORE_FILE = '.pygitignore'
+
+# The repository directory itself is always ignored
+ALWAYS_IGNORED = '.pygit'
+
+
+def _translate_glob (pattern):
+    """Translate a gitignore glob to a regular expression string."""
+    out = []
+    i = 0
+    n = len (pattern)
+    while i < n:
+        c = pattern[i]
+        if pattern.startswith ('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            out.append ('(?:.*/)?')
+            i += 3
+        elif pattern.startswith ('**', i) and i + 2 == n and (i == 0 or pattern[i - 1] == '/'):
+            out.append ('.*')
+            i += 2
+        elif c == '*':
+            out.append ('[^/]*')
+            i += 1
+        elif c == '?':
+            out.append ('[^/]')
+            i += 1
+        elif c == '[':
+            end = pattern.find (']', i + 2)
+            if end == -1:
+                out.append (re.escape (c))
+                i += 1
+                continue
+            body = pattern[i + 1:end]
+            if body.startswith ('!'):
+                body = '^' + body[1:]
+            out.append ('[' + body.replace ('\\', '\\\\') + ']')
+            i = end + 1
+        elif c == '\\' and i + 1 < n:
+            out.append (re.escape (pattern[i + 1]))
+            i += 2
+        else:
+            out.append (re.escape (c))
+            i += 1
+    return ''.join (out)
+
+
+class IgnoreRules:
+    """The compiled patterns of one ignore file."""
+
+    def __init__ (self, lines):
+        patterns = []
+        for line in lines:
+            line = line.rstrip ('\n').rstrip ()
+            if not line or line.startswith ('#'):
+                continue
+            negate = line.startswith ('!')
+            if negate:
+                line = line[1:]
+            elif line.startswith ('\\'):
+                line = line[1:]
+            dir_only = line.endswith ('/')
+            line = line.rstrip ('/')
+            if not line:
+                continue
+            anchored = '/' in line
+            regex = _translate_glob (line.lstrip ('/'))
+            if not anchored:
+                regex = '(?:.*/)?' + regex
+            patterns.append ((regex, negate, dir_only))
+
+        self.patterns = patterns
+        # The last matching pattern wins, so alternatives are tried in
+        # reverse order and the name of the matching group tells which
+        # pattern it was
+        self._dir_regex = self._compile (patterns)
+        self._file_regex = self._compile (
+            [p if not p[2] else (None, p[1], p[2]) for p in patterns])
+
+    @staticmethod
+    def _compile (patterns):
+        alternatives = [f'(?P<{"n" if negate else "p"}{i}>{regex})'
+                        for i, (regex, negate, _) in enumerate (patterns)
+                        if regex is not None]
+        if not alternatives:
+            return None
+        return re.compile ('(?:' + '|'.join (reversed (alternatives)) + r')\Z')
+
+    def match (self, path, is_dir):
+        """
+        Match a path relative to the ignore file's directory.
+
+        Returns:
+            bool: True if ignored, False if re-included, None if no pattern
+                matches
+        """
+        regex = self._dir_regex if is_dir else self._file_regex
+        if regex is None:
+            return None
+        m = regex.match (path)
+        if m is None:
+            return None
+        return m.lastgroup[0] == 'p'
+
+
+# Compiled rules per ignore file: path -> (stat key, IgnoreRules)
+_rules_cache = {}
+
+
+def get_rules (dirpath):
+    """
+    Return the compiled rules of the ignore file in dirpath.
+
+    Returns:
+        IgnoreRules: The rules, or None if the directory has no ignore file
+    """
+    path = os.path.join (dirpath, IGNORE_FILE)
+    try:
+        st = os.stat (path)
+    except (FileNotFoundError, NotADirectoryError):
+        _rules_cache.pop (path, None)
+        return None
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _rules_cache.get (path)
+    if cached is None or cached[0] != key:
+        with open (path) as f:
+            cached = (key, IgnoreRules (f))
+        _rules_cache[path] = cached
+    return cached[1]
+
+
+def _normalize (path):
+    path = os.path.normpath (path).replace ('\\', '/')
+    return '' if path == '.' else path
+
+
+def _match_parts (parts, is_dir, rules_for):
+    """Match a path given as components against the ignore files above it."""
+    # Deeper ignore files take precedence
+    for depth in range (len (parts) - 1, -1, -1):
+        rules = rules_for ('/'.join (parts[:depth]))
+        if rules is not None:
+            result = rules.match ('/'.join (parts[depth:]), is_dir)
+            if result is not None:
+                return result
+    return False
+
+
+def is_ignored (path, is_dir=None):
+    """
+    Check if a path should be ignored.
+
+    Args:
+        path: Path relative to the working tree root
+        is_dir: Whether path is a directory, looked up if None
+
+    Returns:
+        bool: True if the path or one of its parent directories is ignored
+    """
+    path = _normalize (path)
+    if not path:
+        return False
+    parts = path.split ('/')
+    if parts[0] == ALWAYS_IGNORED:
+        return True
+    if is_dir is None:
+        is_dir = os.path.isdir (path)
+
+    def rules_for (dirpath):
+        return get_rules (dirpath or '.')
+
+    # Nothing below an ignored directory can be re-included
+    for i in range (1, len (parts)):
+        if _match_parts (parts[:i], True, rules_for):
+            return True
+    return _match_parts (parts, is_dir, rules_for)
+
+
+def walk (top='.'):
+    """
+    Walk the working tree like os.walk, skipping ignored paths.
+
+    Ignored directories are pruned instead of being descended into, and
+    each ignore file is looked up once per walk.
+
+    Yields:
+        tuple: (root, dirnames, filenames) without ignored entries
+    """
+    top_parts = [p for p in _normalize (top).split ('/') if p]
+    if top_parts and is_ignored (_normalize (top), True):
+        return
+
+    rules = {}
+
+    def rules_for (dirpath):
+        if dirpath not in rules:
+            rules[dirpath] = get_rules (dirpath or '.')
+        return rules[dirpath]
+
+    for root, dirnames, filenames in os.walk (top):
+        root_parts = [p for p in _normalize (root).split ('/') if p]
+        kept = []
+        for dirname in dirnames:
+            parts = root_parts + [dirname]
+            if parts[0] == ALWAYS_IGNORED or _match_parts (parts, True, rules_for):
+                continue
+            kept.append (dirname)
+        # Pruning in place keeps os.walk from descending
+        dirnames[:] = kept
+        filenames = [name for name in filenames
+                     if not _match_parts (root_parts + [name], False, rules_for)]
+        yield root, dirnames, filenames
@@ -0,0 +1,470 @@
+"""Packfile storage for PyGit.
+
+A pack stores many objects in a single file, with similar objects stored as
+deltas against each other:
+
+- ``pack-<name>.pack``: header, one zlib-compressed entry per object, SHA-1
+  trailer. Entries are either whole objects or deltas against an earlier
+  entry of the same pack, addressed by relative offset.
+- ``pack-<name>.idx``: 256-entry fan-out table, sorted binary oids and their
+  pack offsets, used to find an object with a binary search.
+
+Both files are read through mmap, so looking up an object only touches the
+pages it needs.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+PACK_SIGNATURE = b'PACK'
+IDX_SIGNATURE = b'\xfftOc'
+VERSION = 2
+
+# Entry type codes
+TYPE_CODES = {'commit': 1, 'tree': 2, 'blob': 3}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items ()}
+OFS_DELTA = 6
+
+# Delta search parameters
+WINDOW = 10          # Number of preceding objects tried as delta bases
+MAX_DEPTH = 10       # Longest allowed delta chain
+MAX_DELTA_SIZE = 16 * 1024 * 1024  # Larger objects are always stored whole
+BLOCK_SIZE = 16      # Granularity of the delta base index
+
+_OID_SIZE = 20
+_FANOUT_SIZE = 256 * 4
+_HEADER = struct.Struct ('>4sII')
+
+
+def _encode_varint (n):
+    """Little-endian base-128 encoding used in delta headers."""
+    out = bytearray ()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append (byte | 0x80)
+        else:
+            out.append (byte)
+            return bytes (out)
+
+
+def _decode_varint (buf, pos):
+    n = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        n |= (byte & 0x7f) << shift
+        shift += 7
+        if not byte & 0x80:
+            return n, pos
+
+
+def _encode_entry_header (type_code, size):
+    out = bytearray ()
+    byte = (type_code << 4) | (size & 0x0f)
+    size >>= 4
+    while size:
+        out.append (byte | 0x80)
+        byte = size & 0x7f
+        size >>= 7
+    out.append (byte)
+    return bytes (out)
+
+
+def _decode_entry_header (buf, pos):
+    byte = buf[pos]
+    pos += 1
+    type_code = (byte >> 4) & 0x07
+    size = byte & 0x0f
+    shift = 4
+    while byte & 0x80:
+        byte = buf[pos]
+        pos += 1
+        size |= (byte & 0x7f) << shift
+        shift += 7
+    return type_code, size, pos
+
+
+def _encode_offset (offset):
+    """Encode a negative base offset the way git does for OFS_DELTA."""
+    out = [offset & 0x7f]
+    offset >>= 7
+    while offset:
+        offset -= 1
+        out.append (0x80 | (offset & 0x7f))
+        offset >>= 7
+    return bytes (reversed (out))
+
+
+def _decode_offset (buf, pos):
+    byte = buf[pos]
+    pos += 1
+    offset = byte & 0x7f
+    while byte & 0x80:
+        byte = buf[pos]
+        pos += 1
+        offset = ((offset + 1) << 7) | (byte & 0x7f)
+    return offset, pos
+
+
+def index_delta_base (base):
+    """
+    Index the blocks of a delta base for create_delta.
+
+    Returns:
+        dict: Maps each BLOCK_SIZE-aligned block to its first offset
+    """
+    index = {}
+    for offset in range (0, len (base) - BLOCK_SIZE + 1, BLOCK_SIZE):
+        index.setdefault (base[offset:offset + BLOCK_SIZE], offset)
+    return index
+
+
+def _match_length (base, base_pos, target, target_pos):
+    """Length of the common run of base[base_pos:] and target[target_pos:]."""
+    limit = min (len (base) - base_pos, len (target) - target_pos, 0xffffff)
+    length = 0
+    step = 256
+    while length < limit:
+        n = min (step, limit - length)
+        if base[base_pos + length:base_pos + length + n] == \
+           target[target_pos + length:target_pos + length + n]:
+            length += n
+            step *= 2
+        elif n == 1:
+            break
+        else:
+            step = max (n // 2, 1)
+    return length
+
+
+def create_delta (base, target, base_index=None):
+    """
+    Create a delta that turns base into target.
+
+    Args:
+        base: Base content
+        target: Target content
+        base_index: Result of index_delta_base (base), if already computed
+
+    Returns:
+        bytes: Delta in git's copy/insert instruction format
+    """
+    if base_index is None:
+        base_index = index_delta_base (base)
+
+    out = bytearray (_encode_varint (len (base)) + _encode_varint (len (target)))
+    literal = bytearray ()
+
+    def flush_literal ():
+        for start in range (0, len (literal), 0x7f):
+            chunk = literal[start:start + 0x7f]
+            out.append (len (chunk))
+            out.extend (chunk)
+        literal.clear ()
+
+    pos = 0
+    end = len (target)
+    while pos < end:
+        base_pos = base_index.get (target[pos:pos + BLOCK_SIZE]) \
+            if pos + BLOCK_SIZE <= end else None
+        if base_pos is None:
+            literal.append (target[pos])
+            pos += 1
+            continue
+
+        length = _match_length (base, base_pos, target, pos)
+        flush_literal ()
+
+        # Copy instruction: flag bits select which offset/size bytes follow
+        op = 0x80
+        args = bytearray ()
+        for i in range (4):
+            byte = (base_pos >> (8 * i)) & 0xff
+            if byte:
+                op |= 1 << i
+                args.append (byte)
+        for i in range (3):
+            byte = (length >> (8 * i)) & 0xff
+            if byte:
+                op |= 1 << (4 + i)
+                args.append (byte)
+        out.append (op)
+        out.extend (args)
+        pos += length
+
+    flush_literal ()
+    return bytes (out)
+
+
+def apply_delta (base, delta):
+    """
+    Apply a delta created by create_delta to base.
+
+    Returns:
+        bytes: Target content
+    """
+    base_size, pos = _decode_varint (delta, 0)
+    target_size, pos = _decode_varint (delta, pos)
+    assert base_size == len (base), 'Delta base size mismatch'
+
+    out = bytearray ()
+    while pos < len (delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            offset = size = 0
+            for i in range (4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range (3):
+                if op & (1 << (4 + i)):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[offset:offset + (size or 0x10000)]
+        elif op:
+            out += delta[pos:pos + op]
+            pos += op
+        else:
+            raise ValueError ('Invalid delta instruction')
+
+    assert len (out) == target_size, 'Delta target size mismatch'
+    return bytes (out)
+
+
+def write_pack (pack_dir, oids, read_object):
+    """
+    Write the given objects into a new pack and its index.
+
+    Objects are ordered by type and size so that similar objects land in
+    the same delta window; each one is stored as a delta against the best
+    earlier object in the window if that is substantially smaller.
+
+    Args:
+        pack_dir: Directory to write the pack to
+        oids: Object IDs to pack
+        read_object: Callable returning (type, content) for an oid
+
+    Returns:
+        str: Path of the written .pack file
+    """
+    # First pass only collects what's needed for ordering, so at most a
+    # window's worth of object contents is held in memory while writing
+    order = []
+    for oid in oids:
+        type_, content = read_object (oid)
+        order.append ((TYPE_CODES[type_], len (content), oid))
+    order.sort (key=lambda entry: (entry[0], -entry[1]))
+
+    os.makedirs (pack_dir, exist_ok=True)
+    fd, tmp_pack = tempfile.mkstemp (dir=pack_dir, prefix='tmp_pack_')
+    offsets = {}
+    sha = hashlib.sha1 ()
+    try:
+        with os.fdopen (fd, 'wb') as out:
+            def write (chunk):
+                sha.update (chunk)
+                out.write (chunk)
+
+            write (_HEADER.pack (PACK_SIGNATURE, VERSION, len (order)))
+            offset = _HEADER.size
+            # Window entries: (type code, content, base index, offset, depth)
+            window = []
+            for type_code, size, oid in order:
+                _, content = read_object (oid)
+                depth = 0
+                best = None
+                if size <= MAX_DELTA_SIZE:
+                    for w_type, w_content, w_index, w_offset, w_depth in window:
+                        if w_type != type_code or w_depth >= MAX_DEPTH:
+                            continue
+                        if abs (len (w_content) - size) > size // 2:
+                            continue
+                        delta = create_delta (w_content, content, w_index)
+                        # Only worth it if the delta is much smaller
+                        if len (delta) < size // 2 and \
+                           (best is None or len (delta) < len (best[0])):
+                            best = (delta, w_offset, w_depth)
+
+                if best:
+                    delta, base_offset, base_depth = best
+                    depth = base_depth + 1
+                    entry = (_encode_entry_header (OFS_DELTA, len (delta)) +
+                             _encode_offset (offset - base_offset) +
+                             zlib.compress (delta))
+                else:
+                    entry = (_encode_entry_header (type_code, size) +
+                             zlib.compress (content))
+
+                offsets[oid] = offset
+                write (entry)
+                offset += len (entry)
+
+                if size <= MAX_DELTA_SIZE:
+                    window.append ((type_code, content, index_delta_base (content),
+                                    offsets[oid], depth))
+                    if len (window) > WINDOW:
+                        window.pop (0)
+
+            pack_checksum = sha.digest ()
+            out.write (pack_checksum)
+
+        name = hashlib.sha1 (''.join (sorted (offsets)).encode ()).hexdigest ()
+        pack_path = f'{pack_dir}/pack-{name}.pack'
+        os.chmod (tmp_pack, 0o644)
+        os.replace (tmp_pack, pack_path)
+    except BaseException:
+        if os.path.exists (tmp_pack):
+            os.unlink (tmp_pack)
+        raise
+
+    _write_index (pack_path[:-len ('.pack')] + '.idx', offsets, pack_checksum)
+    return pack_path
+
+
+def _write_index (idx_path, offsets, pack_checksum):
+    """Write the sorted, fan-out indexed .idx file for a pack."""
+    oids = sorted (offsets)
+    fanout = [0] * 256
+    for oid in oids:
+        fanout[int (oid[:2], 16)] += 1
+    total = 0
+    for i in range (256):
+        total += fanout[i]
+        fanout[i] = total
+
+    content = bytearray (IDX_SIGNATURE + struct.pack ('>I', VERSION))
+    content += struct.pack ('>256I', *fanout)
+    for oid in oids:
+        content += bytes.fromhex (oid)
+    for oid in oids:
+        content += struct.pack ('>Q', offsets[oid])
+    content += pack_checksum
+    content += hashlib.sha1 (content).digest ()
+
+    dirname = os.path.dirname (idx_path)
+    fd, tmp_path = tempfile.mkstemp (dir=dirname, prefix='tmp_idx_')
+    with os.fdopen (fd, 'wb') as out:
+        out.write (content)
+    os.chmod (tmp_path, 0o644)
+    # The index is renamed last so readers never see a pack without it
+    os.replace (tmp_path, idx_path)
+
+
+class PackFile:
+    """Read access to a pack and its index through mmap."""
+
+    def __init__ (self, idx_path):
+        self.idx_path = idx_path
+        self.pack_path = idx_path[:-len ('.idx')] + '.pack'
+        with open (idx_path, 'rb') as f:
+            self._idx = mmap.mmap (f.fileno (), 0, access=mmap.ACCESS_READ)
+        with open (self.pack_path, 'rb') as f:
+            self._pack = mmap.mmap (f.fileno (), 0, access=mmap.ACCESS_READ)
+
+        signature, version = struct.unpack_from ('>4sI', self._idx, 0)
+        assert signature == IDX_SIGNATURE and version == VERSION, \
+            f'Unsupported pack index {idx_path}'
+        signature, version, self.count = _HEADER.unpack_from (self._pack, 0)
+        assert signature == PACK_SIGNATURE and version == VERSION, \
+            f'Unsupported pack {self.pack_path}'
+
+        self._fanout = struct.unpack_from ('>256I', self._idx, 8)
+        self._oids_start = 8 + _FANOUT_SIZE
+        self._offsets_start = self._oids_start + self.count * _OID_SIZE
+
+    def close (self):
+        self._idx.close ()
+        self._pack.close ()
+
+    def _oid_at (self, i):
+        start = self._oids_start + i * _OID_SIZE
+        return self._idx[start:start + _OID_SIZE]
+
+    def find_offset (self, oid):
+        """
+        Find the pack offset of an object with a binary search of the index.
+
+        Returns:
+            int: Offset of the entry, or None if the object isn't in the pack
+        """
+        key = bytes.fromhex (oid)
+        first = key[0]
+        lo = self._fanout[first - 1] if first else 0
+        hi = self._fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_oid = self._oid_at (mid)
+            if mid_oid < key:
+                lo = mid + 1
+            elif mid_oid > key:
+                hi = mid
+            else:
+                return struct.unpack_from (
+                    '>Q', self._idx, self._offsets_start + mid * 8)[0]
+        return None
+
+    def __contains__ (self, oid):
+        return self.find_offset (oid) is not None
+
+    def iter_prefix (self, prefix):
+        """Yield the oids in the pack starting with a hex prefix, in order."""
+        # Padding an odd prefix gives the smallest oid that could match
+        key = bytes.fromhex (prefix + '0' * (len (prefix) % 2))
+        first = key[0]
+        lo = self._fanout[first - 1] if first else 0
+        hi = self._fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._oid_at (mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        for i in range (lo, self.count):
+            oid = self._oid_at (i).hex ()
+            if not oid.startswith (prefix):
+                return
+            yield oid
+
+    def iter_oids (self):
+        """Iterate through the oids in the pack in sorted order."""
+        for i in range (self.count):
+            yield self._oid_at (i).hex ()
+
+    def _inflate (self, pos, size):
+        decompressor = zlib.decompressobj ()
+        out = bytearray ()
+        chunk_size = max (size + 64, 4096)
+        while not decompressor.eof:
+            chunk = self._pack[pos:pos + chunk_size]
+            if not chunk:
+                raise ValueError (f'Truncated pack {self.pack_path}')
+            out += decompressor.decompress (chunk)
+            pos += chunk_size
+        return bytes (out)
+
+    def _read_at (self, offset):
+        type_code, size, pos = _decode_entry_header (self._pack, offset)
+        if type_code == OFS_DELTA:
+            relative, pos = _decode_offset (self._pack, pos)
+            base_type, base = self._read_at (offset - relative)
+            return base_type, apply_delta (base, self._inflate (pos, size))
+        return TYPE_NAMES[type_code], self._inflate (pos, size)
+
+    def read (self, oid):
+        """
+        Read an object from the pack.
+
+        Returns:
+            tuple: (type, content), or None if the object isn't in the pack
+        """
+        offset = self.find_offset (oid)
+        if offset is None:
+            return None
+        return self._read_at (offset)
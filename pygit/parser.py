@@ -2,6 +2,8 @@
 
 import argparse
 from . import base
+from . import data
+from . import diff
 from . import commands
 
 def create_parser():
@@ -23,6 +25,9 @@ def _add_basic_commands(commands_parser):
     # Init
     init_parser = commands_parser.add_parser('init', help='Initialize a new repository')
     init_parser.set_defaults(func=commands.init)
+    init_parser.add_argument('--object-format', choices=data.OBJECT_FORMATS,
+                             default=data.DEFAULT_OBJECT_FORMAT,
+                             help='Object store layout')
 
     # Add
     add_parser = commands_parser.add_parser('add', help='Add file contents to the index')
@@ -39,15 +44,46 @@ def _add_basic_commands(commands_parser):
     diff_parser.set_defaults(func=commands.diff)
     diff_parser.add_argument('--cached', action='store_true', help='Show staged changes')
     diff_parser.add_argument('commit', nargs='?', help='Commit to diff against')
+    _add_diff_options(diff_parser)
+
+    # Show
+    show_parser = commands_parser.add_parser('show', help='Show a commit and its changes')
+    show_parser.set_defaults(func=commands.show)
+    show_parser.add_argument('oid', default='@', type=base.get_oid, nargs='?')
+    _add_diff_options(show_parser)
 
     # Status
     status_parser = commands_parser.add_parser('status', help='Show working tree status')
     status_parser.set_defaults(func=commands.status)
+    status_parser.add_argument('-v', '--verbose', action='store_true',
+                               help='Show the diff of staged changes')
+    _add_diff_options(status_parser)
 
     # Log
     log_parser = commands_parser.add_parser('log', help='Show commit history')
     log_parser.set_defaults(func=commands.log)
-    log_parser.add_argument('oid', default='@', type=base.get_oid, nargs='?')
+    log_parser.add_argument('revisions', nargs='*', metavar='revision',
+                            help='Commits to list history from (default HEAD); '
+                                 'A..B, A...B and ^A select ranges')
+    log_parser.add_argument('--not', dest='not_revisions', nargs='+', default=[],
+                            metavar='revision',
+                            help='Leave out commits reachable from these revisions')
+    log_parser.add_argument('--oneline', action='store_true',
+                            help='Show each commit as its abbreviated oid and subject')
+
+def _add_diff_options(subparser):
+    """Add the options shared by commands that print diffs."""
+    subparser.add_argument('-U', '--unified', type=int, nargs='?',
+                           const=diff.DEFAULT_CONTEXT, metavar='N',
+                           help='Show a unified diff with N lines of context')
+    subparser.add_argument('--diff-algorithm', choices=diff.DIFF_ALGORITHMS,
+                           default='myers', help='Line diff algorithm')
+    subparser.add_argument('--stat', action='store_true',
+                           help='Show the number of changed lines per file')
+    subparser.add_argument('--name-only', action='store_true',
+                           help='Only show the names of changed files')
+    subparser.add_argument('-p', '--paginate', action='store_true',
+                           help='Pipe output through a pager when writing to a terminal')
 
 def _add_branch_commands(commands_parser):
     """Add branch-related commands like branch, checkout, and merge."""
@@ -67,6 +103,17 @@ def _add_branch_commands(commands_parser):
     merge_parser.set_defaults(func=commands.merge)
     merge_parser.add_argument('commit', type=base.get_oid, help='Commit to merge')
 
+    # Merge-base
+    merge_base_parser = commands_parser.add_parser('merge-base',
+                                                   help='Find common ancestors for a merge')
+    merge_base_parser.set_defaults(func=commands.merge_base)
+    merge_base_parser.add_argument('commits', nargs='+', type=base.get_oid,
+                                   help='Commits to find common ancestors of')
+    merge_base_parser.add_argument('--all', action='store_true',
+                                   help='Print all best common ancestors')
+    merge_base_parser.add_argument('--octopus', action='store_true',
+                                   help='Find ancestors common to all commits')
+
 def _add_remote_commands(commands_parser):
     """Add remote operation commands like clone, fetch, and push."""
     # Clone
@@ -99,6 +146,25 @@ def _add_plumbing_commands(commands_parser):
     hash_object_parser.set_defaults(func=commands.hash_object)
     hash_object_parser.add_argument('file', help='File to hash')
 
+    # Migrate-objects
+    migrate_parser = commands_parser.add_parser('migrate-objects',
+                                                help='Convert a flat object store to the fanout format')
+    migrate_parser.set_defaults(func=commands.migrate_objects)
+
+    # Write-commit-graph
+    commit_graph_parser = commands_parser.add_parser('write-commit-graph',
+                                                     help='Write the commit-graph file')
+    commit_graph_parser.set_defaults(func=commands.write_commit_graph)
+
+    # Pack-refs
+    pack_refs_parser = commands_parser.add_parser('pack-refs',
+                                                  help='Move loose refs into the packed-refs file')
+    pack_refs_parser.set_defaults(func=commands.pack_refs)
+
+    # Pack
+    pack_parser = commands_parser.add_parser('pack', help='Pack reachable loose objects')
+    pack_parser.set_defaults(func=commands.pack)
+
     # Cat-file
     cat_file_parser = commands_parser.add_parser('cat-file', help='Display object contents')
     cat_file_parser.set_defaults(func=commands.cat_file)
@@ -4,6 +4,7 @@ import os
 import shutil
 from . import data
 from . import base
+from . import diff
 
 
 REMOTE_REFS_BASE = 'refs/heads/'
@@ -22,32 +23,113 @@ def fetch (remote_path):
     # Ensure objects directory exists
     os.makedirs(f'{data.GIT_DIR}/objects', exist_ok=True)
     
-    # Fetch all objects
-    for oid in base.iter_objects_in_commits (refs.values ()):
-        data.fetch_object_if_missing (oid, remote_path)
+    # Fetch the objects we don't have yet
+    local_path = os.path.dirname (data.GIT_DIR)
+    count = _copy_objects (remote_path, local_path, set (refs.values ()))
+    print (f'Fetched {count} objects')
     
-    # Update local refs to match remote
-    for refname, value in refs.items ():
-        if refname.startswith('refs/heads/'):
-            # Store remote refs under refs/remotes/
-            remote_ref = f'refs/remotes/origin/{refname[11:]}'
-            data.update_ref (remote_ref, data.RefValue (symbolic=False, value=value))
-            
-            # If this is our current branch, update it
-            current_branch = base.get_branch_name()
-            if current_branch and refname == f'refs/heads/{current_branch}':
-                # Fast-forward if possible
-                current_ref = data.get_ref (f'refs/heads/{current_branch}').value
-                if base.is_ancestor_of (value, current_ref):
-                    data.update_ref (refname, data.RefValue (symbolic=False, value=value))
-                    # Update working directory
-                    commit = base.get_commit (value)
-                    base.read_tree (commit.tree, update_working=True)
+    # Store remote branches under refs/remotes/, all in one ref transaction
+    with data.ref_transaction () as transaction:
+        for refname, value in refs.items ():
+            if refname.startswith('refs/heads/'):
+                remote_ref = f'refs/remotes/origin/{refname[11:]}'
+                transaction.update (remote_ref, data.RefValue (symbolic=False, value=value))
+
+    # If our current branch moved on the remote, fast-forward it
+    current_branch = base.get_branch_name()
+    refname = f'refs/heads/{current_branch}'
+    if current_branch and refname in refs:
+        value = refs[refname]
+        current_ref = data.get_ref (refname).value
+        if base.is_ancestor_of (value, current_ref):
+            # Update working directory while HEAD still describes the index
+            commit = base.get_commit (value)
+            base.read_tree (commit.tree, update_working=True)
+            data.update_ref (refname, data.RefValue (symbolic=False, value=value),
+                             old_value=current_ref or '')
+
+
+def _find_missing_commits (wants, have):
+    """
+    Negotiate the commits to transfer: walk history from wants in the
+    current repository and stop at the commits the other side has.
+
+    Args:
+        wants: Commit OIDs to transfer
+        have: Callable telling whether the other side has an object
+
+    Returns:
+        list: Commits the other side is missing, parents before children
+    """
+    missing = []
+    done = set ()
+    for want in wants:
+        stack = [want]
+        while stack:
+            oid = stack[-1]
+            if oid in done:
+                stack.pop ()
+                continue
+            if have (oid):
+                done.add (oid)
+                stack.pop ()
+                continue
+            pending = [p for p in base.get_parents (oid) if p not in done]
+            if pending:
+                stack.extend (pending)
+                continue
+            done.add (oid)
+            missing.append (oid)
+            stack.pop ()
+    return missing
+
+
+def _copy_objects (source_path, target_path, wants):
+    """
+    Copy the objects reachable from wants that the target repository is
+    missing.
+
+    Trees and commits are only stored after everything they refer to, so
+    a tree or commit that exists in a repository is complete. That lets the
+    negotiation stop at the first commit the target has and the object walk
+    skip every subtree it has, instead of walking the full history.
+
+    Args:
+        source_path: Path to the repository to copy from
+        target_path: Path to the repository to copy to
+        wants: Commit OIDs whose objects the target should have
+
+    Returns:
+        int: Number of objects copied
+    """
+    def have (oid):
+        with data.change_git_dir (target_path):
+            return data.object_exists (oid)
+
+    with data.change_git_dir (source_path):
+        commits = _find_missing_commits (wants, have)
+        trees = [base.get_commit (oid).tree for oid in commits]
+        objects = list (base.iter_objects_in_trees (trees, have))
+
+    # Blobs don't refer to anything and are copied in parallel; trees and
+    # commits follow one by one, in dependency order
+    with data.change_git_dir (target_path):
+        os.makedirs (f'{data.GIT_DIR}/objects', exist_ok=True)
+        data.fetch_objects ([oid for type_, oid in objects if type_ == 'blob'],
+                            source_path)
+        for oid in [oid for type_, oid in objects if type_ == 'tree'] + commits:
+            data.fetch_object_if_missing (oid, source_path)
+    return len (objects) + len (commits)
 
 
 def push (remote_path, refname):
     """
     Push current branch to remote repository.
+
+    Only the commits the remote doesn't have yet, and the trees and blobs
+    they introduce, are transferred, and only the files that changed
+    between the remote's old and new commit are rewritten in its working
+    directory.
     
     Args:
         remote_path: Path to remote repository
@@ -62,56 +144,46 @@ def push (remote_path, refname):
         print(f"error: No local ref found for {refname}")
         return
     
-    # Don't allow force push
-    if remote_ref and not base.is_ancestor_of(local_ref, remote_ref):
+    # Don't allow force push; a remote commit we don't have can't be an
+    # ancestor of ours
+    if remote_ref and not (data.object_exists(remote_ref) and
+                           base.is_ancestor_of(local_ref, remote_ref)):
         raise Exception("Push would not be fast-forward")
 
-    # Get all objects that need to be pushed
-    local_objects = set()
-    for oid in base.iter_objects_in_commits({local_ref}):
-        local_objects.add(oid)
-
-    # Get remote objects
-    remote_objects = set()
-    if remote_ref:
-        with data.change_git_dir(remote_path):
-            for oid in base.iter_objects_in_commits({remote_ref}):
-                remote_objects.add(oid)
-
-    # Push missing objects
-    objects_to_push = local_objects - remote_objects
-    for oid in objects_to_push:
-        data.push_object(oid, remote_path)
+    # Push the objects the remote is missing
+    local_path = os.path.dirname(data.GIT_DIR)
+    pushed = _copy_objects(local_path, remote_path, {local_ref})
 
     # Update remote repository
     with data.change_git_dir(remote_path):
-        # Update ref
-        data.update_ref(refname, data.RefValue(symbolic=False, value=local_ref))
+        # Update ref, unless someone else pushed since we looked
+        data.update_ref(refname, data.RefValue(symbolic=False, value=local_ref),
+                        old_value=remote_ref or '')
         
         # Get the commit we're pushing
-        commit = base.get_commit(local_ref)
+        old_tree = remote_ref and base.get_commit(remote_ref).tree
+        new_tree = base.get_commit(local_ref).tree
         
-        # Update working directory
-        base.read_tree(commit.tree, update_working=True)
+        # Update index; the remote's files are written below, since the
+        # checkout engine works on the current directory
+        base.read_tree(new_tree)
         
-        # Update index
-        with data.get_index() as index:
-            tree = base.get_tree(commit.tree)
-            for path, oid in tree.items():
-                index[path] = oid
-                
-                # Ensure parent directories exist
-                dir_path = os.path.dirname(path)
-                if dir_path:  # Only create directory if path is not empty
-                    os.makedirs(os.path.join(remote_path, dir_path), exist_ok=True)
-                
-                # Write file content
-                file_content = data.get_object(oid)
-                with open(os.path.join(remote_path, path), 'wb') as f:
-                    f.write(file_content)
+        for path, _, oid in diff.iter_tree_changes(old_tree, new_tree):
+            file_path = os.path.join(remote_path, path)
+            if not oid:
+                if os.path.isfile(file_path):
+                    os.remove(file_path)
+                continue
+
+            # Ensure parent directories exist
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            
+            # Write file content
+            with open(file_path, 'wb') as f:
+                data.copy_object(oid, f)
 
     print(f"Pushed to {remote_path}:{refname}")
-    print(f"Updated {len(objects_to_push)} objects")
+    print(f"Updated {pushed} objects")
 
 def _get_remote_refs (remote_path):
     """Get all refs from remote repository"""
@@ -129,50 +201,57 @@ def _get_remote_refs (remote_path):
         return refs
 
 def clone(remote_path, target_path):
-    """Clone a repository from remote_path to target_path"""
+    """
+    Clone a repository from remote_path to target_path.
+
+    Object files are hard-linked (or reflinked, or copied in the kernel) in
+    one pass instead of being fetched one by one, and the working tree is
+    checked out from the cloned HEAD, so the index is built from the oids
+    already in the tree rather than by re-hashing every file.
+
+    Args:
+        remote_path: Path to the repository to clone
+        target_path: Path of the new repository
+    """
+    remote_path = os.path.abspath(remote_path)
+    target_path = os.path.abspath(target_path)
+
     # Remove target directory if it exists
     if os.path.exists(target_path):
         shutil.rmtree(target_path)
-    
-    # First, copy the entire source directory
-    shutil.copytree(remote_path, target_path, ignore=shutil.ignore_patterns('.pygit*'))
-    
-    # Initialize new repository in target
+    os.makedirs(target_path)
+
+    refs = _get_remote_refs(remote_path)
+    with data.change_git_dir(remote_path):
+        head = data.get_ref('HEAD', deref=False)
+        object_format = data.get_object_format()
+
     with data.change_git_dir(target_path):
         # Create repository structure
         os.makedirs(f'{data.GIT_DIR}/objects', exist_ok=True)
         os.makedirs(f'{data.GIT_DIR}/refs/heads', exist_ok=True)
         os.makedirs(f'{data.GIT_DIR}/refs/tags', exist_ok=True)
-        
-        # Get refs from remote
-        refs = _get_remote_refs(remote_path)
-        
-        # Fetch all objects
-        for oid in base.iter_objects_in_commits(refs.values()):
-            data.fetch_object_if_missing(oid, remote_path)
-        
+        # Linked object files keep the remote's layout
+        data.set_config('object_format', object_format)
+
+        counts = data.clone_objects(remote_path)
+        print(f'Cloned {sum(counts.values())} object files')
+
+        # Check out the remote's HEAD in the new working tree, before the
+        # new repository has a HEAD the empty index would differ from
+        head_oid = refs.get(head.value) if head.symbolic else head.value
+        if head_oid:
+            cwd = os.getcwd()
+            os.chdir(target_path)
+            try:
+                base.read_tree(base.get_commit(head_oid).tree, update_working=True)
+            finally:
+                os.chdir(cwd)
+
         # Update refs to match remote
         for refname, value in refs.items():
             if refname.startswith('refs/heads/'):
                 data.update_ref(refname, data.RefValue(symbolic=False, value=value))
-        
-        # Set up HEAD to point to master
-        master_ref = refs.get('refs/heads/master')
-        if master_ref:
-            # First set HEAD value
-            with open(f'{data.GIT_DIR}/HEAD', 'w') as f:
-                f.write('ref: refs/heads/master\n')
-            
-            # Then set up master branch
-            data.update_ref('refs/heads/master', 
-                          data.RefValue(symbolic=False, value=master_ref))
-            
-            # Add all files to index
-            with data.get_index() as index:
-                for root, _, files in os.walk('.'):
-                    for file in files:
-                        path = os.path.relpath(os.path.join(root, file))
-                        if not base.is_ignored(path):
-                            with open(path, 'rb') as f:
-                                oid = data.hash_object(f.read())
-                            index[path] = oid
+
+        if head.value:
+            data.update_ref('HEAD', head, deref=False)
@@ -1,6 +1,7 @@
 import os
 import shutil
 import unittest
+from unittest import mock
 from pygit import base, data
 
 class TestBase(unittest.TestCase):
@@ -30,6 +31,39 @@ class TestBase(unittest.TestCase):
         tree_oid = base.write_tree()
         self.assertIsNotNone(tree_oid)
 
+    def test_write_tree_reuses_cached_trees(self):
+        """Test that write_tree only writes directories that changed"""
+        for dirname in ('dir1/sub', 'dir2'):
+            os.makedirs(dirname)
+        for path in ('dir1/sub/a.txt', 'dir1/b.txt', 'dir2/c.txt', 'd.txt'):
+            with open(path, 'w') as f:
+                f.write(path)
+        base.add(['dir1', 'dir2', 'd.txt'])
+        tree1 = base.write_tree()
+        self.assertEqual(base.write_tree(), tree1)
+
+        with open('dir1/sub/a.txt', 'w') as f:
+            f.write('changed')
+        base.add(['dir1/sub/a.txt'])
+        with mock.patch.object(data, 'hash_object',
+                               wraps=data.hash_object) as hash_object:
+            tree2 = base.write_tree()
+        # The root, dir1 and dir1/sub, but not dir2
+        self.assertEqual(hash_object.call_count, 3)
+
+        # Same result as writing every tree from scratch
+        with data.get_index() as index:
+            index.trees.clear()
+            index.dirty = True
+        self.assertEqual(base.write_tree(), tree2)
+        self.assertNotEqual(tree1, tree2)
+
+        # Reading a tree fills the cache-tree
+        base.read_tree(tree1)
+        with data.get_index() as index:
+            self.assertEqual(index.trees[''], tree1)
+            self.assertEqual(set(index.trees), {'', 'dir1', 'dir1/sub', 'dir2'})
+
     def test_commit(self):
         with open('test.txt', 'w') as f:
             f.write('test content')
@@ -56,6 +90,158 @@ class TestBase(unittest.TestCase):
         with open('test.txt') as f:
             self.assertEqual(f.read(), 'version 2')
 
+    def test_checkout_only_touches_changed_paths(self):
+        """Test that checkout writes and removes only differing paths"""
+        os.makedirs('dir')
+        for path in ('same.txt', 'changed.txt', 'dir/removed.txt'):
+            with open(path, 'w') as f:
+                f.write(f'{path} 1')
+        base.add(['same.txt', 'changed.txt', 'dir/removed.txt'])
+        commit1 = base.commit("First commit")
+
+        with open('changed.txt', 'w') as f:
+            f.write('changed.txt 2')
+        os.remove('dir/removed.txt')
+        with open('added.txt', 'w') as f:
+            f.write('added.txt 2')
+        with data.get_index() as index:
+            del index['dir/removed.txt']
+        base.add(['changed.txt', 'added.txt'])
+        commit2 = base.commit("Second commit")
+
+        same_mtime = os.stat('same.txt').st_mtime_ns
+        base.checkout(commit1)
+        self.assertFalse(os.path.exists('added.txt'))
+        with open('dir/removed.txt') as f:
+            self.assertEqual(f.read(), 'dir/removed.txt 1')
+        with open('changed.txt') as f:
+            self.assertEqual(f.read(), 'changed.txt 1')
+        self.assertEqual(os.stat('same.txt').st_mtime_ns, same_mtime)
+
+        base.checkout(commit2)
+        self.assertFalse(os.path.exists('dir'))
+        self.assertEqual(base.get_index_tree(), base.get_working_tree())
+
+    def test_checkout_refuses_to_overwrite_changes(self):
+        """Test that checkout keeps local changes and untracked files"""
+        with open('test.txt', 'w') as f:
+            f.write('version 1')
+        base.add(['test.txt'])
+        commit1 = base.commit("First commit")
+
+        with open('test.txt', 'w') as f:
+            f.write('version 2')
+        with open('new.txt', 'w') as f:
+            f.write('new')
+        base.add(['test.txt', 'new.txt'])
+        commit2 = base.commit("Second commit")
+        base.checkout(commit1)
+
+        # Local change to a path that differs between the commits
+        with open('test.txt', 'w') as f:
+            f.write('local change')
+        with self.assertRaises(Exception):
+            base.checkout(commit2)
+        with open('test.txt') as f:
+            self.assertEqual(f.read(), 'local change')
+        self.assertEqual(data.get_ref('HEAD').value, commit1)
+
+        # Untracked file in the way of a path checkout would create
+        base.add(['test.txt'])
+        base.commit("Local commit")
+        with open('new.txt', 'w') as f:
+            f.write('untracked')
+        with self.assertRaises(Exception):
+            base.checkout(commit2)
+        with open('new.txt') as f:
+            self.assertEqual(f.read(), 'untracked')
+
+    def test_checkout_between_files_and_directories(self):
+        """Test checkouts where a file and a directory swap places"""
+        os.makedirs('f')
+        with open('f/g', 'w') as f:
+            f.write('in dir')
+        base.add(['f'])
+        commit1 = base.commit("Directory f")
+
+        os.remove('f/g')
+        os.rmdir('f')
+        with data.get_index() as index:
+            del index['f/g']
+        with open('f', 'w') as f:
+            f.write('file')
+        base.add(['f'])
+        commit2 = base.commit("File f")
+
+        base.checkout(commit1)
+        with open('f/g') as f:
+            self.assertEqual(f.read(), 'in dir')
+        base.checkout(commit2)
+        with open('f') as f:
+            self.assertEqual(f.read(), 'file')
+
+        # An untracked file where a directory goes is reported up front
+        os.remove('f')
+        with data.get_index() as index:
+            del index['f']
+        with open('b', 'w') as f:
+            f.write('b')
+        base.add(['b'])
+        commit3 = base.commit("Only b")
+        with open('f', 'w') as f:
+            f.write('untracked')
+        with self.assertRaises(base.CheckoutConflictError):
+            base.checkout(commit1)
+        self.assertTrue(os.path.exists('b'))
+        self.assertEqual(data.get_ref('HEAD').value, commit3)
+
+    def test_checkout_keeps_staged_changes(self):
+        """Test that checkout refuses to drop changes staged in the index"""
+        with open('a.txt', 'w') as f:
+            f.write('version 1')
+        base.add(['a.txt'])
+        commit1 = base.commit("First commit")
+        with open('a.txt', 'w') as f:
+            f.write('version 2')
+        base.add(['a.txt'])
+        base.commit("Second commit")
+        base.checkout(commit1)
+
+        with open('a.txt', 'w') as f:
+            f.write('staged')
+        base.add(['a.txt'])
+        staged = base.get_index_tree()['a.txt']
+        with self.assertRaises(base.CheckoutConflictError):
+            base.checkout('master')
+        with open('a.txt') as f:
+            self.assertEqual(f.read(), 'staged')
+        self.assertEqual(base.get_index_tree()['a.txt'], staged)
+
+    def test_abbreviated_oids(self):
+        """Test resolving and printing abbreviated oids"""
+        # Find two blobs whose oids share their first four digits
+        seen = {}
+        for i in range(100000):
+            content = b'blob %d' % i
+            oid = data.hash_object(content, write=False)
+            if oid[:4] in seen:
+                break
+            seen[oid[:4]] = content
+        first = data.hash_object(seen[oid[:4]])
+        second = data.hash_object(content)
+        # One loose, one packed
+        data.pack_objects([first])
+
+        self.assertEqual(data.find_oids_by_prefix(first[:4]), sorted([first, second]))
+        with self.assertRaises(Exception):
+            base.get_oid(first[:4])
+
+        short = data.abbreviate(first)
+        self.assertEqual(len(short), len(os.path.commonprefix([first, second])) + 1)
+        self.assertEqual(base.get_oid(short), first)
+        self.assertEqual(base.get_oid(data.abbreviate(second)), second)
+        self.assertIsNone(data.expand_oid('0000000'))
+
     def test_merge(self):
         """Test merging branches"""
         # Create initial commit with version 1
@@ -80,4 +266,84 @@ class TestBase(unittest.TestCase):
         
         # Verify content
         with open('test.txt') as f:
-            self.assertEqual(f.read(), 'version 1')
\ No newline at end of file
+            self.assertEqual(f.read(), 'version 1')
+
+    def _make_commit(self, message, *parents):
+        commit = f'tree {base.write_tree()}\n'
+        commit += ''.join(f'parent {parent}\n' for parent in parents)
+        return data.hash_object(f'{commit}\n{message}\n'.encode(), 'commit')
+
+    def test_merge_bases(self):
+        """Test merge bases and ancestry on a branching history"""
+        root = self._make_commit('root')
+        a1 = self._make_commit('a1', root)
+        a2 = self._make_commit('a2', a1)
+        b1 = self._make_commit('b1', root)
+        c1 = self._make_commit('c1', a1)
+        merge = self._make_commit('merge', a2, b1)
+
+        self.assertEqual(base.get_merge_base(a2, b1), root)
+        self.assertEqual(base.get_merge_base(merge, c1), a1)
+        self.assertEqual(base.get_merge_base(a2, merge), a2)
+        self.assertEqual(base.get_octopus_merge_bases([a2, b1, c1]), [root])
+        self.assertEqual(base.get_generation(merge), 4)
+
+        self.assertTrue(base.is_ancestor_of(merge, b1))
+        self.assertTrue(base.is_ancestor_of(merge, root))
+        self.assertFalse(base.is_ancestor_of(merge, c1))
+        self.assertFalse(base.is_ancestor_of(b1, a1))
+
+    def test_revisions(self):
+        """Test revision navigation and range queries"""
+        old = self._make_commit('old')
+        root = self._make_commit('root', old)
+        a1 = self._make_commit('a1', root)
+        a2 = self._make_commit('a2', a1)
+        b1 = self._make_commit('b1', root)
+        merge = self._make_commit('merge', a2, b1)
+        data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=merge))
+        data.update_ref('refs/tags/v1', data.RefValue(symbolic=False, value=root))
+
+        self.assertEqual(base.get_oid('@~2'), a1)
+        self.assertEqual(base.get_oid('HEAD^2'), b1)
+        self.assertEqual(base.get_oid('master^2~1^'), old)
+        self.assertEqual(base.get_oid('@^0'), merge)
+
+        def commits(*revisions):
+            return set(base.iter_commits_in_range(*base.parse_revisions(revisions)))
+
+        self.assertEqual(commits('v1..master'), {a1, a2, b1, merge})
+        self.assertEqual(commits('master', '--not', 'v1', f'{b1}'), {a1, a2, merge})
+        self.assertEqual(commits('^master~1', 'master'), {b1, merge})
+        self.assertEqual(commits(f'{a2}...{b1}'), {a1, a2, b1})
+
+        # The walk stops at the excluded side instead of reading all history
+        with mock.patch.object(base, 'get_parents', wraps=base.get_parents) as get_parents:
+            list(base.iter_commits_in_range([merge], [root]))
+        self.assertNotIn(old, [call.args[0] for call in get_parents.call_args_list])
+
+    def test_walks_with_tiny_parsed_cache(self):
+        """Test that history walks don't depend on what parsed_cache keeps"""
+        root = self._make_commit('root')
+        a1 = self._make_commit('a1', root)
+        b1 = self._make_commit('b1', root)
+        merge = self._make_commit('merge', a1, b1)
+
+        base._generations.clear()
+        data.set_cache_limits(parsed_bytes=16)
+        try:
+            self.assertEqual(base.get_merge_base(a1, b1), root)
+            self.assertEqual(base.get_generation(merge), 3)
+            self.assertEqual(set(base.iter_commits_in_range([merge], [a1])), {b1, merge})
+        finally:
+            data.set_cache_limits(parsed_bytes=data.PARSED_CACHE_BYTES)
+
+    def test_criss_cross_merge_bases(self):
+        """Test that all best merge bases are found"""
+        root = self._make_commit('root')
+        a = self._make_commit('a', root)
+        b = self._make_commit('b', root)
+        x = self._make_commit('x', a, b)
+        y = self._make_commit('y', b, a)
+
+        self.assertEqual(sorted(base.get_merge_bases(x, y)), sorted([a, b]))
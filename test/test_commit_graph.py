@@ -0,0 +1,68 @@
+import os
+import shutil
+import unittest
+from unittest import mock
+from pygit import base, commit_graph, data
+
+class TestCommitGraph(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = os.path.join(os.path.dirname(__file__), 'test_repo')
+        os.makedirs(self.test_dir, exist_ok=True)
+        os.chdir(self.test_dir)
+        data.GIT_DIR = os.path.join(self.test_dir, '.pygit')
+        base.init()
+
+    def tearDown(self):
+        os.chdir(os.path.dirname(__file__))
+        shutil.rmtree(self.test_dir)
+
+    def test_updated_on_commit(self):
+        """Test that commits are added to the graph incrementally"""
+        commits = []
+        for i in range(10):
+            with open('test.txt', 'w') as f:
+                f.write(f'version {i}')
+            base.add(['test.txt'])
+            commits.append(base.commit(f'Commit {i}'))
+
+        graph = data.get_commit_graph()
+        self.assertEqual(len(graph), 10)
+        # Small layers get merged, so the chain stays short
+        self.assertLessEqual(len(graph.layers), 4)
+        for i, oid in enumerate(commits):
+            self.assertEqual(graph.generation(oid), i + 1)
+            self.assertEqual(graph.parents(oid), commits[i - 1:i] if i else [])
+
+        # History walks don't need to parse commit objects
+        with mock.patch.object(base, 'get_commit') as get_commit:
+            walked = list(base.iter_commits_and_parents({commits[-1]}))
+        get_commit.assert_not_called()
+        self.assertEqual(walked, commits[::-1])
+
+    def test_octopus_parents(self):
+        """Test commits with more than two parents"""
+        tree = 'ab' * 20
+        roots = {f'{i:040x}': (tree, []) for i in range(1, 4)}
+        merge = {'f' * 40: (tree, list(roots))}
+        info_dir = os.path.join(data.GIT_DIR, 'objects', 'info')
+
+        commit_graph.write(info_dir, roots)
+        commit_graph.write(info_dir, merge, commit_graph.load(info_dir))
+
+        graph = commit_graph.load(info_dir)
+        self.assertEqual(graph.parents('f' * 40), list(roots))
+        self.assertEqual(graph.generation('f' * 40), 2)
+        self.assertIsNone(graph.lookup('e' * 40))
+
+    def test_write_commit_graph(self):
+        """Test writing a graph for history committed without one"""
+        with open('test.txt', 'w') as f:
+            f.write('content')
+        base.add(['test.txt'])
+        first = base.commit('First commit')
+        shutil.rmtree(os.path.join(data.GIT_DIR, 'objects', 'info'))
+        second = base.commit('Second commit')
+        self.assertIsNone(data.get_commit_graph())
+
+        self.assertEqual(base.write_commit_graph(), 2)
+        self.assertEqual(data.get_commit_graph().parents(second), [first])
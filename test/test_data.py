@@ -1,6 +1,9 @@
 import os
 import shutil
+import threading
+import time
 import unittest
+from unittest import mock
 from pygit import data
 
 class TestData(unittest.TestCase):
@@ -56,8 +59,8 @@ class TestData(unittest.TestCase):
     def test_index_operations(self):
         """Test index file operations"""
         test_data = {
-            'file1.txt': 'abc' * 13,  # 39 char dummy hash
-            'dir/file2.txt': 'def' * 13
+            'file1.txt': 'abcd' * 10,  # 40 char dummy hash
+            'dir/file2.txt': 'def0' * 10
         }
         
         # Write to index
@@ -92,6 +95,96 @@ class TestData(unittest.TestCase):
             self.assertIn(ref_name, found_refs)
             self.assertEqual(found_refs[ref_name].value, value)
 
+    def test_packed_refs(self):
+        """Test packing refs and loose refs overriding packed ones"""
+        data.update_ref('HEAD', data.RefValue(symbolic=True, value='refs/heads/master'),
+                        deref=False)
+        data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value='a' * 40))
+        data.update_ref('refs/heads/topic/x', data.RefValue(symbolic=False, value='b' * 40))
+        data.update_ref('refs/tags/v1.0', data.RefValue(symbolic=False, value='c' * 40))
+
+        self.assertEqual(data.pack_refs(), 3)
+        self.assertFalse(os.path.exists(f'{data.GIT_DIR}/refs/heads/master'))
+        self.assertFalse(os.path.exists(f'{data.GIT_DIR}/refs/heads/topic'))
+        self.assertTrue(os.path.isdir(f'{data.GIT_DIR}/refs/heads'))
+        # HEAD is symbolic and stays loose
+        self.assertEqual(data.get_ref('HEAD').value, 'a' * 40)
+        self.assertEqual(dict(data.iter_refs('refs/heads/')),
+                         {'refs/heads/master': data.RefValue(False, 'a' * 40),
+                          'refs/heads/topic/x': data.RefValue(False, 'b' * 40)})
+
+        data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value='d' * 40))
+        self.assertEqual(data.get_ref('refs/heads/master').value, 'd' * 40)
+
+        data.delete_ref('refs/tags/v1.0')
+        self.assertIsNone(data.get_ref('refs/tags/v1.0').value)
+        self.assertNotIn('refs/tags/v1.0', dict(data.iter_refs()))
+
+    def test_ref_transactions(self):
+        """Test compare-and-swap updates and all-or-nothing transactions"""
+        a, b, c = 'a' * 40, 'b' * 40, 'c' * 40
+        data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=a),
+                        old_value='')
+        data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=b),
+                        old_value=a)
+        with self.assertRaises(Exception):
+            data.update_ref('refs/heads/master', data.RefValue(symbolic=False, value=c),
+                            old_value=a)
+        self.assertEqual(data.get_ref('refs/heads/master').value, b)
+
+        with self.assertRaises(Exception):
+            with data.ref_transaction() as transaction:
+                transaction.update('refs/tags/v1', data.RefValue(symbolic=False, value=c))
+                transaction.delete('refs/heads/master', old_value=a)
+        self.assertIsNone(data.get_ref('refs/tags/v1').value)
+        self.assertEqual(data.get_ref('refs/heads/master').value, b)
+        self.assertEqual(os.listdir(f'{data.GIT_DIR}/refs/heads'), ['master'])
+
+    def test_locking(self):
+        """Test that a held lock blocks writers and index updates aren't lost"""
+        with data.LockFile(f'{data.GIT_DIR}/refs/heads/master'):
+            with mock.patch.object(data, 'LOCK_TIMEOUT', 0.05):
+                with self.assertRaises(Exception):
+                    data.update_ref('refs/heads/master',
+                                    data.RefValue(symbolic=False, value='a' * 40))
+
+        def add(i):
+            with data.get_index() as index:
+                index[f'file{i}'] = 'b' * 40
+
+        threads = [threading.Thread(target=add, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with data.get_index() as index:
+            self.assertEqual(len(index), 8)
+        self.assertFalse(os.path.exists(f'{data.GIT_DIR}/index.lock'))
+
+    def test_delete_ref_during_pack_refs(self):
+        """Test that pack_refs and ref deletions take locks in the same order"""
+        data.update_ref('refs/tags/old', data.RefValue(symbolic=False, value='a' * 40))
+        data.pack_refs()
+        errors = []
+
+        def delete():
+            try:
+                data.delete_ref('refs/tags/old')
+            except Exception as e:
+                errors.append(e)
+
+        # Like pack_refs: lock packed-refs, then the refs to pack
+        with data.LockFile(f'{data.GIT_DIR}/packed-refs'):
+            thread = threading.Thread(target=delete)
+            thread.start()
+            time.sleep(0.1)
+            with mock.patch.object(data, 'LOCK_TIMEOUT', 0.5):
+                with data.LockFile(f'{data.GIT_DIR}/refs/tags/old'):
+                    pass
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertIsNone(data.get_ref('refs/tags/old').value)
+
     def test_change_git_dir(self):
         """Test changing GIT_DIR context manager"""
         original_dir = data.GIT_DIR
@@ -100,4 +193,130 @@ class TestData(unittest.TestCase):
         with data.change_git_dir(test_dir):
             self.assertEqual(data.GIT_DIR, f'{test_dir}/.pygit')
             
-        self.assertEqual(data.GIT_DIR, original_dir)
\ No newline at end of file
+        self.assertEqual(data.GIT_DIR, original_dir)
+
+    def test_fanout_objects(self):
+        """Test compressed objects in fan-out directories"""
+        data.set_config('object_format', 'fanout')
+        oid = data.hash_object(b'fanout content')
+
+        object_path = os.path.join(data.GIT_DIR, 'objects', oid[:2], oid[2:])
+        self.assertTrue(os.path.exists(object_path))
+        self.assertTrue(data.object_exists(oid))
+        self.assertEqual(data.get_object(oid), b'fanout content')
+
+    def test_migrate_objects(self):
+        """Test converting a flat object store in place"""
+        oid = data.hash_object(b'flat content')
+        self.assertEqual(data.get_object_format(), 'flat')
+
+        self.assertEqual(data.migrate_objects(), 1)
+        self.assertEqual(data.get_object_format(), 'fanout')
+        self.assertFalse(os.path.exists(
+            os.path.join(data.GIT_DIR, 'objects', oid)))
+        self.assertEqual(data.get_object(oid), b'flat content')
+
+    def test_lru_cache(self):
+        """Test size-bounded eviction and hit/miss counters"""
+        cache = data.LRUCache(40)
+        cache.put('a', b'a' * 10, 10)
+        cache.put('b', b'b' * 10, 10)
+        self.assertEqual(cache.get('a'), b'a' * 10)
+        cache.put('c', b'c' * 10, 10)
+        cache.put('d', b'd' * 10, 10)
+        cache.put('e', b'e' * 10, 10)
+
+        # 'b' was least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'a' * 10)
+        self.assertEqual(cache.size, 40)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+        cache.resize(20)
+        self.assertEqual(len(cache), 2)
+
+    def test_object_cache(self):
+        """Test that repeated reads are served from the object cache"""
+        oid = data.hash_object(b'cached object')
+        data.get_object(oid)
+        hits = data.object_cache.hits
+        os.remove(os.path.join(data.GIT_DIR, 'objects', oid))
+        self.assertEqual(data.get_object(oid), b'cached object')
+        self.assertEqual(data.object_cache.hits, hits + 1)
+
+    def test_hash_files_parallel(self):
+        """Test that parallel hashing returns oids in input order"""
+        paths = []
+        for i in range(50):
+            path = f'file{i}.txt'
+            with open(path, 'w') as f:
+                f.write(f'content {i}')
+            paths.append(path)
+
+        with mock.patch.object(data, 'HASH_BATCH_FILES', 4):
+            oids = data.hash_files(paths, workers=4)
+        self.assertEqual(oids, [data.hash_file(path) for path in paths])
+        self.assertFalse(any(data.object_exists(oid) for oid in oids))
+
+    def test_streaming_objects(self):
+        """Test writing and reading objects in chunks"""
+        content = os.urandom(data.CHUNK_SIZE * 3 + 123)
+        with open('large.bin', 'wb') as f:
+            f.write(content)
+
+        for object_format in data.OBJECT_FORMATS:
+            data.set_config('object_format', object_format)
+            oid = data.hash_file('large.bin', write=True)
+            self.assertEqual(oid, data.hash_object(content, write=False))
+
+            data.object_cache.clear()
+            chunks = list(data.stream_object(oid))
+            self.assertGreater(len(chunks), 1)
+            self.assertEqual(b''.join(chunks), content)
+
+        # No temporary files are left behind
+        objects_dir = os.path.join(data.GIT_DIR, 'objects')
+        self.assertFalse([name for name in os.listdir(objects_dir)
+                          if name.startswith('tmp_')])
+
+    def test_binary_index(self):
+        """Test that the index is binary and only rewritten when changed"""
+        index_path = os.path.join(data.GIT_DIR, 'index')
+        with data.get_index() as index:
+            index['file.txt'] = 'abcd' * 10
+        with open(index_path, 'rb') as f:
+            self.assertTrue(f.read().startswith(data.INDEX_SIGNATURE))
+
+        mtime = os.stat(index_path).st_mtime_ns
+        os.utime(index_path, ns=(mtime - 10**9, mtime - 10**9))
+        with data.get_index() as index:
+            self.assertEqual(index['file.txt'], 'abcd' * 10)
+            index['file.txt'] = 'abcd' * 10
+        self.assertEqual(os.stat(index_path).st_mtime_ns, mtime - 10**9)
+
+    def test_index_cache_tree(self):
+        """Test that cached tree oids are stored and invalidated by path"""
+        with data.get_index() as index:
+            index['a/b/file.txt'] = 'abcd' * 10
+            index['a/other.txt'] = 'abcd' * 10
+            index['c/file.txt'] = 'abcd' * 10
+            for dirpath in ('', 'a', 'a/b', 'c'):
+                index.set_tree(dirpath, 'def0' * 10)
+
+        with data.get_index() as index:
+            self.assertEqual(set(index.trees), {'', 'a', 'a/b', 'c'})
+            index['a/b/file.txt'] = 'def0' * 10
+            self.assertEqual(index.trees, {'c': 'def0' * 10})
+
+    def test_json_index_upgrade(self):
+        """Test that old JSON indexes are read and rewritten as binary"""
+        index_path = os.path.join(data.GIT_DIR, 'index')
+        with open(index_path, 'w') as f:
+            f.write('{"a.txt": "%s"}' % ('ab' * 20))
+
+        with data.get_index() as index:
+            self.assertEqual(dict(index), {'a.txt': 'ab' * 20})
+        with open(index_path, 'rb') as f:
+            self.assertTrue(f.read().startswith(data.INDEX_SIGNATURE))
+        with data.get_index() as index:
+            self.assertEqual(dict(index), {'a.txt': 'ab' * 20})
@@ -1,6 +1,7 @@
 import os
 import shutil
 import unittest
+from unittest import mock
 from pygit import base, data, diff
 
 class TestDiff(unittest.TestCase):
@@ -85,4 +86,182 @@ class TestDiff(unittest.TestCase):
 
         tree = base.get_tree(base.get_commit(commit).tree)
         diff_output = diff.diff_trees({}, tree)
-        self.assertIn(b'Binary file', diff_output)
\ No newline at end of file
+        self.assertIn(b'Binary file', diff_output)
+
+    def test_tree_changes_skip_shared_subtrees(self):
+        """Test that subtrees with the same oid are not read"""
+        os.makedirs('shared')
+        os.makedirs('changed')
+        for path in ('shared/a.txt', 'changed/b.txt', 'top.txt'):
+            with open(path, 'w') as f:
+                f.write(path)
+        base.add(['shared', 'changed', 'top.txt'])
+        tree1 = base.get_commit(base.commit("First commit")).tree
+
+        with open('changed/b.txt', 'w') as f:
+            f.write('modified')
+        with open('changed/c.txt', 'w') as f:
+            f.write('new')
+        base.add(['changed'])
+        tree2 = base.get_commit(base.commit("Second commit")).tree
+
+        shared_oid = next(oid for type_, oid, name in base._iter_tree_entries(tree1)
+                          if name == 'shared')
+        with mock.patch.object(base, '_iter_tree_entries',
+                               wraps=base._iter_tree_entries) as read_tree:
+            changes = list(diff.iter_changed_files(tree1, tree2))
+        self.assertEqual(changes, [('changed/b.txt', 'modified'),
+                                   ('changed/c.txt', 'new file')])
+        self.assertNotIn(mock.call(shared_oid),
+                         read_tree.call_args_list)
+
+        # Flattened trees give the same changes
+        self.assertEqual(sorted(diff.iter_changed_files(base.get_tree(tree1), tree2)),
+                         changes)
+
+    def test_diff_lines(self):
+        """Test that an inserted line only changes that line"""
+        old = [f'line {i}\n'.encode() for i in range(10)]
+        new = old[:3] + [b'inserted\n'] + old[3:]
+        for algorithm in diff.DIFF_ALGORITHMS:
+            self.assertEqual(diff.diff_lines(old, new, algorithm),
+                             [(0, 0, 3), (3, 4, 7), (10, 11, 0)])
+
+        old = [b'a\n', b'b\n', b'c\n', b'a\n', b'b\n', b'b\n', b'a\n']
+        new = [b'c\n', b'b\n', b'a\n', b'b\n', b'a\n', b'c\n']
+        matched = sum(n for _, _, n in diff.diff_lines(old, new))
+        self.assertEqual(matched, 4)
+
+    def test_unified_diff(self):
+        """Test unified hunks with context"""
+        old = [f'{i}\n'.encode() for i in range(1, 21)]
+        new = old[:4] + [b'five\n'] + old[5:17] + old[18:]
+        output = b''.join(diff.unified_diff(old, new, 'a/f', 'b/f', context=1))
+        self.assertEqual(output,
+                         b'--- a/f\n+++ b/f\n'
+                         b'@@ -4,3 +4,3 @@\n 4\n-5\n+five\n 6\n'
+                         b'@@ -17,3 +17,2 @@\n 17\n-18\n 19\n')
+
+        output = b''.join(diff.unified_diff([], [b'new'], '/dev/null', 'b/f'))
+        self.assertEqual(output,
+                         b'--- /dev/null\n+++ b/f\n@@ -0,0 +1 @@\n'
+                         b'+new\n\\ No newline at end of file\n')
+
+    def test_unified_diff_trees(self):
+        """Test unified output of diff_trees"""
+        with open('file1.txt', 'w') as f:
+            f.write('a\nb\nc\n')
+        base.add(['file1.txt'])
+        tree1 = base.get_commit(base.commit("First commit")).tree
+
+        with open('file1.txt', 'w') as f:
+            f.write('a\nB\nc\n')
+        base.add(['file1.txt'])
+        tree2 = base.get_commit(base.commit("Second commit")).tree
+
+        output = diff.diff_trees(tree1, tree2, unified=0)
+        self.assertIn(b'diff --git a/file1.txt b/file1.txt\n', output)
+        self.assertIn(b'@@ -2 +2 @@\n-b\n+B\n', output)
+
+    def test_binary_detection_by_content(self):
+        """Test that text and binary files are told apart by content"""
+        files = {'Makefile': b'all:\n\techo hi\n',
+                 'schema.proto': 'message Café {}\n'.encode(),
+                 'image.txt': b'\x89PNG\r\n\x1a\n\x00\x00',
+                 'latin1.md': b'caf\xe9\n'}
+        for path, content in files.items():
+            with open(path, 'wb') as f:
+                f.write(content)
+        base.add(list(files))
+        tree = base.get_tree(base.get_commit(base.commit("Add files")).tree)
+
+        for path, binary in (('Makefile', False), ('schema.proto', False),
+                             ('image.txt', True), ('latin1.md', True)):
+            self.assertEqual(diff.blob_info(tree[path]), (binary, len(files[path])))
+
+        output = diff.diff_trees({}, tree)
+        self.assertIn(b'echo hi', output)
+        self.assertEqual(output.count(b'Binary file'), 2)
+
+        # Results are cached per blob
+        with mock.patch.object(data, 'stream_object') as stream_object:
+            diff.blob_info(tree['Makefile'])
+        stream_object.assert_not_called()
+
+    def test_large_file_summarized(self):
+        """Test that files above the size limit are not diffed"""
+        with open('big.csv', 'w') as f:
+            f.write('a,b\n' * 100)
+        base.add(['big.csv'])
+        tree = base.get_tree(base.get_commit(base.commit("Add file")).tree)
+
+        with mock.patch.object(diff, 'DIFF_MAX_BYTES', 100):
+            data.parsed_cache.clear()
+            output = diff.diff_trees({}, tree, unified=3)
+        data.parsed_cache.clear()
+        self.assertIn(b'larger than 100 bytes', output)
+        self.assertNotIn(b'a,b', output)
+
+    def test_name_only_and_stat(self):
+        """Test diff summaries, and that names need no blob contents"""
+        with open('file1.txt', 'w') as f:
+            f.write('a\nb\nc\n')
+        base.add(['file1.txt'])
+        tree1 = base.get_commit(base.commit("First commit")).tree
+
+        with open('file1.txt', 'w') as f:
+            f.write('a\nB\nc\nd\n')
+        with open('file2.txt', 'w') as f:
+            f.write('new\n')
+        base.add(['file1.txt', 'file2.txt'])
+        tree2 = base.get_commit(base.commit("Second commit")).tree
+
+        data.object_cache.clear()
+        with mock.patch.object(data, 'get_object', wraps=data.get_object) as get_object:
+            names = b''.join(diff.iter_name_only(tree1, tree2))
+        self.assertEqual(names, b'file1.txt\nfile2.txt\n')
+        self.assertFalse([call for call in get_object.call_args_list
+                          if call.args[1:] != ('tree',)])
+
+        stat = b''.join(diff.iter_stat(tree1, tree2))
+        self.assertEqual(stat,
+                         b' file1.txt | 3 ++-\n'
+                         b' file2.txt | 1 +\n'
+                         b' 2 files changed, 3 insertions(+), 1 deletions(-)\n')
+
+        # The streamed chunks add up to the whole diff
+        self.assertEqual(b''.join(diff.iter_diff(tree1, tree2, unified=3)),
+                         diff.diff_trees(tree1, tree2, unified=3))
+
+    def test_merge_blobs_line_level(self):
+        """Test that changes to different lines merge without conflicts"""
+        base_oid = data.hash_object(b'1\n2\n3\n4\n5\n6\n')
+        ours = data.hash_object(b'one\n2\n3\n4\n5\n6\n')
+        theirs = data.hash_object(b'1\n2\n3\n4\n5\nsix\n')
+        self.assertEqual(diff.merge_blobs(base_oid, ours, theirs),
+                         b'one\n2\n3\n4\n5\nsix\n')
+
+        theirs = data.hash_object(b'uno\n2\n3\n4\n5\n6\n')
+        self.assertEqual(diff.merge_blobs(base_oid, ours, theirs),
+                         b'<<<<<<< HEAD\none\n=======\nuno\n>>>>>>>\n'
+                         b'2\n3\n4\n5\n6\n')
+
+    def test_merge_trees_passes_agreeing_paths_through(self):
+        """Test that only paths changed on both sides are read"""
+        base_tree = {'same': data.hash_object(b'same\n'),
+                     'ours': data.hash_object(b'base\n'),
+                     'both': data.hash_object(b'a\nb\nc\n'),
+                     'gone': data.hash_object(b'gone\n')}
+        head_tree = dict(base_tree, ours=data.hash_object(b'changed\n'),
+                         both=data.hash_object(b'A\nb\nc\n'))
+        del head_tree['gone']
+        other_tree = dict(base_tree, both=data.hash_object(b'a\nb\nC\n'))
+
+        with mock.patch.object(data, 'get_object', wraps=data.get_object) as get_object:
+            merged = diff.merge_trees(base_tree, head_tree, other_tree)
+        read = {call.args[0] for call in get_object.call_args_list}
+        self.assertEqual(read, {base_tree['both'], head_tree['both'],
+                                other_tree['both']})
+        self.assertEqual(set(merged), {'same', 'ours', 'both'})
+        self.assertEqual(merged['ours'], head_tree['ours'])
+        self.assertEqual(data.get_object(merged['both']), b'A\nb\nC\n')
@@ -1,7 +1,7 @@
 import os
 import shutil
 import unittest
-from pygit import base, data
+from pygit import base, data, ignore
 
 class TestIgnore(unittest.TestCase):
     def setUp(self):
@@ -52,4 +52,51 @@ class TestIgnore(unittest.TestCase):
         # Check working tree
         working_tree = base.get_working_tree()
         self.assertNotIn('test.log', working_tree)
-        self.assertIn('test.txt', working_tree) 
\ No newline at end of file
+        self.assertIn('test.txt', working_tree)
+
+    def test_gitignore_semantics(self):
+        """Test negation, anchoring and ** patterns"""
+        with open('.pygitignore', 'w') as f:
+            f.write('*.log\n')
+            f.write('!keep.log\n')
+            f.write('/build\n')
+            f.write('docs/**/*.tmp\n')
+            f.write('**/cache/\n')
+
+        self.assertTrue(base.is_ignored('sub/debug.log'))
+        self.assertFalse(base.is_ignored('sub/keep.log'))
+        self.assertTrue(base.is_ignored('build/out.o'))
+        self.assertFalse(base.is_ignored('src/build/out.o'))
+        self.assertTrue(base.is_ignored('docs/a/b/page.tmp'))
+        self.assertTrue(base.is_ignored('docs/page.tmp'))
+        self.assertFalse(base.is_ignored('src/page.tmp'))
+        self.assertTrue(base.is_ignored('a/b/cache/data.bin'))
+        # A file named like a directory-only pattern isn't matched
+        self.assertFalse(ignore.is_ignored('cache', is_dir=False))
+
+    def test_nested_ignore_files(self):
+        """Test that deeper ignore files apply to their directory and win"""
+        os.makedirs('sub')
+        with open('.pygitignore', 'w') as f:
+            f.write('*.txt\n')
+        with open(os.path.join('sub', '.pygitignore'), 'w') as f:
+            f.write('!wanted.txt\n/local.bin\n')
+
+        self.assertTrue(base.is_ignored('other.txt'))
+        self.assertFalse(base.is_ignored('sub/wanted.txt'))
+        self.assertTrue(base.is_ignored('sub/local.bin'))
+        self.assertFalse(base.is_ignored('local.bin'))
+
+    def test_walk_prunes_ignored_directories(self):
+        """Test that ignored directories are not descended into"""
+        os.makedirs(os.path.join('node_modules', 'pkg'))
+        with open(os.path.join('node_modules', 'pkg', 'index.js'), 'w') as f:
+            f.write('ignored')
+        with open('main.js', 'w') as f:
+            f.write('tracked')
+        with open('.pygitignore', 'w') as f:
+            f.write('node_modules/\n')
+
+        roots = [os.path.normpath(root) for root, _, _ in ignore.walk('.')]
+        self.assertEqual(roots, ['.'])
+        self.assertIn('main.js', base.get_working_tree())
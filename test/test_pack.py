@@ -0,0 +1,57 @@
+import os
+import shutil
+import unittest
+from pygit import base, data, pack
+
+class TestPack(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = os.path.join(os.path.dirname(__file__), 'test_repo')
+        os.makedirs(self.test_dir, exist_ok=True)
+        os.chdir(self.test_dir)
+        data.GIT_DIR = os.path.join(self.test_dir, '.pygit')
+        base.init()
+
+    def tearDown(self):
+        os.chdir(os.path.dirname(__file__))
+        shutil.rmtree(self.test_dir)
+
+    def test_delta_round_trip(self):
+        """Test that applying a delta reproduces the target"""
+        base_content = b''.join(b'line %d\n' % i for i in range(1000))
+        target = base_content.replace(b'line 500\n', b'changed\n') + b'tail\n'
+
+        delta = pack.create_delta(base_content, target)
+        self.assertLess(len(delta), len(target) // 10)
+        self.assertEqual(pack.apply_delta(base_content, delta), target)
+
+    def test_pack_reachable_objects(self):
+        """Test packing objects and reading them back from the pack"""
+        lines = [b'line %d\n' % i for i in range(1000)]
+        with open('big.txt', 'wb') as f:
+            f.write(b''.join(lines))
+        base.add(['big.txt'])
+        first = base.commit('First commit')
+
+        lines[500] = b'changed\n'
+        with open('big.txt', 'wb') as f:
+            f.write(b''.join(lines))
+        base.add(['big.txt'])
+        second = base.commit('Second commit')
+
+        objects = list(base.iter_objects_in_commits({second}))
+        contents = {oid: data.get_object(oid, expected=None) for oid in objects}
+        self.assertEqual(base.pack_objects(), len(objects))
+
+        # Loose copies are gone, everything is served from the pack
+        packs = os.listdir(os.path.join(data.GIT_DIR, 'objects', 'pack'))
+        self.assertEqual(len(packs), 2)
+        for oid, content in contents.items():
+            self.assertFalse(os.path.exists(
+                os.path.join(data.GIT_DIR, 'objects', oid[:2], oid[2:])))
+            self.assertTrue(data.object_exists(oid))
+            self.assertEqual(data.get_object(oid, expected=None), content)
+
+        self.assertEqual(base.get_commit(second).parents, (first,))
+        self.assertFalse(data.object_exists('0' * 40))
+        # Nothing is left to pack
+        self.assertEqual(base.pack_objects(), 0)
@@ -1,6 +1,7 @@
 import os
 import shutil
 import unittest
+from unittest import mock
 from pygit import base, data, remote
 
 class TestRemote(unittest.TestCase):
@@ -43,6 +44,40 @@ class TestRemote(unittest.TestCase):
         # Check commit history
         self.assertEqual(base.get_oid('@'), source_commit)
 
+    def test_clone_links_objects_without_rehashing(self):
+        """Test that clone shares object files and checks out from the tree"""
+        os.chdir(self.source_dir)
+        os.makedirs('dir')
+        with open('dir/a.txt', 'w') as f:
+            f.write('a')
+        base.add(['dir'])
+        base.commit('Initial commit')
+        with open('untracked.txt', 'w') as f:
+            f.write('not committed')
+
+        with mock.patch.object(data, 'hash_file') as hash_file:
+            remote.clone(self.source_dir, self.target_dir)
+        hash_file.assert_not_called()
+
+        os.chdir(self.target_dir)
+        data.GIT_DIR = os.path.join(self.target_dir, '.pygit')
+        self.assertFalse(os.path.exists('untracked.txt'))
+        with open('dir/a.txt') as f:
+            self.assertEqual(f.read(), 'a')
+
+        source_objects = os.path.join(self.source_dir, '.pygit', 'objects')
+        for root, _, files in os.walk(source_objects):
+            for name in files:
+                target = os.path.join(data.GIT_DIR, 'objects',
+                                      os.path.relpath(root, source_objects), name)
+                self.assertTrue(os.path.exists(target))
+
+        st = os.stat('dir/a.txt')
+        with data.get_index() as index:
+            self.assertEqual(index.stat['dir/a.txt'],
+                             (st.st_mtime_ns, st.st_ctime_ns, st.st_size,
+                              st.st_ino, st.st_mode))
+
     def test_push_and_fetch(self):
         """Test pushing and fetching changes"""
         # Create target repo
@@ -81,4 +116,90 @@ class TestRemote(unittest.TestCase):
         remote.fetch(self.target_dir)
         
         # Verify fetch
-        self.assertTrue(data.object_exists(target_commit))
\ No newline at end of file
+        self.assertTrue(data.object_exists(target_commit))
+
+    def test_fetch_only_transfers_missing_objects(self):
+        """Test that a second fetch only copies what is new"""
+        os.makedirs('dir')
+        for path in ('dir/a.txt', 'dir/b.txt', 'c.txt'):
+            with open(path, 'w') as f:
+                f.write(path)
+        base.add(['dir', 'c.txt'])
+        base.commit("First commit")
+
+        os.makedirs(self.target_dir)
+        os.chdir(self.target_dir)
+        data.GIT_DIR = os.path.join(self.target_dir, '.pygit')
+        base.init()
+        remote.fetch(self.source_dir)
+        first = data.get_ref('refs/remotes/origin/master').value
+        self.assertEqual(sorted(base.get_tree(base.get_commit(first).tree)),
+                         ['c.txt', 'dir/a.txt', 'dir/b.txt'])
+
+        os.chdir(self.source_dir)
+        data.GIT_DIR = os.path.join(self.source_dir, '.pygit')
+        with open('dir/a.txt', 'w') as f:
+            f.write('changed')
+        base.add(['dir/a.txt'])
+        second = base.commit("Second commit")
+
+        os.chdir(self.target_dir)
+        data.GIT_DIR = os.path.join(self.target_dir, '.pygit')
+        with mock.patch.object(data, 'fetch_objects',
+                               wraps=data.fetch_objects) as fetch_objects, \
+             mock.patch.object(data, 'fetch_object_if_missing',
+                               wraps=data.fetch_object_if_missing) as fetch_object:
+            remote.fetch(self.source_dir)
+
+        # The changed blob, then the root tree, dir and the new commit
+        self.assertEqual(len(fetch_objects.call_args.args[0]), 1)
+        self.assertEqual(fetch_object.call_count, 3)
+        self.assertEqual(data.get_ref('refs/remotes/origin/master').value, second)
+        with open(os.path.join(self.source_dir, 'dir/a.txt'), 'rb') as f:
+            content = f.read()
+        tree = base.get_tree(base.get_commit(second).tree)
+        self.assertEqual(data.get_object(tree['dir/a.txt']), content)
+
+    def test_incremental_push(self):
+        """Test that a second push only sends and writes what changed"""
+        os.makedirs(self.target_dir)
+        os.chdir(self.target_dir)
+        data.GIT_DIR = os.path.join(self.target_dir, '.pygit')
+        base.init()
+
+        os.chdir(self.source_dir)
+        data.GIT_DIR = os.path.join(self.source_dir, '.pygit')
+        os.makedirs('dir')
+        for path in ('dir/a.txt', 'b.txt', 'c.txt'):
+            with open(path, 'w') as f:
+                f.write(path)
+        base.add(['dir', 'b.txt', 'c.txt'])
+        base.commit("First commit")
+        remote.push(self.target_dir, 'refs/heads/master')
+
+        with open('b.txt', 'w') as f:
+            f.write('changed')
+        os.remove('c.txt')
+        with data.get_index() as index:
+            del index['c.txt']
+        base.add(['b.txt'])
+        second = base.commit("Second commit")
+
+        unchanged = os.path.join(self.target_dir, 'dir/a.txt')
+        mtime = os.stat(unchanged).st_mtime_ns
+        os.utime(unchanged, ns=(mtime - 10**9, mtime - 10**9))
+        with mock.patch.object(data, 'object_exists',
+                               wraps=data.object_exists) as object_exists:
+            remote.push(self.target_dir, 'refs/heads/master')
+        # Only the new commit and its parent, the root tree, dir and b.txt are
+        # looked up; nothing below dir is visited
+        checked = {call.args[0] for call in object_exists.call_args_list}
+        self.assertEqual(len(checked), 5)
+
+        self.assertEqual(os.stat(unchanged).st_mtime_ns, mtime - 10**9)
+        self.assertFalse(os.path.exists(os.path.join(self.target_dir, 'c.txt')))
+        with open(os.path.join(self.target_dir, 'b.txt')) as f:
+            self.assertEqual(f.read(), 'changed')
+        with data.change_git_dir(self.target_dir):
+            self.assertEqual(data.get_ref('refs/heads/master').value, second)
+            self.assertEqual(set(base.get_index_tree()), {'dir/a.txt', 'b.txt'})
@@ -1,6 +1,7 @@
 import os
 import shutil
 import unittest
+from unittest import mock
 from pygit import base, data
 
 class TestStatus(unittest.TestCase):
@@ -65,4 +66,36 @@ class TestStatus(unittest.TestCase):
 
         # Check working tree
         working_tree = base.get_working_tree()
-        self.assertNotIn('delete.txt', working_tree) 
\ No newline at end of file
+        self.assertNotIn('delete.txt', working_tree)
+
+    def test_unchanged_files_not_rehashed(self):
+        """Test that files with matching stat data reuse the index oid"""
+        with open('cached.txt', 'w') as f:
+            f.write('cached content')
+        # Backdate the file so its entry is not racily clean
+        os.utime('cached.txt', ns=(10**18, 10**18))
+        base.add(['cached.txt'])
+
+        with mock.patch.object(data, 'hash_file',
+                               wraps=data.hash_file) as hash_file:
+            working_tree = base.get_working_tree()
+        hash_file.assert_not_called()
+        self.assertEqual(working_tree['cached.txt'],
+                         base.get_index_tree()['cached.txt'])
+
+        # Changing the file invalidates the stat data
+        with open('cached.txt', 'w') as f:
+            f.write('changed content')
+        working_tree = base.get_working_tree()
+        self.assertNotEqual(working_tree['cached.txt'],
+                            base.get_index_tree()['cached.txt'])
+
+    def test_status_does_not_write_objects(self):
+        """Test that scanning the working tree stores no objects"""
+        with open('scanned.txt', 'w') as f:
+            f.write('scanned content')
+
+        working_tree = base.get_working_tree()
+        self.assertEqual(working_tree['scanned.txt'],
+                         data.hash_object(b'scanned content', write=False))
+        self.assertFalse(data.object_exists(working_tree['scanned.txt']))